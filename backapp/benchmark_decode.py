@@ -0,0 +1,117 @@
+"""
+Benchmarks full decoding vs reduced-resolution (draft/reduce) decoding for typical phone images.
+
+Each case runs in a fresh subprocess so peak RSS reflects only that decode path (Linux only).
+
+    python benchmark_decode.py --repeat 5
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+# (name, size, format) - typical camera and screenshot inputs
+CASES = [
+    ("12MP landscape JPEG", (4032, 3024), "JPEG"),
+    ("12MP portrait JPEG", (3024, 4032), "JPEG"),
+    ("50MP JPEG", (8160, 6120), "JPEG"),
+    ("FullHD JPEG", (1920, 1080), "JPEG"),
+    ("Phone screenshot PNG", (1170, 2532), "PNG"),
+]
+
+PATHS = {
+    "model": {"max_edge": 1536},
+    "embedding": {"min_edge": 256, "mode": "RGB"},
+}
+
+
+def make_photo(size, fmt) -> bytes:
+    """Smooth gradients plus sensor-like noise, so JPEG sizes resemble real photos."""
+    w, h = size
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 255, (max(1, h // 64), max(1, w // 64), 3), dtype=np.uint8)
+    img = Image.fromarray(base).resize((w, h), Image.Resampling.BILINEAR)
+    noise = rng.normal(0, 6, (h, w, 3))
+    pixels = np.clip(np.asarray(img, dtype=np.int16) + noise, 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format=fmt, quality=92)
+    return buf.getvalue()
+
+
+def peak_rss_kb() -> int:
+    """High-water RSS of this process (VmHWM resets on exec, unlike ru_maxrss)."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return 0
+
+
+def run_child(path: str, pipeline: str, method: str, repeat: int):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from services.image_utils import decode_image
+
+    with open(path, "rb") as f:
+        data = f.read()
+    baseline = peak_rss_kb()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        if method == "full":
+            img = Image.open(io.BytesIO(data))
+            img.load()
+            if pipeline == "embedding":
+                img = img.convert("RGB")
+            else:
+                img.thumbnail((PATHS["model"]["max_edge"],) * 2, Image.Resampling.LANCZOS, reducing_gap=None)
+        else:
+            img = decode_image(data, **PATHS[pipeline])
+            img.load()
+        timings.append(time.perf_counter() - start)
+        size = img.size
+        del img
+
+    peak = peak_rss_kb()
+    print(json.dumps({
+        "median_ms": round(sorted(timings)[len(timings) // 2] * 1000, 1),
+        "peak_mb": round((peak - baseline) / 1024, 1),
+        "output": list(size),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode time and peak memory: full vs draft decoding")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--child", nargs=3, metavar=("PATH", "PIPELINE", "METHOD"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child, args.repeat)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'image':<22}{'pipeline':<11}{'method':<7}{'ms':>9}{'peak MB':>9}  output")
+        for name, size, fmt in CASES:
+            path = os.path.join(tmp, f"{size[0]}x{size[1]}.{fmt.lower()}")
+            with open(path, "wb") as f:
+                f.write(make_photo(size, fmt))
+            for pipeline in PATHS:
+                for method in ("full", "draft"):
+                    out = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), "--repeat", str(args.repeat), "--child", path, pipeline, method],
+                        capture_output=True, text=True, check=True
+                    )
+                    row = json.loads(out.stdout.strip().splitlines()[-1])
+                    print(f"{name:<22}{pipeline:<11}{method:<7}{row['median_ms']:>9}{row['peak_mb']:>9}  {row['output']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Offline load test for /verify, /price and /details.
+
+Starts the local provider stand-ins from stub_providers.py, launches the
+FastAPI app in a subprocess pointed at them, and drives each endpoint at
+increasing concurrency. Reports throughput and p50/p95/p99 latency.
+
+Example:
+    python load_test.py --concurrency 1,4,16 --requests 32 --latency 1.5 --error-rate 0.05
+"""
+import argparse
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image, ImageDraw
+
+from stub_providers import add_stub_arguments, start_stubs
+
+
+def make_test_image(label: str, size=(1200, 1600)) -> bytes:
+    # Layout is derived from the label so front/back differ enough to pass the duplicate check
+    rng = random.Random(label)
+    img = Image.new("RGB", size, color=(200, 170, 60))
+    draw = ImageDraw.Draw(img)
+    for _ in range(6):
+        x, y = rng.randrange(0, size[0] - 300), rng.randrange(0, size[1] - 300)
+        color = tuple(rng.randrange(0, 256) for _ in range(3))
+        draw.rectangle([x, y, x + rng.randrange(100, 300), y + rng.randrange(100, 300)], fill=color)
+    draw.text((150, 200), label, fill="white")
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def start_app(port: int, gemini_url: str, serpapi_url: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "GEMINI_API_KEY": "stub-key",
+        "GEMINI_API_ENDPOINT": gemini_url,
+        "SEARCH_API_KEY": "stub-key",
+        "SERPAPI_BASE_URL": serpapi_url,
+        "DUCKDUCKGO_ENABLED": "0",
+        # Stub thumbnails are served from 127.0.0.1
+        "IMAGE_FETCH_ALLOW_PRIVATE": "1",
+    })
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 180  # model weights load on import
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("App exited during startup")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                return proc
+        except requests.RequestException:
+            time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError("App did not start in time")
+
+
+def run_level(base_url: str, endpoint: str, concurrency: int, total: int, files: list, timeout: float) -> dict:
+    latencies = []
+    statuses = {}
+
+    def one_call(_):
+        start = time.perf_counter()
+        try:
+            response = requests.post(f"{base_url}{endpoint}", files=files, timeout=timeout)
+            status = response.status_code
+        except requests.RequestException:
+            status = "timeout"
+        return time.perf_counter() - start, status
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for elapsed, status in pool.map(one_call, range(total)):
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+    wall = time.perf_counter() - wall_start
+
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": total,
+        "throughput_rps": round(total / wall, 2) if wall else 0.0,
+        "p50_s": round(percentile(latencies, 50), 3),
+        "p95_s": round(percentile(latencies, 95), 3),
+        "p99_s": round(percentile(latencies, 99), 3),
+        "statuses": statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test against local provider stubs")
+    add_stub_arguments(parser)
+    parser.add_argument("--app-port", type=int, default=8800)
+    parser.add_argument("--endpoints", default="/verify,/price,/details")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=16, help="Requests per endpoint per level")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    gemini, serpapi = start_stubs(args)
+    app = start_app(args.app_port, gemini.url, serpapi.url)
+    base_url = f"http://127.0.0.1:{args.app_port}"
+
+    files = [
+        ("front_image", ("front.jpg", make_test_image("FRONT VIEW"), "image/jpeg")),
+        ("back_image", ("back.jpg", make_test_image("BACK VIEW"), "image/jpeg")),
+    ]
+
+    results = []
+    try:
+        print(f"{'endpoint':<10}{'conc':>6}{'reqs':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}  statuses")
+        for level in [int(c) for c in args.concurrency.split(",")]:
+            for endpoint in args.endpoints.split(","):
+                row = run_level(base_url, endpoint, level, args.requests, files, args.timeout)
+                results.append(row)
+                print(f"{row['endpoint']:<10}{row['concurrency']:>6}{row['requests']:>6}"
+                      f"{row['throughput_rps']:>9}{row['p50_s']:>9}{row['p95_s']:>9}{row['p99_s']:>9}  {row['statuses']}")
+    finally:
+        app.terminate()
+        app.wait(timeout=10)
+        gemini.stop()
+        serpapi.stop()
+
+    print()
+    for stub in (gemini, serpapi):
+        print(f"{stub.kind} stub calls: {stub.config.calls} (429s: {stub.config.throttled})")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import asyncio
 import requests
 from dotenv import load_dotenv
 
@@ -8,10 +9,59 @@ load_dotenv()
 from services.gemini_service import gemini_service
 from services.search_service import search_service
 from services.verification_service import verification_service
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from services.upload_service import upload_service, UploadLimitMiddleware
+from services.typosquat_service import typosquat_service
+from services.barcode_service import barcode_service
+from services.ingredient_screener import ingredient_screener
+from services.quality_service import quality_service
+from services.video_service import video_service
+from services.reference_service import reference_service
+from services.price_ranker import price_ranker
+from services.image_pool import image_pool
+from services.circuit_breaker import breakers, CircuitOpenError, track_degradation
+from services.deadline import DeadlineMiddleware, DeadlineExceeded
+from services import admission
+from services.compression import CompressionMiddleware
+from services.subscription_service import subscription_service, Caller
+from services.history_service import history_service
+from services.price_refresher import price_refresher
+from services.page_fetcher import page_fetcher
+from services.regions import parse_regions, DEFAULT_REGIONS
+from services.response_models import (
+    respond, as_list, FastJSONResponse, VerifyResponse, ProductInfo, VerificationResult, ForensicSummary, PriceResponse, PriceEntry, DetailsResponse
+)
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, UploadFile, File, HTTPException, Depends, Header
+from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start and warm the image worker processes before accepting traffic
+    await run_in_threadpool(image_pool.start)
+    price_refresher.start()
+    yield
+    await price_refresher.stop()
+    image_pool.shutdown()
+    # Write out scans still waiting in the history queue
+    await run_in_threadpool(history_service.shutdown)
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+# Per-endpoint concurrency limits and priority queues (paid tier first); see services/admission.py.
+# Runs inside the deadline so queue time counts against it.
+app.add_middleware(admission.AdmissionController)
+
+# 413 for bodies over the upload caps, from Content-Length or while streaming, before admission queues them
+app.add_middleware(UploadLimitMiddleware)
+
+# Per-request deadline from the X-Request-Timeout header (capped); see services/deadline.py.
+# Added before CORS so that 504s still carry CORS headers.
+app.add_middleware(DeadlineMiddleware)
+
+# Brotli / gzip for JSON bodies over COMPRESS_MIN_BYTES
+app.add_middleware(CompressionMiddleware)
 
 # CORS for development
 app.add_middleware(
@@ -22,128 +72,352 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    # No local fallback for this endpoint: fail fast instead of waiting out retries and timeouts
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc), "provider": exc.provider},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))}
+    )
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
 @app.get("/")
 def root():
     return {"message": "Product Verification API"}
 
+@app.get("/health/gemini")
+def gemini_health():
+    """Per-client health of the Gemini key/model pool (calls, 429s, latency, ejections)."""
+    provider = gemini_service.provider
+    return {"clients": provider.stats() if hasattr(provider, "stats") else []}
+
+@app.get("/health/providers")
+def providers_health():
+    """Circuit breaker state per external provider (closed / open / half_open)."""
+    return {"breakers": [breaker.snapshot() for breaker in breakers.values()]}
+
+@app.get("/health/admission")
+def admission_health():
+    """Queue depth, in-flight requests, wait-time percentiles and shed counts per endpoint."""
+    return {"lanes": admission.snapshot()}
+
+@app.get("/health/history")
+def history_health():
+    """Scan history write-behind queue: pending scans, batches written, retries and drops."""
+    return history_service.snapshot()
+
+@app.get("/health/prices")
+def prices_health():
+    """Price cache hits/misses, background refresh counts, the most requested products and retailer page fetches."""
+    return {**price_refresher.snapshot(), "pages": page_fetcher.snapshot()}
+
+async def current_caller(request: Request) -> Caller:
+    # Admission control already looked the caller up for POST endpoints
+    caller = getattr(request.state, "caller", None)
+    if caller is None:
+        caller = await run_in_threadpool(subscription_service.caller, request.headers.get("authorization"))
+    return caller
+
+@app.get("/history")
+async def scan_history(
+    intent: str = None,
+    input_type: str = None,
+    verdict: str = None,
+    since: str = None,
+    until: str = None,
+    cursor: str = None,
+    limit: int = 20,
+    fields: str = None,
+    verbose: bool = False,
+    caller: Caller = Depends(current_caller)
+):
+    """
+    The caller's scans, newest first, with their result and cheapest price.
+    Filters: intent (verify / price / details), input_type, verdict (Genuine / Fake / Uncertain)
+    and since / until (ISO dates, until inclusive). Pages with `cursor=` from the previous
+    page's `next_cursor`; `verbose=true` includes each scan's stored response.
+    """
+    if not caller.user_id:
+        raise HTTPException(status_code=401, detail="Sign in to see your scan history")
+    page = await run_in_threadpool(history_service.page, caller.user_id, intent, input_type, verdict,
+                                   since, until, cursor, limit, verbose)
+    return respond(page, fields)
+
+@app.get("/stats")
+async def scan_stats(days: int = 30, fields: str = None, caller: Caller = Depends(current_caller)):
+    """
+    Dashboard counts for the caller: scans per intent and Genuine / Fake / Uncertain results,
+    all time and per UTC day over the last `days` days (max 366). Read from rollup tables
+    maintained as scans are written, so the cost does not grow with the history.
+    """
+    if not caller.user_id:
+        raise HTTPException(status_code=401, detail="Sign in to see your scan stats")
+    return respond(await run_in_threadpool(history_service.stats, caller.user_id, days), fields)
+
 @app.post("/verify")
 async def verify_product(
     file: UploadFile = File(None), 
     front_image: UploadFile = File(None), 
-    back_image: UploadFile = File(None)
+    back_image: UploadFile = File(None),
+    fields: str = None,
+    verbose: bool = False,
+    caller: Caller = Depends(current_caller),
+    x_input_type: str = Header(None),
+    x_image_url: str = Header(None)
 ):
     """
     Verifies product authenticity using Chain-of-Thought Gemini analysis.
     Works across all product categories without needing reference images or datasets.
     Supports optional Front and Back images for better accuracy.
+    `verbose=true` includes the model's full forensic output; `fields=` trims the response.
+    Signed-in scans are saved to history (X-Input-Type / X-Image-Url describe the scan).
     """
-    images_data = []
-    filenames = []
-    
-    # helper to process upload
-    async def add_image(upload_file):
-        if upload_file:
-            content = await upload_file.read()
-            images_data.append(content)
-            filenames.append(upload_file.filename)
-
-    await add_image(file)
-    await add_image(front_image)
-    await add_image(back_image)
-    
+    async with upload_service.ingest([file, front_image, back_image]) as (images_data, filenames):
+        result = await _verify(images_data, filenames, verbose)
+        history_service.record(caller.user_id, "verify", result, x_input_type, x_image_url)
+        return respond(result, fields)
+
+async def _verify(images_data: list[bytes], filenames: list[str], verbose: bool = False) -> VerifyResponse:
     print(f"Received CoT verification request for: {filenames}")
+    degraded = track_degradation()
     
     if not images_data:
         raise HTTPException(status_code=400, detail="At least one image (file, front_image, or back_image) must be provided")
     
+    # Blurry / dark / tiny / duplicate photos are rejected before any model call
+    await run_in_threadpool(quality_service.check, images_data, filenames)
+
     try:
+        # Barcode decoding runs alongside the verdict; bad GS1 check digits become anomalies
+        barcode_scan = asyncio.ensure_future(run_in_threadpool(barcode_service.scan, images_data))
+        # Banned/hazardous ingredients are screened locally and merged into the health audit
+        ingredient_scan = asyncio.ensure_future(run_in_threadpool(ingredient_screener.screen_images, images_data))
+
+        # Blatant logo typosquats are found locally; they send Gemini straight to the full forensic tier
+        typosquat_hint = await run_in_threadpool(typosquat_service.check, images_data)
+        # Nothing else decodes the uploads in this process once the barcode and label scans finish
+        asyncio.ensure_future(upload_service.release_decode(barcode_scan, ingredient_scan))
         # Use the new CoT verification method
         print("Running Chain-of-Thought verification...")
-        cot_result = gemini_service.verify_product_authenticity(images_data)
+        # Blocking model + image work runs off the event loop
+        try:
+            cot_result = await run_in_threadpool(gemini_service.verify_product_authenticity, images_data, typosquat_hint)
+        except CircuitOpenError as e:
+            # Gemini is down or out of quota: answer from local checks + reference embeddings
+            print(f"Verification degraded: {e}")
+            gtin = barcode_service.primary_gtin(await barcode_scan)
+            # An unconfirmed identification is still a better reference query than none
+            product_name = await run_in_threadpool(barcode_service.index.hint, gtin) if gtin else None
+            cot_result = await run_in_threadpool(reference_service.fallback_verification, images_data, product_name)
         
         # Check for errors in the CoT result
         if "error" in cot_result and cot_result.get("verification", {}).get("is_authentic_guess") == "Error":
             print(f"Verification error: {cot_result.get('error')}")
             # Don't raise exception - return the error structure for frontend to handle
         
+        barcode_flags = barcode_service.anomalies(await barcode_scan)
+        if barcode_flags:
+            verification = cot_result.setdefault("verification", {})
+            verification["anomalies_detected"] = as_list(verification.get("anomalies_detected")) + [f["observation"] for f in barcode_flags]
+            raw = cot_result.get("raw_forensic_analysis")
+            raw = cot_result["raw_forensic_analysis"] = raw if isinstance(raw, dict) else {}
+            raw["forensic_flags"] = as_list(raw.get("forensic_flags")) + barcode_flags
+        typosquat_service.merge_into(cot_result, typosquat_hint)
+        ingredient_screener.merge_into(cot_result, await ingredient_scan)
+
         # Extract verification details
         product_info = cot_result.get("product_info", {})
         verification = cot_result.get("verification", {})
         
         # Format the response
-        result = {
-            "filename": ", ".join(filenames),
-            "product_info": {
-                "brand": product_info.get("brand", "Unknown"),
-                "model": product_info.get("model", "Unknown"),
-                "category": product_info.get("category", "Unknown")
-            },
-            "verification_result": {
-                "is_authentic": verification.get("is_authentic_guess") == "Authentic",
-                "verdict": verification.get("is_authentic_guess", "Error"),
-                "confidence_score": verification.get("confidence_score", 0) / 100,  # Convert to 0-1 scale
-                "anomalies": verification.get("anomalies_detected", []),
-                "reasoning": verification.get("detailed_reasoning", "No analysis available"),
-                "method": "Chain-of-Thought (CoT) Forensic Analysis"
-            },
-            "raw_forensic_analysis": cot_result.get("raw_forensic_analysis", {})
-        }
+        raw = cot_result.get("raw_forensic_analysis", {})
+        result = VerifyResponse(
+            filename=", ".join(filenames),
+            product_info=ProductInfo(
+                brand=product_info.get("brand", "Unknown"),
+                model=product_info.get("model", "Unknown"),
+                category=product_info.get("category", "Unknown")
+            ),
+            verification_result=VerificationResult(
+                is_authentic=verification.get("is_authentic_guess") == "Authentic",
+                verdict=verification.get("is_authentic_guess", "Error"),
+                confidence_score=verification.get("confidence_score", 0) / 100,  # Convert to 0-1 scale
+                anomalies=verification.get("anomalies_detected", []),
+                reasoning=verification.get("detailed_reasoning", "No analysis available"),
+                method=cot_result.get("method", "Chain-of-Thought (CoT) Forensic Analysis")
+            ),
+            # Flag observations / warnings / reasoning are already in verification_result
+            raw_forensic_analysis=raw if verbose else ForensicSummary.from_raw(raw),
+            # Which cascade tier answered (screening / full), for threshold tuning
+            cascade=cot_result.get("cascade"),
+            # Providers that were unavailable and the local fallback used instead
+            degraded=degraded or None
+        )
         
-        print(f"CoT Verification complete: {result['verification_result']['verdict']} ({result['verification_result']['confidence_score']*100:.0f}%)")
-        print(f"Product: {result['product_info']['brand']} {result['product_info']['model']} ({result['product_info']['category']})")
+        print(f"CoT Verification complete: {result.verification_result.verdict} ({result.verification_result.confidence_score*100:.0f}%)")
+        print(f"Product: {result.product_info.brand} {result.product_info.model} ({result.product_info.category})")
         return result
         
-    except HTTPException:
+    except (HTTPException, CircuitOpenError, DeadlineExceeded):
         raise
     except Exception as e:
         print(f"Verification Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/verify/video")
+async def verify_video(
+    video: UploadFile = File(...),
+    fields: str = None,
+    verbose: bool = False,
+    caller: Caller = Depends(current_caller),
+    x_image_url: str = Header(None)
+):
+    """
+    Video-scan mode: accepts a short clip of the product (slowly turning it under good light),
+    picks the sharpest distinct frames locally and runs the regular verification on them.
+    """
+    if not video_service.available:
+        raise HTTPException(status_code=501, detail="Video scan is not available on this server")
+    async with upload_service.ingest_video(video) as (video_data, filename):
+        try:
+            frames, scan_info = await run_in_threadpool(video_service.select_frames, video_data)
+        except Exception as e:
+            print(f"Video decode error: {e}")
+            raise HTTPException(status_code=400, detail=f"{filename}: could not decode video")
+        if not frames:
+            raise HTTPException(status_code=400, detail=f"{filename}: no frames could be decoded")
+        result = await _verify(frames, [f"{filename}@{s['time']}s" for s in scan_info["selected"]], verbose)
+        result.video_scan = scan_info
+        history_service.record(caller.user_id, "verify", result, "video", x_image_url)
+        return respond(result, fields)
+
+@app.post("/verify/reference")
+async def verify_reference(
+    file: UploadFile = File(None),
+    front_image: UploadFile = File(None),
+    back_image: UploadFile = File(None),
+    fields: str = None,
+    caller: Caller = Depends(current_caller)
+):
+    """
+    Visual reference check: compares the front photo against official product images found
+    online. Embedding similarity decides clear cases; Gemini compares only inconclusive ones.
+    A Consistent result confirms the barcode's product index entry.
+    """
+    async with upload_service.ingest([file, front_image, back_image]) as (images_data, filenames):
+        if not images_data:
+            raise HTTPException(status_code=400, detail="At least one image must be provided")
+        degraded = track_degradation()
+        await run_in_threadpool(quality_service.check, images_data, filenames)
+        try:
+            product_name, gtin = await _identify(images_data, caller.user_id)
+            await upload_service.release_decode()
+            if product_name == "unknown product":
+                raise HTTPException(status_code=422, detail="Could not identify the product to look up references")
+            result = await run_in_threadpool(reference_service.compare, images_data[0], product_name)
+            if gtin and result.get("verdict") == "Consistent":
+                # The photo matches official images of the identified product: a verified identification
+                await run_in_threadpool(barcode_service.index.remember, gtin, product_name, "reference",
+                                        caller.user_id, True)
+            return respond({"product_name": product_name, "gtin": gtin, "filename": ", ".join(filenames), **result,
+                            "degraded": degraded or None}, fields)
+        except (HTTPException, CircuitOpenError, DeadlineExceeded):
+            raise
+        except Exception as e:
+            print(f"Reference Check Error: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/price")
 async def check_price(
     file: UploadFile = File(None),
     front_image: UploadFile = File(None),
     back_image: UploadFile = File(None),
-    sort: str = "price_asc"
+    sort: str = "price_asc",
+    regions: str = None,
+    fields: str = None,
+    caller: Caller = Depends(current_caller),
+    x_input_type: str = Header(None),
+    x_image_url: str = Header(None)
 ):
     """
     Checks online prices for the product in the images.
+    `regions` is a comma-separated list of markets (e.g. "in,us,uk"); prices come back in the first one's currency.
     """
-    images_data = []
-    
-    async def add_image(upload_file):
-        if upload_file:
-            images_data.append(await upload_file.read())
+    try:
+        region_codes = parse_regions(regions)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    async with upload_service.ingest([file, front_image, back_image]) as (images_data, filenames):
+        result = await _price(images_data, sort, filenames, region_codes, caller.user_id)
+        history_service.record(caller.user_id, "price", result, x_input_type, x_image_url)
+        return respond(result, fields)
 
-    await add_image(file)
-    await add_image(front_image)
-    await add_image(back_image)
-    
+async def _identify(images_data: list[bytes], voter: str = None):
+    """
+    Product name + GTIN; a barcode confirmed in the product index skips the Gemini call.
+    Otherwise the identification counts as `voter`'s vote for the barcode's name.
+    """
+    codes = await run_in_threadpool(barcode_service.scan, images_data)
+    gtin = barcode_service.primary_gtin(codes)
+    product_name = await run_in_threadpool(barcode_service.index.lookup, gtin) if gtin else None
+    if product_name:
+        print(f"Barcode {gtin} found in product index")
+    else:
+        product_name = await run_in_threadpool(gemini_service.identify_product, images_data)
+        if gtin and product_name != "unknown product":
+            await run_in_threadpool(barcode_service.index.remember, gtin, product_name, "gemini", voter)
+    print(f"Identified product: {product_name}")
+    return product_name, gtin
+
+async def _price(images_data: list[bytes], sort: str, filenames: list[str] = None, regions: list = None,
+                 voter: str = None) -> PriceResponse:
     if not images_data:
         raise HTTPException(status_code=400, detail="At least one image must be provided")
+    degraded = track_degradation()
     
+    await run_in_threadpool(quality_service.check, images_data, filenames)
+
     try:
-        # 1. Identify Product Name
-        product_name = gemini_service.identify_product(images_data)
-        print(f"Identified product: {product_name}")
+        # 1. Identify Product Name (a known barcode skips the model call)
+        product_name, gtin = await _identify(images_data, voter)
+        await upload_service.release_decode()
         
         # 2. Find Prices
         print(f"Finding prices for: {product_name}")
-        prices = search_service.find_product_prices(product_name)
+        regions = regions or DEFAULT_REGIONS
+        price_refresher.record(product_name, regions)
+        prices = await run_in_threadpool(search_service.find_product_prices, product_name, regions)
+
+        # 3. Score result thumbnails against the user's photo (within a fixed latency budget)
+        visual_rerank = await run_in_threadpool(price_ranker.rerank, images_data[0], prices)
         
-        # 3. Sort Results
+        # 4. Sort Results
         if sort == "price_asc":
             prices.sort(key=lambda x: x["price"])
         elif sort == "price_desc":
             prices.sort(key=lambda x: x["price"], reverse=True)
         elif sort == "rating":
             prices.sort(key=lambda x: x["rating"], reverse=True)
+        elif sort == "relevance":
+            prices.sort(key=lambda x: x.get("visual_similarity") or 0.0, reverse=True)
+        # Results that visibly show a different product sink below the rest, whatever the sort
+        prices.sort(key=lambda x: x.get("visual_match") is False)
             
-        return {
-            "product_name": product_name,
-            "prices": prices
-        }
+        return PriceResponse(
+            product_name=product_name,
+            gtin=gtin,
+            prices=[PriceEntry.from_dict(p) for p in prices],
+            visual_rerank=visual_rerank,
+            degraded=degraded or None,
+            regions=regions
+        )
     
+    except (HTTPException, CircuitOpenError, DeadlineExceeded):
+        raise
     except Exception as e:
         print(f"Price Check Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -152,37 +426,59 @@ async def check_price(
 async def get_details(
     file: UploadFile = File(None),
     front_image: UploadFile = File(None),
-    back_image: UploadFile = File(None)
+    back_image: UploadFile = File(None),
+    fields: str = None,
+    caller: Caller = Depends(current_caller),
+    x_input_type: str = Header(None),
+    x_image_url: str = Header(None)
 ):
     """
     Analyzes images to provide detailed product specifications.
     """
-    images_data = []
-    filenames = []
-    
-    async def add_image(upload_file):
-        if upload_file:
-            images_data.append(await upload_file.read())
-            filenames.append(upload_file.filename)
-
-    await add_image(file)
-    await add_image(front_image)
-    await add_image(back_image)
-    
+    async with upload_service.ingest([file, front_image, back_image]) as (images_data, filenames):
+        result = await _details(images_data, filenames)
+        history_service.record(caller.user_id, "details", result, x_input_type, x_image_url)
+        return respond(result, fields)
+
+async def _details(images_data: list[bytes], filenames: list[str]) -> DetailsResponse:
     if not images_data:
         raise HTTPException(status_code=400, detail="At least one image must be provided")
     
+    await run_in_threadpool(quality_service.check, images_data, filenames)
+    await upload_service.release_decode()
+
     try:
-        details = gemini_service.analyze_for_details(images_data)
+        details = await run_in_threadpool(gemini_service.analyze_for_details, images_data)
         
-        return {
-            **details,
-            "filename": ", ".join(filenames)
-        }
+        return DetailsResponse.from_dict(details, ", ".join(filenames))
+    except (HTTPException, CircuitOpenError, DeadlineExceeded):
+        raise
     except Exception as e:
         print(f"Details Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/safety")
+async def check_safety(
+    file: UploadFile = File(None),
+    front_image: UploadFile = File(None),
+    back_image: UploadFile = File(None)
+):
+    """
+    Safety-only check: screens the label text for banned / hazardous ingredients locally,
+    without a model call. Best with a clear photo of the ingredient list.
+    """
+    async with upload_service.ingest([file, front_image, back_image]) as (images_data, filenames):
+        if not images_data:
+            raise HTTPException(status_code=400, detail="At least one image must be provided")
+        assessment = await run_in_threadpool(ingredient_screener.screen_images, images_data)
+        if assessment is None:
+            raise HTTPException(status_code=503, detail="Local OCR is not available on this server")
+        return {
+            "filename": ", ".join(filenames),
+            "health_safety_assessment": assessment,
+            "method": "Local Ingredient Screener (OCR + Aho-Corasick)"
+        }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=8000)
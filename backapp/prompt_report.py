@@ -0,0 +1,67 @@
+"""
+Token-count report for the versioned prompts in services/prompts.py.
+
+Prints, per prompt, the static system-instruction tokens (sent once per call, but
+identical every time and therefore cacheable) and the per-call user tokens.
+Counts come from the Gemini count_tokens API when a key is configured, otherwise
+from a ~4 characters/token estimate.
+
+Example:
+    python prompt_report.py            # uses GEMINI_API_KEY if set
+    python prompt_report.py --offline  # estimate only, no network
+"""
+import argparse
+import os
+
+from dotenv import load_dotenv
+
+from services.prompts import PROMPTS
+
+load_dotenv()
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, round(len(text) / 4))
+
+
+def live_counter(api_key: str, model_name: str):
+    from services.providers import LiveGeminiProvider
+
+    provider = LiveGeminiProvider(api_key, model_name)
+
+    def count(system: str, user: str):
+        with_system = provider._model(model_name, system).count_tokens([user]).total_tokens
+        user_only = provider._model(model_name).count_tokens([user]).total_tokens
+        return with_system - user_only, user_only
+
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Token counts per prompt version")
+    parser.add_argument("--offline", action="store_true", help="Estimate from characters instead of calling count_tokens")
+    parser.add_argument("--model", default=os.getenv("GEMINI_MODEL", "gemini-2.5-flash"))
+    parser.add_argument("--cache-min-tokens", type=int, default=1024,
+                        help="Minimum prefix length for Gemini implicit caching on this model")
+    args = parser.parse_args()
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    counter = None
+    if api_key and not args.offline:
+        counter = live_counter(api_key, args.model)
+    source = f"count_tokens ({args.model})" if counter else "estimate (~4 chars/token)"
+
+    print(f"Token counts: {source}")
+    print(f"{'prompt':<24}{'system':>8}{'user':>7}{'total':>8}  cacheable prefix")
+    for prompt in PROMPTS.values():
+        if counter:
+            system_tokens, user_tokens = counter(prompt.system, prompt.user)
+        else:
+            system_tokens, user_tokens = estimate_tokens(prompt.system), estimate_tokens(prompt.user)
+        cacheable = "yes" if system_tokens >= args.cache_min_tokens else f"no (< {args.cache_min_tokens})"
+        print(f"{prompt.label:<24}{system_tokens:>8}{user_tokens:>7}{system_tokens + user_tokens:>8}  {cacheable}")
+    print("Images add ~258 tokens per 768px tile on top of these.")
+
+
+if __name__ == "__main__":
+    main()
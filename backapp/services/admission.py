@@ -0,0 +1,192 @@
+"""
+Admission control and load shedding per endpoint.
+
+Each POST endpoint has a lane: at most `concurrency` requests run at once, up to `queue`
+more wait for a slot, and anything beyond that is answered 503 with a Retry-After estimate
+instead of piling up behind Gemini. Waiters are served paid tier first (active pro /
+enterprise subscriptions, see subscription_service), then in arrival order; when the queue
+is full a paid request displaces the newest free-tier waiter. A waiter that cannot get a slot
+within ADMISSION_MAX_WAIT_SECONDS (or its request deadline) is shed as well.
+
+Limits come from ADMISSION_CONCURRENCY / ADMISSION_QUEUE, overridable per endpoint with
+ADMISSION_LIMITS="verify=4:8,price=6:12" (concurrency:queue). GET /health/admission shows
+queue depth, in-flight requests and wait times per lane.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import deque
+from dotenv import load_dotenv
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+
+from services import deadline
+from services.subscription_service import subscription_service, PAID
+
+load_dotenv()
+
+ENDPOINTS = ("/verify", "/verify/video", "/verify/reference", "/price", "/details", "/safety")
+PRIORITY = {PAID: 0}    # everything else (free, anonymous) is 1
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, lane: str, reason: str, retry_after: float):
+        super().__init__(f"{lane} is overloaded ({reason}), retry in {retry_after:.0f}s")
+        self.lane = lane
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Lane:
+    def __init__(self, name: str, concurrency: int, queue_size: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.in_flight = 0
+        self.waiters = []               # heap of [priority, seq, future]
+        self.seq = itertools.count()
+        self.service_ewma = None        # seconds per admitted request
+        self.waits = deque(maxlen=500)  # recent queue waits, seconds
+        self.stats = {"admitted": 0, "queued": 0, "rejected_full": 0, "shed_for_paid": 0, "timed_out": 0}
+
+    def retry_after(self) -> float:
+        # Time for the queue ahead to drain through the lane's slots
+        per_request = self.service_ewma or 5.0
+        return max(1.0, math.ceil(per_request * (len(self.waiters) + 1) / self.concurrency))
+
+    def _remove(self, entry):
+        self.waiters.remove(entry)
+        heapq.heapify(self.waiters)
+
+    async def acquire(self, priority: int, max_wait: float) -> float:
+        """Waits for a slot; returns the seconds spent queued or raises AdmissionRejected."""
+        if self.in_flight < self.concurrency and not self.waiters:
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+            self.waits.append(0.0)
+            return 0.0
+
+        if len(self.waiters) >= self.queue_size:
+            # Displace the newest waiter of the lowest priority, if it ranks below this request
+            victim = max(self.waiters, key=lambda e: (e[0], e[1]), default=None)
+            if victim is None or victim[0] <= priority:
+                self.stats["rejected_full"] += 1
+                raise AdmissionRejected(self.name, "queue full", self.retry_after())
+            self._remove(victim)
+            self.stats["shed_for_paid"] += 1
+            victim[2].set_exception(AdmissionRejected(self.name, "displaced by a priority request", self.retry_after()))
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self.seq), future]
+        heapq.heappush(self.waiters, entry)
+        self.stats["queued"] += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait({future}, timeout=max(0.0, max_wait))
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()      # a slot was handed over just as the client went away
+            elif entry in self.waiters:
+                self._remove(entry)
+            raise
+        if not future.done():
+            self._remove(entry)
+            self.stats["timed_out"] += 1
+            raise AdmissionRejected(self.name, "queue wait too long", self.retry_after())
+        future.result()             # re-raises AdmissionRejected for a displaced waiter
+        waited = time.monotonic() - start
+        self.stats["admitted"] += 1
+        self.waits.append(waited)
+        return waited
+
+    def release(self, elapsed: float = None):
+        if elapsed is not None:
+            self.service_ewma = elapsed if self.service_ewma is None else 0.8 * self.service_ewma + 0.2 * elapsed
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None)     # hand the slot straight to the next waiter
+                return
+        self.in_flight -= 1
+
+    def snapshot(self) -> dict:
+        waits = sorted(self.waits)
+
+        def percentile(q):
+            return round(waits[min(len(waits) - 1, int(q * len(waits)))] * 1000) if waits else 0
+
+        return {
+            "lane": self.name,
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "in_flight": self.in_flight,
+            "queue_depth": len(self.waiters),
+            "queued_paid": sum(1 for e in self.waiters if e[0] == 0),
+            "wait_ms_p50": percentile(0.5),
+            "wait_ms_p95": percentile(0.95),
+            "service_seconds_ewma": round(self.service_ewma, 3) if self.service_ewma is not None else None,
+            **self.stats,
+        }
+
+
+def _build_lanes() -> dict:
+    concurrency = int(os.getenv("ADMISSION_CONCURRENCY", 8))
+    queue_size = int(os.getenv("ADMISSION_QUEUE", 16))
+    overrides = {}
+    for item in os.getenv("ADMISSION_LIMITS", "").split(","):
+        name, _, limits = item.partition("=")
+        if limits:
+            parts = limits.split(":")
+            overrides["/" + name.strip().strip("/")] = (int(parts[0]), int(parts[1]) if len(parts) > 1 else queue_size)
+    return {path: Lane(path, *overrides.get(path, (concurrency, queue_size))) for path in ENDPOINTS}
+
+
+class AdmissionController:
+    """Pure ASGI middleware: decides before the upload body is read, so shed requests cost almost nothing."""
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = os.getenv("ADMISSION_CONTROL", "1") != "0"
+        self.max_wait = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", 15))
+        self.lanes = lanes
+
+    async def __call__(self, scope, receive, send):
+        lane = self.lanes.get(scope.get("path")) if scope["type"] == "http" and scope.get("method") == "POST" else None
+        if not (self.enabled and lane):
+            return await self.app(scope, receive, send)
+
+        authorization = next((v.decode("latin-1") for k, v in scope.get("headers", []) if k == b"authorization"), None)
+        caller = (await run_in_threadpool(subscription_service.caller, authorization) if authorization
+                  else subscription_service.caller(None))
+        # Endpoints read the caller from request.state instead of looking it up again
+        scope.setdefault("state", {})["caller"] = caller
+        tier = caller.tier
+        left = deadline.remaining()
+        max_wait = self.max_wait if left is None else min(self.max_wait, left)
+        try:
+            await lane.acquire(PRIORITY.get(tier, 1), max_wait)
+        except AdmissionRejected as e:
+            print(f"Admission: {e} [{tier}]")
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": str(e), "reason": e.reason, "tier": tier},
+                headers={"Retry-After": str(int(e.retry_after))},
+            )
+            return await response(scope, receive, send)
+
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lane.release(time.monotonic() - start)
+
+
+lanes = _build_lanes()
+
+
+def snapshot() -> list:
+    return [lane.snapshot() for lane in lanes.values()]
@@ -0,0 +1,249 @@
+"""
+Local barcode/QR decoding with a self-filling GTIN -> product index.
+
+Decoding uses pyzbar (optional: needs `pyzbar` and the zbar shared library). Confirmed
+GTINs let /price skip the Gemini identification call until the entry is older than
+PRODUCT_INDEX_TTL_DAYS. A GTIN is confirmed once independent callers' identifications agree
+(PRODUCT_INDEX_MIN_AGREEMENT) or a reference check verifies the name; until then the
+names seen are only hints. GS1 payloads in 2D codes with a wrong check digit are reported by
+/verify as a forensic anomaly.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+from services.image_utils import decode_image
+
+load_dotenv()
+
+try:
+    from pyzbar import pyzbar
+except Exception:  # ImportError, or the zbar shared library is missing
+    pyzbar = None
+
+LINEAR_GTIN_TYPES = {"EAN13", "EAN8", "UPCA", "UPCE", "ISBN13"}
+
+# GS1 Application Identifier (01) = GTIN-14, as an element string or a GS1 Digital Link URL
+# (optionally prefixed by a symbology identifier such as "]C1" or "]Q3")
+GS1_GTIN_PATTERN = re.compile(r"(?:\(01\)|/01/|^(?:\][A-Za-z]\d)?01)(\d{14})")
+
+
+def gtin_check_digit(body: str) -> int:
+    """GS1 mod-10 check digit for the digits before the check digit."""
+    total = sum(int(d) * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(body)))
+    return (10 - total % 10) % 10
+
+
+def is_valid_gtin(code: str) -> bool:
+    return code.isdigit() and len(code) in (8, 12, 13, 14) and gtin_check_digit(code[:-1]) == int(code[-1])
+
+
+def upce_to_upca(upce: str) -> str:
+    """Expands an 8-digit UPC-E (number system + 6 digits + check) to UPC-A."""
+    ns, d, check = upce[0], upce[1:7], upce[7]
+    last = d[5]
+    if last in "012":
+        body = d[0:2] + last + "0000" + d[2:5]
+    elif last == "3":
+        body = d[0:3] + "00000" + d[3:5]
+    elif last == "4":
+        body = d[0:4] + "00000" + d[4]
+    else:
+        body = d[0:5] + "0000" + last
+    return ns + body + check
+
+
+def to_gtin14(code: str) -> str:
+    return code.zfill(14)
+
+
+def name_key(product_name: str) -> str:
+    """Identifications agree when they match ignoring case, spacing and punctuation."""
+    return re.sub(r"[^a-z0-9]", "", product_name.lower())
+
+
+class ProductIndex:
+    """
+    SQLite GTIN-14 -> product name cache, filled from past identifications. Each
+    identification is a vote; a name is served by lookup() only once min_agreement distinct
+    voters agree on it or it was verified, so one wrong (or hostile) identification cannot
+    poison the index for everyone. Entries and votes expire ttl_seconds after they were last
+    written, so a wrong identification is redone instead of being served forever.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 30 * 24 * 3600, min_agreement: int = 2):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.min_agreement = min_agreement
+        self.lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS products (
+                    gtin TEXT PRIMARY KEY,
+                    product_name TEXT NOT NULL,
+                    source TEXT,
+                    hits INTEGER DEFAULT 0,
+                    created_at REAL,
+                    updated_at REAL
+                )
+            """)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(products)")}
+            if "confirmed" not in columns:
+                # Entries written before confirmation existed were single identifications: hints only
+                conn.execute("ALTER TABLE products ADD COLUMN confirmed INTEGER DEFAULT 0")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS product_votes (
+                    gtin TEXT NOT NULL,
+                    name_key TEXT NOT NULL,
+                    product_name TEXT NOT NULL,
+                    voter TEXT NOT NULL,
+                    updated_at REAL,
+                    PRIMARY KEY (gtin, name_key, voter)
+                )
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:  # commits on success
+                yield conn
+        finally:
+            conn.close()
+
+    def lookup(self, gtin: str):
+        """Confirmed product name for the GTIN, or None if unknown, unconfirmed or expired."""
+        with self.lock, self._connect() as conn:
+            row = conn.execute("SELECT product_name FROM products WHERE gtin = ? AND confirmed = 1 AND updated_at >= ?",
+                               (to_gtin14(gtin), time.time() - self.ttl_seconds)).fetchone()
+            if row:
+                conn.execute("UPDATE products SET hits = hits + 1 WHERE gtin = ?", (to_gtin14(gtin),))
+                return row[0]
+        return None
+
+    def hint(self, gtin: str):
+        """Best name known for the GTIN, confirmed or not (the most agreed-on identification), or None."""
+        gtin, cutoff = to_gtin14(gtin), time.time() - self.ttl_seconds
+        with self.lock, self._connect() as conn:
+            row = conn.execute("SELECT product_name, confirmed FROM products WHERE gtin = ? AND updated_at >= ?",
+                               (gtin, cutoff)).fetchone()
+            if row and row[1]:
+                return row[0]
+            vote = conn.execute("""
+                SELECT product_name FROM product_votes WHERE gtin = ? AND updated_at >= ?
+                GROUP BY name_key ORDER BY COUNT(DISTINCT voter) DESC, MAX(updated_at) DESC LIMIT 1
+            """, (gtin, cutoff)).fetchone()
+        if vote:
+            return vote[0]
+        return row[0] if row else None
+
+    def remember(self, gtin: str, product_name: str, source: str = "gemini", voter: str = None,
+                 verified: bool = False) -> bool:
+        """
+        Records an identification by `voter` (a user id; anonymous callers share one vote).
+        The name is confirmed once min_agreement distinct voters agree, or at once when
+        verified. Returns whether the GTIN now maps to this name.
+        """
+        gtin, key, now = to_gtin14(gtin), name_key(product_name), time.time()
+        if not key:
+            return False
+        with self.lock, self._connect() as conn:
+            conn.execute("""
+                INSERT INTO product_votes (gtin, name_key, product_name, voter, updated_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(gtin, name_key, voter) DO UPDATE SET product_name = excluded.product_name,
+                    updated_at = excluded.updated_at
+            """, (gtin, key, product_name, voter or "anonymous", now))
+            agreeing = conn.execute(
+                "SELECT COUNT(DISTINCT voter) FROM product_votes WHERE gtin = ? AND name_key = ? AND updated_at >= ?",
+                (gtin, key, now - self.ttl_seconds)).fetchone()[0]
+            if not verified and agreeing < self.min_agreement:
+                return False
+            conn.execute("""
+                INSERT INTO products (gtin, product_name, source, hits, created_at, updated_at, confirmed)
+                VALUES (?, ?, ?, 0, ?, ?, 1)
+                ON CONFLICT(gtin) DO UPDATE SET product_name = excluded.product_name,
+                    source = excluded.source, updated_at = excluded.updated_at, confirmed = 1,
+                    hits = CASE WHEN products.product_name = excluded.product_name THEN products.hits ELSE 0 END
+            """, (gtin, product_name, "verified" if verified else source, now, now))
+        return True
+
+
+class BarcodeService:
+    def __init__(self, index_path: str = None):
+        self.enabled = pyzbar is not None and os.getenv("BARCODE_SCAN", "1") != "0"
+        self.scan_max_edge = 2000  # bars need resolution; phone photos are usually larger
+        self.index = ProductIndex(index_path or os.getenv(
+            "PRODUCT_INDEX_PATH",
+            os.path.join(os.path.dirname(os.path.dirname(__file__)), "product_index.db")
+        ), ttl_seconds=float(os.getenv("PRODUCT_INDEX_TTL_DAYS", 30)) * 24 * 3600,
+            min_agreement=int(os.getenv("PRODUCT_INDEX_MIN_AGREEMENT", 2)))
+
+    def _gtin_from_symbol(self, symbol_type: str, data: str):
+        if symbol_type in LINEAR_GTIN_TYPES:
+            digits = re.sub(r"\D", "", data)
+            return upce_to_upca(digits) if symbol_type == "UPCE" and len(digits) == 8 else digits
+        match = GS1_GTIN_PATTERN.search(data)
+        return match.group(1) if match else None
+
+    def scan(self, images_data: list[bytes]) -> list:
+        """Decodes all barcodes/QR codes: [{type, data, gtin, valid}] (gtin None for non-GS1 payloads)."""
+        if not self.enabled:
+            return []
+        codes = []
+        seen = set()
+        for img_bytes in images_data:
+            try:
+                image = decode_image(img_bytes, max_edge=self.scan_max_edge, mode="L")
+                symbols = pyzbar.decode(image)
+            except Exception as e:
+                print(f"Barcode scan error: {e}")
+                continue
+            for symbol in symbols:
+                data = symbol.data.decode("utf-8", errors="replace")
+                if (symbol.type, data) in seen:
+                    continue
+                seen.add((symbol.type, data))
+                gtin = self._gtin_from_symbol(symbol.type, data)
+                codes.append({
+                    "type": symbol.type,
+                    "data": data,
+                    "gtin": gtin,
+                    "valid": is_valid_gtin(gtin) if gtin else None,
+                })
+        return codes
+
+    def primary_gtin(self, codes: list):
+        """First GTIN with a valid check digit, preferring linear barcodes over QR payloads."""
+        ordered = sorted(codes, key=lambda c: c["type"] not in LINEAR_GTIN_TYPES)
+        for code in ordered:
+            if code["gtin"] and code["valid"]:
+                return code["gtin"]
+        return None
+
+    def anomalies(self, codes: list) -> list:
+        """
+        Forensic flags for GTINs whose check digit does not match.
+
+        zbar verifies the check digit of EAN/UPC symbols itself and drops those that fail, so
+        in practice this only fires for GS1 element strings and Digital Link URLs carried in
+        QR / DataMatrix codes, where the GTIN is plain payload text. A printed EAN-13 with a
+        wrong check digit shows up as no barcode at all, not as an anomaly.
+        """
+        flags = []
+        for code in codes:
+            if code["gtin"] and code["valid"] is False:
+                expected = gtin_check_digit(code["gtin"][:-1])
+                flags.append({
+                    "check": "Barcode Check Digit",
+                    "status": "FAIL",
+                    "observation": f"{code['type']} code {code['gtin']} has an invalid GS1 check digit (expected {expected})"
+                })
+        return flags
+
+
+barcode_service = BarcodeService()
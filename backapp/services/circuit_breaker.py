@@ -0,0 +1,167 @@
+"""
+Per-provider circuit breakers (closed -> open -> half-open) for Gemini, SerpApi and DuckDuckGo.
+
+A breaker opens after CIRCUIT_FAILURE_THRESHOLD consecutive failures (quota errors count like
+any other failure, so one per-minute 429 doesn't take the provider away from every user) and
+then fails calls immediately with CircuitOpenError for
+CIRCUIT_RESET_SECONDS. After that a single trial call is let through (half-open): success
+closes the breaker, failure re-opens it. Client errors (4xx other than 408/429) are the
+caller's fault and do not count.
+
+Endpoints call track_degradation() at the start of a request; services that fall back to
+a local path while a provider is unavailable call note_degraded(), and the notes end up
+in the response's "degraded" field.
+"""
+import os
+import threading
+import time
+from contextvars import ContextVar
+from dotenv import load_dotenv
+
+from services import deadline
+
+load_dotenv()
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose breaker is open."""
+
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(f"{provider} is temporarily unavailable (circuit open, retry in {retry_after:.0f}s)")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+def _counts_as_failure(error: Exception) -> bool:
+    code = getattr(error, "code", None)
+    if code is None:
+        response = getattr(error, "response", None)
+        code = getattr(response, "status_code", None)
+    try:
+        code = int(code)
+    except (TypeError, ValueError):
+        return True
+    return not (400 <= code < 500 and code not in (408, 429))
+
+
+def is_quota_error(error: Exception) -> bool:
+    """Rate-limit / quota errors; google.api_core raises ResourceExhausted (code 429) for these."""
+    if getattr(error, "code", None) == 429:
+        return True
+    message = str(error).lower()
+    return message.startswith("429") or "quota" in message or "resource exhausted" in message
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.stats = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def _retry_after(self, now: float) -> float:
+        return max(0.0, self.opened_at + self.reset_seconds - now)
+
+    def _before_call(self):
+        now = time.monotonic()
+        with self.lock:
+            if not self.enabled:
+                return
+            if self.state == OPEN and self._retry_after(now) <= 0:
+                self.state = HALF_OPEN
+            if self.state == OPEN or (self.state == HALF_OPEN and self.trial_in_flight):
+                self.stats["rejected"] += 1
+                raise CircuitOpenError(self.name, self._retry_after(now) or 1.0)
+            if self.state == HALF_OPEN:
+                self.trial_in_flight = True
+            self.stats["calls"] += 1
+
+    def _after_call(self, error: Exception = None):
+        with self.lock:
+            self.trial_in_flight = False
+            if error is not None and deadline.expired():
+                # A call cut short by the request's own deadline says nothing about the provider
+                return
+            if error is None or not _counts_as_failure(error):
+                if self.state != CLOSED:
+                    print(f"Circuit {self.name}: closed again")
+                self.state = CLOSED
+                self.consecutive_failures = 0
+                return
+            self.stats["failures"] += 1
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.stats["opened"] += 1
+                    print(f"Circuit {self.name}: open for {self.reset_seconds:.0f}s after {type(error).__name__}: {str(error)[:120]}")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def call(self, fn, *args, **kwargs):
+        """Runs fn through the breaker; raises CircuitOpenError without calling it while open."""
+        self._before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self._after_call(e)
+            raise
+        self._after_call()
+        return result
+
+    def is_open(self) -> bool:
+        with self.lock:
+            return self.enabled and self.state == OPEN and self._retry_after(time.monotonic()) > 0
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self.lock:
+            state = self.state
+            if state == OPEN and self._retry_after(now) <= 0:
+                state = HALF_OPEN
+            return {
+                "provider": self.name,
+                "state": state if self.enabled else "disabled",
+                "retry_after_seconds": round(self._retry_after(now), 1) if state == OPEN else 0.0,
+                "consecutive_failures": self.consecutive_failures,
+                **self.stats,
+            }
+
+
+def _build_breakers() -> dict:
+    threshold = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+    reset = float(os.getenv("CIRCUIT_RESET_SECONDS", 30))
+    enabled = os.getenv("CIRCUIT_BREAKERS", "1") != "0"
+    breakers = {}
+    for name in ("gemini", "serpapi", "duckduckgo"):
+        breaker = CircuitBreaker(name, threshold, reset)
+        breaker.enabled = enabled
+        breakers[name] = breaker
+    return breakers
+
+
+breakers = _build_breakers()
+
+_degraded: ContextVar = ContextVar("degraded", default=None)
+
+
+def track_degradation() -> list:
+    """Starts collecting degradation notes for the current request; returns the (live) list."""
+    notes = []
+    _degraded.set(notes)
+    return notes
+
+
+def note_degraded(provider: str, fallback: str):
+    """Records that `provider` was unavailable and `fallback` was used instead."""
+    notes = _degraded.get()
+    entry = {"provider": provider, "fallback": fallback}
+    if notes is not None and entry not in notes:
+        notes.append(entry)
@@ -0,0 +1,74 @@
+"""
+Response compression for large JSON payloads.
+
+Brotli when the client accepts it and the optional `brotli` package is installed, gzip
+otherwise. Only complete (non-streaming) responses of at least COMPRESS_MIN_BYTES are
+compressed; small bodies are sent as-is since the headers would eat the saving.
+"""
+import gzip
+import os
+from dotenv import load_dotenv
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+load_dotenv()
+
+COMPRESSIBLE = (b"application/json", b"text/")
+
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.min_bytes = int(os.getenv("COMPRESS_MIN_BYTES", 1024))
+        self.gzip_level = int(os.getenv("COMPRESS_GZIP_LEVEL", 6))
+        self.brotli_quality = int(os.getenv("COMPRESS_BROTLI_QUALITY", 5))
+
+    def _encoding(self, headers: list):
+        accept = next((v.decode("latin-1").lower() for k, v in headers if k == b"accept-encoding"), "")
+        offered = {part.split(";")[0].strip() for part in accept.split(",")}
+        if brotli is not None and "br" in offered:
+            return "br"
+        if "gzip" in offered:
+            return "gzip"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        encoding = self._encoding(scope.get("headers", [])) if scope["type"] == "http" else None
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start_message = None
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                # Hold the headers back until the body shows whether compression is worthwhile
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                return await send(message)
+
+            start, start_message = start_message, None
+            headers = list(start.get("headers", []))
+            content_type = next((v for k, v in headers if k == b"content-type"), b"")
+            body = message.get("body", b"")
+            if (message.get("more_body", False) or len(body) < self.min_bytes
+                    or any(k == b"content-encoding" for k, _ in headers)
+                    or not content_type.startswith(COMPRESSIBLE)):
+                await send(start)
+                return await send(message)
+
+            if encoding == "br":
+                body = brotli.compress(body, quality=self.brotli_quality)
+            else:
+                body = gzip.compress(body, compresslevel=self.gzip_level)
+            headers = [(k, v) for k, v in headers if k != b"content-length"]
+            headers += [(b"content-encoding", encoding.encode()), (b"content-length", str(len(body)).encode()),
+                        (b"vary", b"Accept-Encoding")]
+            await send({**start, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
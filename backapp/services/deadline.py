@@ -0,0 +1,171 @@
+"""
+End-to-end request deadlines.
+
+The client asks for a time limit with the X-Request-Timeout header (seconds); the server
+applies REQUEST_TIMEOUT_SECONDS when it is missing and caps it at REQUEST_TIMEOUT_MAX_SECONDS.
+DeadlineMiddleware stores the deadline in a context variable, which run_in_threadpool copies
+into worker threads, so every stage can ask for the time remaining:
+
+    timeout = deadline.timeout(15)    # min(15, time left); raises DeadlineExceeded if none is left
+    deadline.check("serpapi")         # raises DeadlineExceeded once expired or abandoned
+    deadline.sleep(5)                 # backoff that refuses to outlast the deadline
+
+When the deadline passes, or the client disconnects, the middleware cancels the request
+task and marks the deadline cancelled; blocking work still running in threads stops at its
+next check instead of finishing an answer nobody will read.
+"""
+import asyncio
+import os
+import time
+from contextvars import ContextVar
+from dotenv import load_dotenv
+
+from fastapi.responses import JSONResponse
+
+load_dotenv()
+
+DEFAULT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", 45))
+MAX_SECONDS = float(os.getenv("REQUEST_TIMEOUT_MAX_SECONDS", 90))
+HEADER = b"x-request-timeout"
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed (or its client went away) before this stage could run."""
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.cancelled = None       # reason, once the request was abandoned
+
+    def remaining(self) -> float:
+        return 0.0 if self.cancelled else max(0.0, self.expires_at - time.monotonic())
+
+
+_current: ContextVar = ContextVar("deadline", default=None)
+
+
+def start(seconds: float) -> Deadline:
+    current = Deadline(seconds)
+    _current.set(current)
+    return current
+
+
+def remaining():
+    """Seconds left for the current request, or None outside a request."""
+    current = _current.get()
+    return None if current is None else current.remaining()
+
+
+def expired() -> bool:
+    current = _current.get()
+    return current is not None and current.remaining() <= 0
+
+
+def check(stage: str = "request"):
+    current = _current.get()
+    if current is not None and current.remaining() <= 0:
+        reason = current.cancelled or f"deadline of {current.seconds:g}s exceeded"
+        raise DeadlineExceeded(f"{stage} skipped: {reason}")
+
+
+def timeout(default: float, stage: str = "request") -> float:
+    """The smaller of `default` and the time left; raises DeadlineExceeded if nothing is left."""
+    check(stage)
+    left = remaining()
+    return default if left is None else min(default, left)
+
+
+def sleep(seconds: float, stage: str = "backoff"):
+    """time.sleep that raises instead of sleeping past the deadline."""
+    left = remaining()
+    if left is not None and seconds >= left:
+        raise DeadlineExceeded(f"{stage} skipped: {seconds:g}s wait would outlast the deadline")
+    time.sleep(seconds)
+
+
+def requested_seconds(headers: list) -> float:
+    for name, value in headers:
+        if name.lower() == HEADER:
+            try:
+                seconds = float(value)
+            except ValueError:
+                break
+            if seconds > 0:
+                return min(seconds, MAX_SECONDS)
+            break
+    return min(DEFAULT_SECONDS, MAX_SECONDS)
+
+
+class DeadlineMiddleware:
+    """
+    Pure ASGI middleware (so the context variable reaches the endpoint's task). Answers 504
+    when the deadline passes before the response has started, and cancels the endpoint
+    without answering when the client disconnects.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        current = start(requested_seconds(scope.get("headers", [])))
+        body_done = asyncio.Event()
+        disconnected = asyncio.Event()
+        response_started = False
+
+        async def receive_wrapper():
+            if body_done.is_set():
+                # After the body only a disconnect can arrive; the watcher below owns receive()
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body", False):
+                body_done.set()
+            return message
+
+        async def send_wrapper(message):
+            nonlocal response_started
+            if current.cancelled:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        async def watch_disconnect():
+            await body_done.wait()
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+
+        app_task = asyncio.ensure_future(self.app(scope, receive_wrapper, send_wrapper))
+        watcher = asyncio.ensure_future(watch_disconnect())
+        gone = asyncio.ensure_future(disconnected.wait())
+        try:
+            done, _ = await asyncio.wait({app_task, gone}, timeout=current.remaining(),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if app_task in done:
+                return app_task.result()
+            if response_started:
+                # Too late to answer 504; let the response that is already streaming finish
+                return await app_task
+
+            current.cancelled = "client disconnected" if gone in done else f"deadline of {current.seconds:g}s exceeded"
+            print(f"{scope.get('path')}: {current.cancelled}, cancelling")
+            app_task.cancel()
+            if gone not in done:
+                response = JSONResponse(status_code=504, content={"detail": f"Request {current.cancelled}"})
+                await response(scope, receive, send)
+            # run_in_threadpool waits for its thread even when cancelled; threads bail out at their next check
+            try:
+                await app_task
+            except (asyncio.CancelledError, Exception):
+                pass
+        finally:
+            watcher.cancel()
+            gone.cancel()
@@ -1,34 +1,61 @@
-import google.generativeai as genai
 import os
 import json
-from PIL import Image
-import io
 from dotenv import load_dotenv
+from services.providers import GeminiProvider, get_gemini_provider
+from services import prompts
+from services.prompts import Prompt
+from services.image_pool import image_pool, ImagePoolBusy
+from services.circuit_breaker import breakers, CircuitOpenError, is_quota_error
+from services import deadline
+from services.deadline import DeadlineExceeded
+from services.response_models import as_list, health_assessment
 
 load_dotenv()
 
 class GeminiService:
-    def __init__(self):
-        self.api_key = os.getenv("GEMINI_API_KEY")
-        if not self.api_key:
+    def __init__(self, provider: GeminiProvider = None):
+        # GEMINI_API_KEYS (comma-separated) pools several keys; see providers.GeminiClientPool
+        self.api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GEMINI_API_KEYS", "").split(",")[0].strip()
+        # Images are downscaled to this longest edge before upload; Gemini tiles larger inputs anyway
+        self.max_image_edge = int(os.getenv("GEMINI_MAX_IMAGE_EDGE", 1536))
+        # Verification cascade: a cheap model + trimmed prompt first, the full forensic prompt only when needed
+        self.cascade_enabled = os.getenv("GEMINI_CASCADE", "1") != "0"
+        self.cascade_model = os.getenv("GEMINI_CASCADE_MODEL", "gemini-2.5-flash-lite")
+        self.cascade_min_confidence = float(os.getenv("GEMINI_CASCADE_MIN_CONFIDENCE", 0.85))
+        self.escalation_model = os.getenv("GEMINI_ESCALATION_MODEL") or None
+        # Fails calls fast once the provider is down or out of quota; see services/circuit_breaker.py
+        self.breaker = breakers["gemini"]
+        # Replay mode serves recorded responses, so it works without a key
+        replaying = os.getenv("PROVIDER_MODE", "live").lower() == "replay"
+        if provider:
+            self.provider = provider
+        elif not self.api_key and not replaying:
             print("Warning: GEMINI_API_KEY not set.")
+            self.provider = None
         else:
-            genai.configure(api_key=self.api_key)
             # Use gemini-2.5-flash to avoid 429 Quota limits (Pro has stricter limits)
-            self.model = genai.GenerativeModel('gemini-2.5-flash')
+            self.provider = get_gemini_provider(self.api_key)
+
+    def _generate(self, prompt: Prompt, images: list, model_name: str = None) -> str:
+        """Static instructions go in system_instruction (cacheable prefix); only the short user line varies."""
+        return self.breaker.call(
+            self.provider.generate_content, [prompt.user] + images, model_name, system_instruction=prompt.system
+        ).strip()
 
     def _prepare_images(self, images_data: list[bytes]) -> list:
-        """Helper to convert bytes to PIL Images"""
+        """Helper to convert bytes to downscaled JPEG blobs (prepared in the image pool)"""
         processed_images = []
         for img_bytes in images_data:
             try:
-                processed_images.append(Image.open(io.BytesIO(img_bytes)))
+                processed_images.append(image_pool.prepare_for_model(img_bytes, self.max_image_edge))
+            except ImagePoolBusy:
+                raise
             except Exception as e:
                 print(f"Error loading image: {e}")
         return processed_images
 
     def extract_features(self, image_bytes: bytes) -> dict:
-        if not self.api_key:
+        if not self.provider:
              return {"error": "Gemini API Key missing"}
 
         retries = 3
@@ -36,34 +63,8 @@ class GeminiService:
 
         for attempt in range(retries):
             try:
-                image = Image.open(io.BytesIO(image_bytes))
-                
-                prompt = """
-                You are an expert in product authentication. Analyze this image.
-                Extract the following details to help verify if it is authentic:
-                1. Brand Name
-                2. Product Name / Model
-                3. Packaging details (text, logo placement, colors)
-                4. A search query to find an official reference image of this exact product.
-
-                Return ONLY a valid JSON object with this structure:
-                {
-                    "brand": "string",
-                    "product_name": "string",
-                    "features": ["feature1", "feature2"],
-                    "search_query": "string"
-                }
-                Do not include markdown formatting like ```json ... ```. Just the raw JSON string.
-                """
-                
-                response = self.model.generate_content([prompt, image])
-                text = response.text.strip()
-                
-                # Cleanup markdown if present
-                if text and text.startswith("```json"):
-                    text = text[7:]
-                
-                text = response.text.strip()
+                image = image_pool.prepare_for_model(image_bytes, self.max_image_edge)
+                text = self._generate(prompts.FEATURES, [image])
                 
                 # Robust JSON extraction
                 json_match = re.search(r'\{.*\}', text, re.DOTALL)
@@ -78,6 +79,8 @@ class GeminiService:
                         text = text[:-3]
                     return json.loads(text)
             
+            except (ImagePoolBusy, CircuitOpenError, DeadlineExceeded):
+                raise
             except json.JSONDecodeError as e:
                 error_str = str(e)
                 print(f"Gemini API Error (Attempt {attempt+1}/{retries}): JSON Decode Error: {error_str}. Raw text: {text}")
@@ -87,11 +90,11 @@ class GeminiService:
                 print(f"Gemini API Error (Attempt {attempt+1}/{retries}): {error_str}")
                 
                 # Handle Quota/Rate Limits with exponential backoff
-                if "429" in error_str or "quota" in error_str.lower() or "resource exhausted" in error_str.lower():
+                if is_quota_error(e):
                     if attempt < retries - 1:
                         wait_time = delay * (2 ** attempt)
                         print(f"Rate limit hit. Retrying in {wait_time}s...")
-                        time.sleep(wait_time)
+                        deadline.sleep(wait_time, "gemini retry")
                         continue
             print(f"Gemini Identification Error: {e}")
             return "unknown product"
@@ -100,22 +103,16 @@ class GeminiService:
         """
         Identifies the product in the images (Front/Back) and returns a search query string.
         """
-        if not self.api_key:
+        if not self.provider:
              return "unknown product"
 
         try:
             images = self._prepare_images(images_data)
             if not images: return "unknown product"
-
-            prompt = """
-            Identify this product specifically for buying online. 
-            Analyze all provided images (Front, Back, Labels).
-            Return ONLY the product name (Brand + Model + Colorway if applicable).
-            Do not include any other text.
-            """
             
-            response = self.model.generate_content([prompt] + images)
-            return response.text.strip()
+            return self._generate(prompts.IDENTIFY, images)
+        except (ImagePoolBusy, CircuitOpenError, DeadlineExceeded):
+            raise
         except Exception as e:
             print(f"Gemini Identification Error: {e}")
             return "unknown product"
@@ -124,36 +121,21 @@ class GeminiService:
         """
         Analyzes images to provide detailed product specifications.
         """
-        if not self.api_key:
+        if not self.provider:
              return {"error": "Key missing"}
 
         try:
             images = self._prepare_images(images_data)
             if not images: return {"description": "No valid images.", "specs": []}
 
-            prompt = """
-            Analyze this product from all available views (Front, Back, etc.). 
-            Provide a comprehensive, engaging description.
-            
-            Return a JSON object with this structure:
-            {
-                "description": "A detailed 3-4 sentence paragraph describing the product, its key features, typical usage, and any notable history or brand reputation.",
-                "specs": [
-                    {"label": "Brand", "value": "string"},
-                    {"label": "Model", "value": "string"},
-                    {"label": "Type", "value": "string (e.g. Biscuit, Smartphone)"},
-                    {"label": "Key Ingredient/Material", "value": "string"},
-                    {"label": "Packaging", "value": "string description"}
-                ]
-            }
-            """
-            response = self.model.generate_content([prompt] + images)
-            text = response.text.strip()
+            text = self._generate(prompts.DETAILS, images)
             if text and text.startswith("```json"):
                 text = text[7:]
             if text and text.endswith("```"):
                 text = text[:-3]
             return json.loads(text)
+        except (ImagePoolBusy, CircuitOpenError, DeadlineExceeded):
+            raise
         except Exception as e:
             print(f"Gemini Details Error: {e}")
             return {"description": "Could not analyze product details.", "specs": []}
@@ -162,39 +144,15 @@ class GeminiService:
         """
         Compares the input image with a reference image using Gemini to detect counterfeit signs.
         """
-        if not self.api_key:
+        if not self.provider:
              return {"error": "Key missing"}
 
         try:
-            img1 = Image.open(io.BytesIO(input_image_bytes))
-            img2 = Image.open(io.BytesIO(reference_image_bytes))
-
-            prompt = """
-            You are an expert counterfeit investigator.
-            Image 1 is the suspect product (uploaded by user).
-            Image 2 is the official reference product (from a trusted source).
-
-            Compare them strictly. Look for differences in:
-            - Logo placement, font, and proportions
-            - Stitching quality and patterns
-            - Material texture and finish
-            - Color shade discrepancies
-            - Label details
-
-            If Image 2 is a generic or different product, state that comparison is invalid.
-
-            Return a JSON object:
-            {
-                "is_authentic": boolean,
-                "confidence_score": float (0.0 to 1.0),
-                "verdict": "Authentic", "Counterfeit", or "Inconclusive",
-                "discrepancies": ["list", "of", "visual", "differences"],
-                "reasoning": "Brief summary of why"
-            }
-            """
+            img1 = image_pool.prepare_for_model(input_image_bytes, self.max_image_edge)
+            img2 = image_pool.prepare_for_model(reference_image_bytes, self.max_image_edge)
 
-            response = self.model.generate_content([prompt, img1, img2])
-            text = response.text.strip()
+
+            text = self._generate(prompts.COMPARE, [img1, img2])
 
             if text and text.startswith("```json"):
                 text = text[7:]
@@ -202,105 +160,112 @@ class GeminiService:
                 text = text[:-3]
 
             return json.loads(text)
+        except (ImagePoolBusy, CircuitOpenError, DeadlineExceeded):
+            raise
         except Exception as e:
             print(f"Gemini Comparison Error: {e}")
             return {"error": str(e), "is_authentic": False, "confidence_score": 0.0, "verdict": "Error", "discrepancies": []}
 
-    def verify_product_authenticity(self, images_data: list[bytes]) -> dict:
+    def verify_product_authenticity(self, images_data: list[bytes], typosquat_hint: dict = None) -> dict:
         """
         Global Lead Forensic & Safety Authenticator Verification.
         Performs deep forensic & safety authentication using multiple views (Front/Back) if available.
+        With the cascade enabled, a cheap screening pass answers clear-cut cases and only
+        low-confidence / Suspicious results escalate to the full forensic prompt. A local
+        typosquat hint (TyposquatService.check) skips the screening pass.
+        Raises CircuitOpenError while Gemini's breaker is open so callers can degrade.
         """
-        if not self.api_key:
+        if not self.provider:
             return {"error": "Gemini API Key missing"}
 
         try:
             images = self._prepare_images(images_data)
             if not images: return {"error": "No valid images provided"}
+        except ImagePoolBusy:
+            raise
         except Exception as e:
             return {"error": f"Invalid image data: {str(e)}"}
 
-        # Define the Global Lead Forensic & Safety Authenticator Prompt
-        forensic_prompt = """
-        You are the Global Lead for Forensic Product Authentication and Consumer Safety. Your capability includes detecting 99.9% of high-quality counterfeits and identifying Health & Safety Risks in product components.
-
-        INPUT ANALYSIS:
-        You have been provided with one or more images.
-        - If Multiple Images: Treat them as different views (e.g., Front, Back, Side) of the SAME single product unit. Cross-reference them.
-        - Front View: Typically contains the main Logo, Brand Name, and Aesthetics.
-        - Back View: Typically contains Ingredients, Nutritional Info, Manufacturer Details, and Barcodes.
-
-        CORE ANALYSIS PROTOCOLS:
-        1. Typography Forensics: Analyze font weight, kerning, and serif details. Look for 'bleed' in printed text.
-        2. Colorimetry: Detect washed-out colors, incorrect gradients, or mismatched official brand palettes.
-        3. Material Physics: Analyze light reflection on packaging. Authentic plastic reflects differently than cheap laminate.
-        4. Ingredient & Safety Compliance (CRITICAL for Back View): Analyze extracted text for harmful ingredients, banned additives, or hazardous materials.
-        5. Data Correlation: Cross-check information between Front and Back (e.g., Brand on front matches Manufacturer on back).
-
-        OUTPUT REQUIREMENT:
-        You must return ONLY a raw JSON object. Do not include markdown formatting like ```json ... ```.
-
-        PERFORM DEEP FORENSIC & SAFETY AUTHENTICATION.
-
-        Target Information:
-        Claimed Brand: Unknown - Detect from Images
-        Category: Unknown - Detect from Images
-
-        EXECUTION STEPS:
-
-        1. OCR & Spell Check: Extract ALL visible text from ALL images.
-           - Detect 'Typosquatting' (e.g., 'Parle-J' vs 'Parle-G').
-           - Match Brand Name on Front with Manufacturer Info on Back.
-           Action: If a typo is found in the main logo, IMMEDIATE VERDICT: 'Counterfeit'.
-
-        2. Health & Safety Audit (Component Analysis):
-           - Food/Pharma: Scan the 'Ingredients' list. Flag Banned Substances (e.g., Potassium Bromate, Red 3). Flag Misleading Claims. Flag Allergen Warnings.
-           - Cosmetics: Look for hazardous chemicals like Hydroquinone, Mercury, or Steroids.
-           - Electronics/Toys: Look for missing 'CE', 'RoHS', or 'Non-Toxic' safety certifications.
-
-        3. Logo & Graphic Analysis:
-           - Is the logo pixelated? (Indicates scanning/reprinting).
-           - Are the regulatory logos (FSSAI, CE, FCC, Eco-marks) sharp and legally accurate?
-
-        4. QR/Barcode Scan:
-           - Analyze clarity. Is it a unique high-res code or a fuzzy static image?
-
-        JSON RESPONSE STRUCTURE:
-        {
-          "verdict": "Authentic" | "Counterfeit" | "Suspicious" | "Unverifiable",
-          "confidence_score": <float 0.0-1.0>,
-          "detected_brand": "<Name read from OCR>",
-          "category_detected": "<e.g., Food, Electronics>",
-          "forensic_flags": [
-            {
-              "check": "Spelling Check",
-              "status": "PASS" | "FAIL",
-              "observation": "Found 'Parle-J' instead of 'Parle-G'"
+        cascade = {"tier": "full", "escalated": False}
+        if self.cascade_enabled and typosquat_hint:
+            reason = f"typosquat hint: '{typosquat_hint['observed']}' near '{typosquat_hint['expected']}'"
+            print(f"Escalating to full forensic tier: {reason}")
+            cascade = {"tier": "full", "escalated": True, "escalation_reason": reason}
+        elif self.cascade_enabled:
+            screen = None
+            try:
+                screen = self._run_forensic(prompts.FORENSIC_SCREENING, images, self.cascade_model, retries=1)
+            except (CircuitOpenError, DeadlineExceeded):
+                raise
+            except Exception as e:
+                print(f"Cascade screening tier failed, escalating: {e}")
+                cascade = {"tier": "full", "escalated": True, "escalation_reason": f"screening failed: {e}"}
+            if screen is not None:
+                reason = self._escalation_reason(screen)
+                if reason is None:
+                    print(f"Verification answered by screening tier ({self.cascade_model}): "
+                          f"{screen.get('verdict')} @ {screen.get('confidence_score')}")
+                    return self._format_forensic(screen, {"tier": "screening", "model": self.cascade_model, "escalated": False,
+                                                         "prompt": prompts.FORENSIC_SCREENING.label})
+                print(f"Escalating to full forensic tier: {reason}")
+                cascade = {"tier": "full", "escalated": True, "escalation_reason": reason}
+                if isinstance(screen, dict):
+                    cascade.update(screening_verdict=screen.get("verdict"), screening_confidence=screen.get("confidence_score"))
+
+        try:
+            result = self._run_forensic(prompts.FORENSIC, images, self.escalation_model, retries=3)
+        except (CircuitOpenError, DeadlineExceeded):
+            raise
+        except Exception as e:
+            return self._verification_error(e)
+        if not isinstance(result, dict):
+            return self._verification_error(f"unexpected answer of type {type(result).__name__}")
+        cascade["model"] = self.escalation_model or "default"
+        cascade["prompt"] = prompts.FORENSIC.label
+        print(f"Verification answered by full tier ({cascade['model']}): {result.get('verdict')} @ {result.get('confidence_score')}")
+        try:
+            return self._format_forensic(result, cascade)
+        except Exception as e:
+            return self._verification_error(f"malformed answer: {e}")
+
+    def _verification_error(self, error) -> dict:
+        return {
+            "error": f"Verification failed: {str(error)}",
+            "product_info": {"brand": "Unknown", "model": "Unknown", "category": "Unknown"},
+            "verification": {
+                "is_authentic_guess": "Error",
+                "confidence_score": 0,
+                "anomalies_detected": ["System Error"],
+                "detailed_reasoning": f"Service unavailable: {str(error)}"
             }
-          ],
-          "health_safety_assessment": {
-            "risk_level": "Safe" | "Caution" | "High Risk" | "Critical",
-            "flagged_components": ["<Ingredient 1>", "<Ingredient 2>"],
-            "safety_warnings": ["<Specific warning, e.g., Contains High Sugar despite 'Healthy' claim>"]
-          },
-          "reasoning": "<Executive summary of the findings>",
-          "recommendation": "<Advice for the user>"
         }
-        """
 
+    def _escalation_reason(self, result: dict):
+        """Why a screening answer is not good enough, or None to accept it."""
+        if not isinstance(result, dict):
+            return f"unreadable screening answer ({type(result).__name__})"
+        verdict = result.get("verdict")
+        if verdict not in ("Authentic", "Counterfeit"):
+            return f"verdict {verdict}"
+        try:
+            confidence = float(result.get("confidence_score", 0))
+        except (TypeError, ValueError):
+            return "unreadable confidence_score"
+        if confidence < self.cascade_min_confidence:
+            return f"confidence {confidence:.2f} < {self.cascade_min_confidence:.2f}"
+        return None
+
+    def _run_forensic(self, prompt: Prompt, images: list, model_name: str = None, retries: int = 3) -> dict:
+        """Sends a forensic prompt and parses the JSON answer; quota errors back off and retry."""
         import time
-        retries = 3
+        import re
         delay = 5 # Reduced initial delay, will backoff
 
         for attempt in range(retries):
             try:
-                # Add 'Generate Content' configuration if needed, but default is usually fine
-                contents = [forensic_prompt] + images
-                response = self.model.generate_content(contents)
-                text = response.text.strip()
+                text = self._generate(prompt, images, model_name)
                 
                 # Robust JSON extraction
-                import re
                 json_match = re.search(r'\{.*\}', text, re.DOTALL)
                 if json_match:
                     json_str = json_match.group(0)
@@ -312,59 +277,63 @@ class GeminiService:
                     if text.endswith("```"):
                         text = text[:-3]
                     result = json.loads(text)
-                
-                # Basic validation of structure
-                if "verdict" not in result:
-                     # Attempt to map if the model drifted, or just raise error
-                     pass 
-
-                # Normalize output to match what frontend/backend expects if necessary
-                # The prompt returns specific keys, we might need to wrap them to match the API response structure 
-                # expected by verify code in main.py. 
-                # main.py expects: product_info, verification (is_authentic_guess, confidence_score, anomalies_detected, detailed_reasoning)
-                
-                # MAPPING ADAPTER
-                is_auth = "Authentic" if result.get("verdict") == "Authentic" else "Counterfeit"
-                if result.get("verdict") == "Suspicious": is_auth = "Counterfeit" # Treat suspicious as counterfeit-adjacent for safety
-                
-                formatted_result = {
-                    "product_info": {
-                        "brand": result.get("detected_brand", "Unknown"),
-                        "model": "Detected",
-                        "category": result.get("category_detected", "Unknown")
-                    },
-                    "verification": {
-                        "is_authentic_guess": is_auth,
-                        "confidence_score": int(result.get("confidence_score", 0) * 100),
-                        "anomalies_detected": [flag["observation"] for flag in result.get("forensic_flags", []) if flag["status"] == "FAIL"] + result.get("health_safety_assessment", {}).get("safety_warnings", []),
-                        "detailed_reasoning": result.get("reasoning", "") + "\n\nHealth Risk: " + result.get("health_safety_assessment", {}).get("risk_level", "Unknown")
-                    },
-                    # Include the raw new structure too if we want to use it later
-                    "raw_forensic_analysis": result
-                }
-                
-                return formatted_result
+                return result
 
+            except (CircuitOpenError, DeadlineExceeded):
+                # No point backing off and retrying while the breaker is open or the client has given up
+                raise
             except Exception as e:
-                error_msg = str(e)
-                if ("429" in error_msg or "quota" in error_msg.lower()) and attempt < retries - 1:
+                if is_quota_error(e) and attempt < retries - 1:
+                    if self.breaker.is_open():
+                        raise CircuitOpenError("gemini", self.breaker.reset_seconds) from e
                     print(f"Quota hit in verification. Retrying in {delay}s...")
-                    time.sleep(delay)
+                    deadline.sleep(delay, "gemini retry")
                     delay *= 2 
                     continue
                 
                 print(f"Verification error (Attempt {attempt+1}): {e}")
                 if attempt == retries - 1:
-                     return {
-                        "error": f"Verification failed: {str(e)}",
-                        "product_info": {"brand": "Unknown", "model": "Unknown", "category": "Unknown"},
-                        "verification": {
-                            "is_authentic_guess": "Error",
-                            "confidence_score": 0,
-                            "anomalies_detected": ["System Error"],
-                            "detailed_reasoning": f"Service unavailable: {str(e)}"
-                        }
-                    }
+                    raise
+
+    def _format_forensic(self, result: dict, cascade: dict) -> dict:
+        # Normalize output to match what frontend/backend expects
+        # main.py expects: product_info, verification (is_authentic_guess, confidence_score, anomalies_detected, detailed_reasoning)
+        
+        # MAPPING ADAPTER
+        is_auth = "Authentic" if result.get("verdict") == "Authentic" else "Counterfeit"
+        if result.get("verdict") == "Suspicious": is_auth = "Counterfeit" # Treat suspicious as counterfeit-adjacent for safety
+
+        # The model's JSON is not trusted to match the schema: "0.9" strings, missing keys, wrong types
+        try:
+            confidence = min(1.0, max(0.0, float(result.get("confidence_score") or 0)))
+        except (TypeError, ValueError):
+            confidence = 0.0
+        # Coerced in place too, since the raw answer is returned as raw_forensic_analysis
+        flags = result["forensic_flags"] = [f for f in as_list(result.get("forensic_flags")) if isinstance(f, dict)]
+        health = result["health_safety_assessment"] = dict(health_assessment(result.get("health_safety_assessment")))
+        for key in ("flagged_components", "safety_warnings"):
+            if key in health:
+                health[key] = as_list(health[key])
+        anomalies = [str(flag.get("observation")) for flag in flags
+                     if flag.get("status") == "FAIL" and flag.get("observation")]
+        anomalies += [str(w) for w in health.get("safety_warnings", [])]
+
+        return {
+            "product_info": {
+                "brand": result.get("detected_brand", "Unknown"),
+                "model": "Detected",
+                "category": result.get("category_detected", "Unknown")
+            },
+            "verification": {
+                "is_authentic_guess": is_auth,
+                "confidence_score": int(round(confidence * 100)),
+                "anomalies_detected": anomalies,
+                "detailed_reasoning": str(result.get("reasoning") or "") + "\n\nHealth Risk: " + str(health.get("risk_level") or "Unknown")
+            },
+            # Include the raw new structure too if we want to use it later
+            "raw_forensic_analysis": result,
+            "cascade": cascade
+        }
 
 gemini_service = GeminiService()
 
@@ -0,0 +1,385 @@
+"""
+Write-behind persistence of scan history.
+
+Endpoints call record() after building their response: it assigns the scan id, queues the
+scan and returns at once, so persistence adds no latency to the request. A background
+thread writes the queue in multi-row batches (see history_store) when HISTORY_BATCH_SIZE
+scans are waiting or the oldest has waited HISTORY_FLUSH_SECONDS, whichever comes first.
+
+Failed batches stay at the head of the queue and are retried with exponential backoff;
+rows have fixed ids and are inserted ignore-on-conflict, so a batch that partly landed
+before the failure is simply written again. A batch rejected outright (4xx, constraint
+violation) is retried row by row so one bad scan cannot block the rest. At most
+HISTORY_MAX_PENDING scans are held in memory while the store is down; beyond that the
+oldest are dropped and counted. The queue is flushed on shutdown.
+
+Only signed-in callers are recorded (scans belong to a user). GET /health/history shows
+queue depth, batch counts and the last error.
+
+stats() serves GET /stats from the rollup tables only (see history_store), so dashboard
+counts cost the same for a user with ten scans or ten thousand.
+
+page() serves GET /history with an opaque keyset cursor (the last item's created_at and id),
+so every page costs the same however far back the user scrolls. Scans still waiting in the
+queue are merged in, so a scan shows up in history (and in stats) as soon as its response
+is sent. Reads take their snapshot of the queue and query the store while no batch is being
+written (WriteBehindBuffer.reading), so a scan is never missed mid-write or counted twice.
+"""
+import base64
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+
+from fastapi import HTTPException
+
+from services.history_store import (
+    ScanRecord, HistoryFilter, authenticity_status, build_store, history_entry, rows_for, utc_now
+)
+from services.response_models import HistoryEntry, HistoryPage, StatCounts, DailyStats, StatsResponse
+
+load_dotenv()
+
+INPUT_TYPES = {"camera", "upload", "url", "video"}
+INTENTS = {"verify", "price", "details"}
+VERDICTS = {"genuine": "Genuine", "fake": "Fake", "uncertain": "Uncertain"}
+MAX_PAGE_SIZE = 100
+MAX_STATS_DAYS = 366
+
+
+def _retriable(error: Exception) -> bool:
+    if isinstance(error, sqlite3.IntegrityError):
+        return False
+    response = getattr(error, "response", None)
+    code = getattr(response, "status_code", None)
+    return code is None or not (400 <= code < 500 and code not in (408, 429))
+
+
+class WriteBehindBuffer:
+    def __init__(self, write, batch_size: int = 100, flush_seconds: float = 2.0, max_pending: int = 10000,
+                 max_backoff: float = 60.0, read_wait: float = 5.0):
+        self.write = write
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.max_backoff = max_backoff
+        self.pending = deque()          # (queued_at, item)
+        self.in_flight = []             # the batch being written
+        self.readers = 0                # reading() blocks in progress; no batch starts meanwhile
+        self.writer_waiting = False     # a due batch waits for readers; new readers queue behind it
+        self.read_wait = read_wait
+        self.cond = threading.Condition()
+        self.thread = None
+        self.stopping = False
+        self.retry_delay = 0.0
+        self.retry_at = 0.0
+        self.last_error = None
+        self.stats = {"queued": 0, "written": 0, "batches": 0, "failed_batches": 0, "rejected": 0, "dropped": 0}
+
+    def submit(self, item):
+        with self.cond:
+            if self.stopping:
+                self.stats["dropped"] += 1
+                return
+            if len(self.pending) >= self.max_pending:
+                self.pending.popleft()
+                self.stats["dropped"] += 1
+            self.pending.append((time.monotonic(), item))
+            self.stats["queued"] += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+                self.thread.start()
+            if len(self.pending) == 1 or len(self.pending) >= self.batch_size:
+                self.cond.notify_all()  # starts the flush timer, or flushes a full batch now
+
+    def _due(self, now: float):
+        if self.retry_delay:
+            return self.retry_at
+        if not self.pending:
+            return None
+        if len(self.pending) >= self.batch_size:
+            return now
+        return self.pending[0][0] + self.flush_seconds
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.stopping:
+                    now = time.monotonic()
+                    due = self._due(now)
+                    if due is not None and due <= now:
+                        break
+                    self.cond.wait(None if due is None else due - now)
+                if not self.pending:
+                    return      # only reached when stopping
+                # Let reads that already took their snapshot finish their store query first
+                self.writer_waiting = True
+                self.cond.wait_for(lambda: not self.readers)
+                self.writer_waiting = False
+                entries = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+                self.in_flight = [item for _, item in entries]
+
+            retry = self._flush(self.in_flight)
+
+            with self.cond:
+                self.in_flight = []
+                self.cond.notify_all()
+                if not retry:
+                    self.retry_delay = 0.0
+                    continue
+                if self.stopping:
+                    lost = len(retry) + len(self.pending)
+                    self.stats["dropped"] += lost
+                    print(f"History: store unavailable at shutdown, {lost} scans not written ({self.last_error})")
+                    return
+                # Back to the head of the queue, oldest first; trim from the oldest if over the cap
+                retry_ids = {id(item) for item in retry}
+                retried = [entry for entry in entries if id(entry[1]) in retry_ids]
+                self.pending.extendleft(reversed(retried))
+                while len(self.pending) > self.max_pending:
+                    self.pending.popleft()
+                    self.stats["dropped"] += 1
+                self.retry_delay = min(self.max_backoff, self.retry_delay * 2 or 0.5)
+                self.retry_at = time.monotonic() + self.retry_delay
+
+    def _flush(self, batch: list) -> list:
+        """Writes a batch; returns the items that should be retried later."""
+        start = time.perf_counter()
+        try:
+            self.write(batch)
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {str(e)[:200]}"
+            if _retriable(e):
+                self.stats["failed_batches"] += 1
+                print(f"History: batch of {len(batch)} failed, will retry ({self.last_error})")
+                return batch
+            # Something in the batch was refused: write one by one and drop only the offenders
+            retry = []
+            for item in batch:
+                try:
+                    self.write([item])
+                    self.stats["written"] += 1
+                except Exception as e:
+                    if _retriable(e):
+                        retry.append(item)
+                    else:
+                        self.stats["rejected"] += 1
+                        print(f"History: scan rejected by the store: {type(e).__name__}: {str(e)[:200]}")
+            if retry:
+                self.stats["failed_batches"] += 1
+            return retry
+        self.stats["written"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["last_batch_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        return []
+
+    def stop(self, timeout: float = 10.0):
+        """Flushes what is queued (one attempt per batch) and stops the writer thread."""
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+            thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def pending_items(self) -> list:
+        """Items not yet in the store: the batch being written, then the queue."""
+        with self.cond:
+            return self.in_flight + [item for _, item in self.pending]
+
+    @contextmanager
+    def reading(self):
+        """
+        Yields pending_items() for a read of the store made inside the block. No batch is
+        written between the snapshot and the end of the block, so every item is either in
+        the snapshot or in the store, never both. If a write takes longer than read_wait,
+        the snapshot includes its batch (visible, possibly also counted from the store).
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: not (self.in_flight or self.writer_waiting), self.read_wait)
+            self.readers += 1
+            items = self.in_flight + [item for _, item in self.pending]
+        try:
+            yield items
+        finally:
+            with self.cond:
+                self.readers -= 1
+                if not self.readers:
+                    self.cond.notify_all()
+
+    def snapshot(self) -> dict:
+        with self.cond:
+            return {
+                "pending": len(self.pending),
+                "oldest_pending_seconds": round(time.monotonic() - self.pending[0][0], 1) if self.pending else 0.0,
+                "retry_in_seconds": round(max(0.0, self.retry_at - time.monotonic()), 1) if self.retry_delay else 0.0,
+                "last_error": self.last_error,
+                **self.stats,
+            }
+
+
+class HistoryService:
+    def __init__(self):
+        self.store = build_store() if os.getenv("SCAN_HISTORY", "1") != "0" else None
+        self.buffer = WriteBehindBuffer(
+            self.store.write_batch if self.store else None,
+            batch_size=int(os.getenv("HISTORY_BATCH_SIZE", 100)),
+            flush_seconds=float(os.getenv("HISTORY_FLUSH_SECONDS", 2)),
+            max_pending=int(os.getenv("HISTORY_MAX_PENDING", 10000)),
+        )
+
+    @staticmethod
+    def _input_type(value: str, default: str) -> str:
+        value = (value or "").strip().lower()
+        return value if value in INPUT_TYPES else default
+
+    @staticmethod
+    def _image_url(value: str):
+        # The app uploads the photo to Storage itself and passes the public URL along
+        value = (value or "").strip()
+        return value if value.startswith(("https://", "http://")) and len(value) <= 2048 else None
+
+    def record(self, user_id: str, intent: str, response, input_type: str = None, image_url: str = None,
+               default_input_type: str = "upload"):
+        """Queues the scan for persistence; returns its id, or None when it is not recorded."""
+        if self.store is None or not user_id:
+            return None
+        scan_id = str(uuid.uuid4())
+        response.scan_id = scan_id
+        self.buffer.submit(ScanRecord(
+            scan_id=scan_id,
+            result_id=str(uuid.uuid4()),
+            user_id=user_id,
+            intent=intent,
+            input_type=self._input_type(input_type, default_input_type),
+            image_url=self._image_url(image_url),
+            created_at=utc_now(),
+            response=response,
+        ))
+        return scan_id
+
+    @staticmethod
+    def _timestamp(value: str, name: str, end_of_day: bool = False):
+        if not value:
+            return None
+        try:
+            moment = datetime.fromisoformat(value.strip())
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"{name} must be an ISO 8601 date or datetime")
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        if end_of_day and len(value.strip()) == 10:
+            moment += timedelta(days=1)     # until=2025-01-31 includes that whole day
+        return moment.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+    @staticmethod
+    def encode_cursor(entry: dict) -> str:
+        raw = f"{entry['created_at']}|{entry['scan_id']}".encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor: str):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+            created_at, scan_id = raw.split("|")
+            uuid.UUID(scan_id)
+            datetime.fromisoformat(created_at)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        return created_at, scan_id
+
+    def _filters(self, intent, input_type, verdict, since, until) -> HistoryFilter:
+        if intent and intent not in INTENTS:
+            raise HTTPException(status_code=400, detail=f"intent must be one of: {', '.join(sorted(INTENTS))}")
+        if input_type and input_type not in INPUT_TYPES:
+            raise HTTPException(status_code=400, detail=f"input_type must be one of: {', '.join(sorted(INPUT_TYPES))}")
+        if verdict and verdict.lower() not in VERDICTS:
+            raise HTTPException(status_code=400, detail=f"verdict must be one of: {', '.join(VERDICTS.values())}")
+        return HistoryFilter(intent or None, input_type or None, VERDICTS[verdict.lower()] if verdict else None,
+                             self._timestamp(since, "since"), self._timestamp(until, "until", end_of_day=True))
+
+    def _pending_entries(self, records: list, user_id: str, filters: HistoryFilter, after: tuple,
+                         with_metadata: bool) -> list:
+        entries = []
+        for record in records:
+            if record.user_id != user_id:
+                continue
+            rows = rows_for(record)
+            prices = sorted(rows["price_results"], key=lambda p: p["price"])
+            entry = history_entry(rows["scans"][0], rows["scan_results"][0], prices[0] if prices else None, with_metadata)
+            if ((filters.intent and entry["intent"] != filters.intent)
+                    or (filters.input_type and entry["input_type"] != filters.input_type)
+                    or (filters.verdict and entry["authenticity_status"] != filters.verdict)
+                    or (filters.since and entry["created_at"] < filters.since)
+                    or (filters.until and entry["created_at"] >= filters.until)
+                    or (after and (entry["created_at"], entry["scan_id"]) >= after)):
+                continue
+            entries.append(entry)
+        return entries
+
+    def page(self, user_id: str, intent: str = None, input_type: str = None, verdict: str = None,
+             since: str = None, until: str = None, cursor: str = None, limit: int = 20,
+             with_metadata: bool = False) -> HistoryPage:
+        """Newest-first page of the user's scans; next_cursor is None on the last page."""
+        if self.store is None:
+            raise HTTPException(status_code=503, detail="Scan history is not enabled on this server")
+        limit = max(1, min(MAX_PAGE_SIZE, limit))
+        filters = self._filters(intent, input_type, verdict, since, until)
+        after = self.decode_cursor(cursor) if cursor else None
+        with self.buffer.reading() as records:
+            # One extra row tells whether there is a next page
+            entries = self.store.history(user_id, filters, after, limit + 1, with_metadata)
+        pending = self._pending_entries(records, user_id, filters, after, with_metadata)
+        if pending:
+            stored = {e["scan_id"] for e in entries}
+            entries = sorted(entries + [e for e in pending if e["scan_id"] not in stored],
+                             key=lambda e: (e["created_at"], e["scan_id"]), reverse=True)[:limit + 1]
+        next_cursor = self.encode_cursor(entries[limit - 1]) if len(entries) > limit else None
+        return HistoryPage(items=[HistoryEntry(**e) for e in entries[:limit]], next_cursor=next_cursor)
+
+    def stats(self, user_id: str, days: int = 30) -> StatsResponse:
+        """All-time and per-day scan / verdict counts for the user, read from the rollups."""
+        if self.store is None:
+            raise HTTPException(status_code=503, detail="Scan history is not enabled on this server")
+        days = max(1, min(MAX_STATS_DAYS, days))
+        today = datetime.now(timezone.utc).date()
+        since = (today - timedelta(days=days - 1)).isoformat()
+        with self.buffer.reading() as records:
+            totals, daily_rows = self.store.stats(user_id, since)
+
+        total, period = StatCounts(), StatCounts()
+        daily = {(today - timedelta(days=i)).isoformat(): StatCounts() for i in range(days)}
+        for row in totals:
+            total.add(row["intent"], row)
+        for row in daily_rows:
+            period.add(row["intent"], row)
+            if row["day"] in daily:
+                daily[row["day"]].add(row["intent"], row)
+        # Scans still waiting in the write-behind queue count already
+        for record in records:
+            if record.user_id != user_id:
+                continue
+            status = authenticity_status(record)
+            counts = {"scans": 1, (status or "").lower(): 1}
+            total.add(record.intent, counts)
+            day = record.created_at[:10]
+            if day >= since:
+                period.add(record.intent, counts)
+                if day in daily:
+                    daily[day].add(record.intent, counts)
+        return StatsResponse(total=total, period=period, days=days, since=since,
+                             daily=[DailyStats(day, counts) for day, counts in sorted(daily.items())])
+
+    def shutdown(self):
+        self.buffer.stop()
+
+    def snapshot(self) -> dict:
+        return {"backend": self.store.name if self.store else None, **self.buffer.snapshot()}
+
+
+history_service = HistoryService()
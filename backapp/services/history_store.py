@@ -0,0 +1,418 @@
+"""
+Scan history storage: rows for `scans`, `scan_results` and `price_results`.
+
+Two backends with the same write_batch(records) interface:
+- SupabaseHistoryStore: PostgREST bulk inserts with the service-role key, one request per
+  table per batch. Rows carry client-generated UUIDs and are sent with
+  `Prefer: resolution=ignore-duplicates`, so re-sending a batch after a failure is harmless.
+- SqliteHistoryStore: local stand-in with the same tables (HISTORY_SQLITE_PATH), used when
+  no service-role key is configured. INSERT OR IGNORE gives the same idempotency.
+
+Row building happens here, on the writer thread, not in the request.
+
+history() reads a page of a user's scans joined with their result, newest first, with keyset
+pagination on (created_at, id): each page is one index range scan of
+(user_id, created_at desc, id desc), or (user_id, intent, created_at desc, id desc) when
+filtered by intent, however deep the page is. These are seek indexes, not covering ones:
+the page's other scan columns are read from the table for the rows it returns, since
+website_url arrives unbounded from the app and would not fit in an index entry. The
+cheapest price of a price scan is index-only, one seek on price_results
+(scan_id, price) carrying currency.
+
+Dashboard counts come from two rollup tables kept up to date by triggers as rows are
+written: scan_stats_daily (user, UTC day, intent) and scan_stats_total (user, intent), each
+with a scan count and Genuine / Fake / Uncertain result counts. Inserts that are ignored as
+duplicates fire no trigger, so retried batches are not counted twice; deleting a scan
+subtracts it again. stats() reads only these rows, never the scans themselves.
+"""
+import os
+import sqlite3
+import threading
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import orjson
+import requests
+
+JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+TABLES = ("scans", "scan_results", "price_results")   # insert order (foreign keys)
+
+# One scan as captured by an endpoint; `response` is the endpoint's response model
+ScanRecord = namedtuple("ScanRecord", ["scan_id", "result_id", "user_id", "intent", "input_type",
+                                       "image_url", "created_at", "response"])
+
+# verify verdicts -> the schema's authenticity_status values
+STATUS = {"Authentic": "Genuine", "Counterfeit": "Fake", "Suspicious": "Fake"}
+
+HistoryFilter = namedtuple("HistoryFilter", ["intent", "input_type", "verdict", "since", "until"])
+
+STAT_COLUMNS = ("scans", "genuine", "fake", "uncertain")
+
+
+def utc_now() -> str:
+    # Fixed-width ISO 8601 so text comparison in SQLite orders like the timestamptz column
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+
+def _known(value):
+    return value if value and value != "Unknown" else None
+
+
+def authenticity_status(record: ScanRecord):
+    if record.intent != "verify":
+        return None
+    return STATUS.get(record.response.verification_result.verdict, "Uncertain")
+
+
+def rows_for(record: ScanRecord) -> dict:
+    """Table name -> rows for one scan."""
+    response = record.response
+    result = {
+        "id": record.result_id,
+        "scan_id": record.scan_id,
+        "authenticity_status": None,
+        "confidence_score": None,
+        "product_name": None,
+        "brand": None,
+        "metadata": response,
+        "created_at": record.created_at,
+    }
+    prices = []
+    if record.intent == "verify":
+        info, verification = response.product_info, response.verification_result
+        result["authenticity_status"] = authenticity_status(record)
+        result["confidence_score"] = verification.confidence_score
+        result["brand"] = _known(info.brand)
+        result["product_name"] = " ".join(p for p in (_known(info.brand), _known(info.model)) if p) or None
+    elif record.intent == "price":
+        result["product_name"] = response.product_name
+        prices = [{
+            # Derived ids keep price rows idempotent across retries too
+            "id": str(uuid.uuid5(uuid.UUID(record.scan_id), str(i))),
+            "scan_id": record.scan_id,
+            "seller": p.seller,
+            "price": p.price,
+            "currency": p.currency,
+            "availability": None,
+            "created_at": record.created_at,
+        } for i, p in enumerate(response.prices)]
+    scan = {
+        "id": record.scan_id,
+        "user_id": record.user_id,
+        "input_type": record.input_type,
+        "intent": record.intent,
+        "image_url": record.image_url,
+        "website_url": None,
+        "created_at": record.created_at,
+    }
+    return {"scans": [scan], "scan_results": [result], "price_results": prices}
+
+
+def history_entry(scan: dict, result: dict, best: dict = None, with_metadata: bool = False) -> dict:
+    """One history list item, flattened from a scan, its result and its cheapest price."""
+    result, best = result or {}, best or {}
+    return {
+        "scan_id": scan["id"],
+        "created_at": scan["created_at"],
+        "intent": scan["intent"],
+        "input_type": scan["input_type"],
+        "image_url": scan.get("image_url"),
+        "website_url": scan.get("website_url"),
+        "product_name": result.get("product_name"),
+        "brand": result.get("brand"),
+        "authenticity_status": result.get("authenticity_status"),
+        "confidence_score": result.get("confidence_score"),
+        "best_price": best.get("price"),
+        "currency": best.get("currency"),
+        "metadata": result.get("metadata") if with_metadata else None,
+    }
+
+
+def batch_rows(records: list) -> dict:
+    tables = {name: [] for name in TABLES}
+    for record in records:
+        for name, rows in rows_for(record).items():
+            tables[name].extend(rows)
+    return tables
+
+
+class SupabaseHistoryStore:
+    name = "supabase"
+
+    def __init__(self, url: str, service_key: str, timeout: float = 10.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({
+            "apikey": service_key,
+            "Authorization": f"Bearer {service_key}",
+            "Content-Type": "application/json",
+            "Prefer": "resolution=ignore-duplicates,return=minimal",
+        })
+
+    def write_batch(self, records: list):
+        for name, rows in batch_rows(records).items():
+            if rows:
+                response = self.session.post(f"{self.url}/rest/v1/{name}", data=orjson.dumps(rows, option=JSON_OPTIONS),
+                                             timeout=self.timeout)
+                response.raise_for_status()
+
+    def history(self, user_id: str, filters: HistoryFilter, after: tuple, limit: int, with_metadata: bool = False) -> list:
+        # The service key bypasses row-level security, so the user filter here is the access check
+        result_columns = "authenticity_status,confidence_score,product_name,brand" + (",metadata" if with_metadata else "")
+        embed = "scan_results!inner" if filters.verdict else "scan_results"
+        params = [
+            ("select", f"id,created_at,intent,input_type,image_url,website_url,{embed}({result_columns}),price_results(price,currency)"),
+            ("user_id", f"eq.{user_id}"),
+            ("price_results.order", "price.asc"),
+            ("price_results.limit", "1"),
+            ("order", "created_at.desc,id.desc"),
+            ("limit", str(limit)),
+        ]
+        if filters.intent:
+            params.append(("intent", f"eq.{filters.intent}"))
+        if filters.input_type:
+            params.append(("input_type", f"eq.{filters.input_type}"))
+        if filters.verdict:
+            params.append(("scan_results.authenticity_status", f"eq.{filters.verdict}"))
+        if filters.since:
+            params.append(("created_at", f"gte.{filters.since}"))
+        if filters.until:
+            params.append(("created_at", f"lt.{filters.until}"))
+        if after:
+            created_at, scan_id = after
+            params.append(("or", f'(created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{scan_id}))'))
+        response = self.session.get(f"{self.url}/rest/v1/scans", params=params, timeout=self.timeout)
+        response.raise_for_status()
+        entries = []
+        for row in response.json():
+            # Postgres trims trailing zeros off the fraction; keep the fixed-width form used everywhere else
+            row["created_at"] = datetime.fromisoformat(row["created_at"]).astimezone(timezone.utc).isoformat(timespec="microseconds")
+            results, prices = row.get("scan_results") or [], row.get("price_results") or []
+            entries.append(history_entry(row, results[0] if results else None, prices[0] if prices else None, with_metadata))
+        return entries
+
+    def stats(self, user_id: str, since_day: str):
+        """(all-time rows per intent, daily rows per intent since since_day) from the rollups."""
+        select = "intent," + ",".join(STAT_COLUMNS)
+        totals = self.session.get(f"{self.url}/rest/v1/scan_stats_total",
+                                  params={"select": select, "user_id": f"eq.{user_id}"}, timeout=self.timeout)
+        totals.raise_for_status()
+        daily = self.session.get(f"{self.url}/rest/v1/scan_stats_daily",
+                                 params={"select": "day," + select, "user_id": f"eq.{user_id}",
+                                         "day": f"gte.{since_day}", "order": "day.asc"}, timeout=self.timeout)
+        daily.raise_for_status()
+        return totals.json(), daily.json()
+
+
+class SqliteHistoryStore:
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS scans (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            input_type TEXT,
+            intent TEXT,
+            image_url TEXT,
+            website_url TEXT,
+            created_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS scan_results (
+            id TEXT PRIMARY KEY,
+            scan_id TEXT REFERENCES scans(id) ON DELETE CASCADE,
+            authenticity_status TEXT,
+            confidence_score REAL,
+            product_name TEXT,
+            brand TEXT,
+            metadata TEXT,
+            created_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS price_results (
+            id TEXT PRIMARY KEY,
+            scan_id TEXT REFERENCES scans(id) ON DELETE CASCADE,
+            seller TEXT,
+            price REAL,
+            currency TEXT,
+            availability TEXT,
+            created_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS scans_user_created_idx ON scans (user_id, created_at DESC, id DESC);
+        CREATE INDEX IF NOT EXISTS scans_user_intent_created_idx ON scans (user_id, intent, created_at DESC, id DESC);
+        CREATE INDEX IF NOT EXISTS scan_results_scan_idx ON scan_results (scan_id);
+        DROP INDEX IF EXISTS price_results_scan_price_idx;
+        CREATE INDEX IF NOT EXISTS price_results_scan_price_currency_idx ON price_results (scan_id, price, currency);
+
+        CREATE TABLE IF NOT EXISTS scan_stats_daily (
+            user_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            intent TEXT NOT NULL,
+            scans INTEGER NOT NULL DEFAULT 0,
+            genuine INTEGER NOT NULL DEFAULT 0,
+            fake INTEGER NOT NULL DEFAULT 0,
+            uncertain INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, intent)
+        );
+        CREATE TABLE IF NOT EXISTS scan_stats_total (
+            user_id TEXT NOT NULL,
+            intent TEXT NOT NULL,
+            scans INTEGER NOT NULL DEFAULT 0,
+            genuine INTEGER NOT NULL DEFAULT 0,
+            fake INTEGER NOT NULL DEFAULT 0,
+            uncertain INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, intent)
+        );
+
+        CREATE TRIGGER IF NOT EXISTS scans_stats_insert AFTER INSERT ON scans BEGIN
+            INSERT INTO scan_stats_daily (user_id, day, intent, scans)
+            VALUES (NEW.user_id, substr(NEW.created_at, 1, 10), NEW.intent, 1)
+            ON CONFLICT (user_id, day, intent) DO UPDATE SET scans = scans + 1;
+            INSERT INTO scan_stats_total (user_id, intent, scans)
+            VALUES (NEW.user_id, NEW.intent, 1)
+            ON CONFLICT (user_id, intent) DO UPDATE SET scans = scans + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS scan_results_stats_insert AFTER INSERT ON scan_results
+        WHEN NEW.authenticity_status IN ('Genuine', 'Fake', 'Uncertain') BEGIN
+            INSERT INTO scan_stats_daily (user_id, day, intent, genuine, fake, uncertain)
+            SELECT s.user_id, substr(s.created_at, 1, 10), s.intent, NEW.authenticity_status = 'Genuine',
+                   NEW.authenticity_status = 'Fake', NEW.authenticity_status = 'Uncertain'
+            FROM scans s WHERE s.id = NEW.scan_id
+            ON CONFLICT (user_id, day, intent) DO UPDATE SET genuine = genuine + excluded.genuine,
+                fake = fake + excluded.fake, uncertain = uncertain + excluded.uncertain;
+            INSERT INTO scan_stats_total (user_id, intent, genuine, fake, uncertain)
+            SELECT s.user_id, s.intent, NEW.authenticity_status = 'Genuine',
+                   NEW.authenticity_status = 'Fake', NEW.authenticity_status = 'Uncertain'
+            FROM scans s WHERE s.id = NEW.scan_id
+            ON CONFLICT (user_id, intent) DO UPDATE SET genuine = genuine + excluded.genuine,
+                fake = fake + excluded.fake, uncertain = uncertain + excluded.uncertain;
+        END;
+
+        -- BEFORE so the scan's results (deleted by the cascade) can still be counted
+        CREATE TRIGGER IF NOT EXISTS scans_stats_delete BEFORE DELETE ON scans BEGIN
+            UPDATE scan_stats_daily SET scans = scans - 1,
+                genuine = genuine - (SELECT count(*) FROM scan_results WHERE scan_id = OLD.id AND authenticity_status = 'Genuine'),
+                fake = fake - (SELECT count(*) FROM scan_results WHERE scan_id = OLD.id AND authenticity_status = 'Fake'),
+                uncertain = uncertain - (SELECT count(*) FROM scan_results WHERE scan_id = OLD.id AND authenticity_status = 'Uncertain')
+            WHERE user_id = OLD.user_id AND day = substr(OLD.created_at, 1, 10) AND intent = OLD.intent;
+            UPDATE scan_stats_total SET scans = scans - 1,
+                genuine = genuine - (SELECT count(*) FROM scan_results WHERE scan_id = OLD.id AND authenticity_status = 'Genuine'),
+                fake = fake - (SELECT count(*) FROM scan_results WHERE scan_id = OLD.id AND authenticity_status = 'Fake'),
+                uncertain = uncertain - (SELECT count(*) FROM scan_results WHERE scan_id = OLD.id AND authenticity_status = 'Uncertain')
+            WHERE user_id = OLD.user_id AND intent = OLD.intent;
+        END;
+    """
+
+    # One-off fill of the rollups for a history database created before they existed
+    BACKFILL = """
+        INSERT INTO scan_stats_daily (user_id, day, intent, scans, genuine, fake, uncertain)
+        SELECT s.user_id, substr(s.created_at, 1, 10), s.intent, count(DISTINCT s.id),
+               coalesce(sum(r.authenticity_status = 'Genuine'), 0), coalesce(sum(r.authenticity_status = 'Fake'), 0),
+               coalesce(sum(r.authenticity_status = 'Uncertain'), 0)
+        FROM scans s LEFT JOIN scan_results r ON r.scan_id = s.id
+        GROUP BY s.user_id, substr(s.created_at, 1, 10), s.intent;
+        INSERT INTO scan_stats_total (user_id, intent, scans, genuine, fake, uncertain)
+        SELECT user_id, intent, sum(scans), sum(genuine), sum(fake), sum(uncertain)
+        FROM scan_stats_daily GROUP BY user_id, intent;
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.SCHEMA)
+            if (conn.execute("SELECT 1 FROM scans LIMIT 1").fetchone()
+                    and not conn.execute("SELECT 1 FROM scan_stats_total LIMIT 1").fetchone()):
+                conn.executescript(self.BACKFILL)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            conn.execute("PRAGMA foreign_keys=ON")
+            with conn:  # commits on success
+                yield conn
+        finally:
+            conn.close()
+
+    def write_batch(self, records: list):
+        tables = batch_rows(records)
+        for row in tables["scan_results"]:
+            row["metadata"] = orjson.dumps(row["metadata"], option=JSON_OPTIONS).decode("utf-8")
+        with self.lock, self._connect() as conn:
+            # One transaction for the whole batch
+            for name in TABLES:
+                rows = tables[name]
+                if rows:
+                    columns = list(rows[0])
+                    conn.executemany(
+                        f"INSERT OR IGNORE INTO {name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                        [tuple(row[c] for c in columns) for row in rows],
+                    )
+
+    def history(self, user_id: str, filters: HistoryFilter, after: tuple, limit: int, with_metadata: bool = False) -> list:
+        where, args = ["s.user_id = ?"], [user_id]
+        for column, value in (("s.intent", filters.intent), ("s.input_type", filters.input_type),
+                              ("r.authenticity_status", filters.verdict)):
+            if value:
+                where.append(f"{column} = ?")
+                args.append(value)
+        if filters.since:
+            where.append("s.created_at >= ?")
+            args.append(filters.since)
+        if filters.until:
+            where.append("s.created_at < ?")
+            args.append(filters.until)
+        if after:
+            where.append("(s.created_at, s.id) < (?, ?)")
+            args.extend(after)
+        sql = f"""
+            SELECT s.id, s.created_at, s.intent, s.input_type, s.image_url, s.website_url,
+                   r.authenticity_status, r.confidence_score, r.product_name, r.brand,
+                   {"r.metadata" if with_metadata else "NULL"} AS metadata,
+                   (SELECT p.price FROM price_results p WHERE p.scan_id = s.id ORDER BY p.price LIMIT 1) AS price,
+                   (SELECT p.currency FROM price_results p WHERE p.scan_id = s.id ORDER BY p.price LIMIT 1) AS currency
+            FROM scans s LEFT JOIN scan_results r ON r.scan_id = s.id
+            WHERE {" AND ".join(where)}
+            ORDER BY s.created_at DESC, s.id DESC
+            LIMIT ?
+        """
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = [dict(row) for row in conn.execute(sql, (*args, limit))]
+        for row in rows:
+            if row["metadata"]:
+                row["metadata"] = orjson.loads(row["metadata"])
+        return [history_entry(row, row, row, with_metadata) for row in rows]
+
+    def stats(self, user_id: str, since_day: str):
+        """(all-time rows per intent, daily rows per intent since since_day) from the rollups."""
+        columns = ", ".join(STAT_COLUMNS)
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            totals = conn.execute(f"SELECT intent, {columns} FROM scan_stats_total WHERE user_id = ?", (user_id,))
+            daily = conn.execute(f"SELECT day, intent, {columns} FROM scan_stats_daily WHERE user_id = ? AND day >= ? "
+                                 "ORDER BY day", (user_id, since_day))
+            return [dict(row) for row in totals], [dict(row) for row in daily]
+
+
+def build_store():
+    """Store for HISTORY_BACKEND (supabase / sqlite / off); defaults to Supabase when a service key is set."""
+    url = os.getenv("SUPABASE_URL") or os.getenv("EXPO_PUBLIC_SUPABASE_URL")
+    service_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+    backend = os.getenv("HISTORY_BACKEND") or ("supabase" if url and service_key else "sqlite")
+    if backend == "supabase":
+        if not (url and service_key):
+            print("History: HISTORY_BACKEND=supabase needs SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY; history disabled")
+            return None
+        return SupabaseHistoryStore(url, service_key, float(os.getenv("HISTORY_WRITE_TIMEOUT", 10)))
+    if backend == "sqlite":
+        return SqliteHistoryStore(os.getenv(
+            "HISTORY_SQLITE_PATH",
+            os.path.join(os.path.dirname(os.path.dirname(__file__)), "history.db")
+        ))
+    return None
@@ -0,0 +1,237 @@
+"""
+Concurrent image downloads with an on-disk HTTP cache.
+
+Used for reference images and shopping thumbnails. Each URL is stored as
+<sha256>.img plus <sha256>.json metadata (ETag / Last-Modified). Entries younger than
+IMAGE_CACHE_TTL_SECONDS are served without touching the network; older ones are
+revalidated with a conditional GET, and a 304 re-uses the cached bytes. The cache is capped
+at IMAGE_CACHE_MAX_BYTES / IMAGE_CACHE_MAX_ENTRIES; past either, the least recently used
+entries (by file mtime, refreshed on every hit) are deleted.
+
+URLs come from third-party search results, so each one (and every redirect hop) must
+resolve to public addresses only: private, loopback, link-local (169.254.169.254 ...) and
+other reserved ranges are refused. IMAGE_FETCH_ALLOW_PRIVATE=1 lifts that for local stubs.
+"""
+import hashlib
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urljoin, urlsplit
+from dotenv import load_dotenv
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services import deadline
+from services.upload_service import detect_image_format
+
+load_dotenv()
+
+MB = 1024 * 1024
+MAX_REDIRECTS = 3
+ALLOW_PRIVATE = os.getenv("IMAGE_FETCH_ALLOW_PRIVATE", "0") == "1"
+
+
+class BlockedAddress(ValueError):
+    """The URL's host resolves to an address that must not be fetched from search results."""
+
+
+def check_public_url(url: str):
+    """Raises BlockedAddress unless every address the URL's host resolves to is public."""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise BlockedAddress(f"not an http(s) URL: {url[:80]}")
+    if ALLOW_PRIVATE:
+        return
+    try:
+        infos = socket.getaddrinfo(parts.hostname, parts.port or (443 if parts.scheme == "https" else 80),
+                                   proto=socket.IPPROTO_TCP)
+    except socket.gaierror as e:
+        raise BlockedAddress(f"cannot resolve {parts.hostname}: {e}")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            raise BlockedAddress(f"{parts.hostname} resolves to non-public address {address}")
+
+
+def get_public(session, url: str, **kwargs):
+    """session.get that follows redirects itself, checking each hop with check_public_url."""
+    for _ in range(MAX_REDIRECTS + 1):
+        check_public_url(url)
+        response = session.get(url, allow_redirects=False, **kwargs)
+        if not response.is_redirect:
+            return response
+        location = response.headers.get("Location")
+        response.close()
+        url = urljoin(url, location)
+    raise BlockedAddress(f"more than {MAX_REDIRECTS} redirects")
+
+
+class ImageFetcher:
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = cache_dir or os.getenv(
+            "IMAGE_CACHE_DIR",
+            os.path.join(os.path.dirname(os.path.dirname(__file__)), "image_cache")
+        )
+        self.ttl = float(os.getenv("IMAGE_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+        self.max_bytes = int(os.getenv("IMAGE_FETCH_MAX_BYTES", 8 * MB))
+        self.timeout = float(os.getenv("IMAGE_FETCH_TIMEOUT", 5))
+        self.max_workers = int(os.getenv("IMAGE_FETCH_WORKERS", 8))
+        self.cache_max_bytes = int(os.getenv("IMAGE_CACHE_MAX_BYTES", 512 * MB))
+        self.cache_max_entries = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", 5000))
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = "Mozilla/5.0 (compatible; Countify/1.0)"
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="image-fetch")
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "revalidated": 0, "downloaded": 0, "failed": 0, "blocked": 0, "evicted": 0}
+        self.cache_bytes, self.cache_entries = self._usage()
+
+    def _paths(self, url: str):
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.cache_dir, digest)
+        return base + ".img", base + ".json"
+
+    def _count(self, key: str):
+        with self.lock:
+            self.stats[key] += 1
+
+    def _usage(self):
+        total, entries = 0, 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".img"):
+                entries += 1
+            total += entry.stat().st_size
+        return total, entries
+
+    def _evict(self):
+        """Deletes least recently used entries until the cache is back under 90% of its caps."""
+        files = {}
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith((".img", ".json")):
+                stat = entry.stat()
+                digest = entry.name.rsplit(".", 1)[0]
+                size, mtime = files.get(digest, (0, 0.0))
+                files[digest] = (size + stat.st_size, max(mtime, stat.st_mtime))
+        total, entries = sum(size for size, _ in files.values()), len(files)
+        for digest, (size, _) in sorted(files.items(), key=lambda item: item[1][1]):
+            if total <= 0.9 * self.cache_max_bytes and entries <= 0.9 * self.cache_max_entries:
+                break
+            for suffix in (".img", ".json"):
+                try:
+                    os.remove(os.path.join(self.cache_dir, digest + suffix))
+                except OSError:
+                    pass
+            total -= size
+            entries -= 1
+            self.stats["evicted"] += 1
+        self.cache_bytes, self.cache_entries = total, entries
+
+    def _load(self, url: str):
+        data_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(data_path, "rb") as f:
+                data = f.read()
+            os.utime(data_path)     # mtime doubles as the LRU clock
+            return data, meta
+        except (OSError, ValueError):
+            return None, None
+
+    def _store(self, url: str, data: bytes, meta: dict):
+        data_path, meta_path = self._paths(url)
+        existed = os.path.exists(data_path)
+        # Write-then-rename so concurrent readers never see a partial file
+        for path, payload, mode in ((data_path, data, "wb"), (meta_path, json.dumps(meta).encode("utf-8"), "wb")):
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, mode) as f:
+                f.write(payload)
+            os.replace(tmp, path)
+        if existed:
+            return      # a revalidated entry: same bytes, already counted
+        with self.lock:
+            self.cache_bytes += len(data)
+            self.cache_entries += 1
+            if self.cache_bytes > self.cache_max_bytes or self.cache_entries > self.cache_max_entries:
+                self._evict()
+
+    def fetch(self, url: str, timeout: float = None):
+        """Image bytes for the URL (from cache when fresh or not modified), or None."""
+        if not url or not url.startswith(("http://", "https://")):
+            return None
+        cached, meta = self._load(url)
+        if cached is not None and time.time() - meta.get("fetched_at", 0) < self.ttl:
+            self._count("hits")
+            return cached
+
+        headers = {}
+        if cached is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            with get_public(self.session, url, headers=headers, timeout=timeout or self.timeout, stream=True) as response:
+                if response.status_code == 304 and cached is not None:
+                    meta["fetched_at"] = time.time()
+                    self._store(url, cached, meta)
+                    self._count("revalidated")
+                    return cached
+                response.raise_for_status()
+                buffer = bytearray()
+                for chunk in response.iter_content(64 * 1024):
+                    buffer.extend(chunk)
+                    if len(buffer) > self.max_bytes:
+                        raise ValueError(f"larger than {self.max_bytes // MB} MB")
+                data = bytes(buffer)
+                if not detect_image_format(data[:16]):
+                    raise ValueError("not a JPEG/PNG/WEBP image")
+                self._store(url, data, {
+                    "url": url,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "fetched_at": time.time(),
+                })
+                self._count("downloaded")
+                return data
+        except BlockedAddress as e:
+            self._count("blocked")
+            print(f"Image fetch refused: {e}")
+            return cached
+        except Exception as e:
+            self._count("failed")
+            print(f"Image fetch failed for {url[:80]}: {e}")
+            # A stale copy is better than nothing if the origin is down
+            return cached
+
+    def fetch_many(self, urls: list, timeout: float = None) -> dict:
+        """
+        Fetches URLs concurrently; returns {url: bytes} for those that arrived within the timeout
+        (capped at the request deadline). Worker threads don't see the request's context, so
+        the remaining time is passed down as the per-download timeout.
+        """
+        left = deadline.remaining()
+        if left is not None:
+            timeout = left if timeout is None else min(timeout, left)
+        per_url = None if timeout is None else max(0.5, min(self.timeout, timeout))
+        unique = list(dict.fromkeys(u for u in urls if u))
+        futures = {self.executor.submit(self.fetch, url, per_url): url for url in unique}
+        done, _ = wait(futures, timeout=timeout)
+        results = {}
+        for future in done:
+            data = future.result()
+            if data is not None:
+                results[futures[future]] = data
+        return results
+
+
+image_fetcher = ImageFetcher()
@@ -0,0 +1,238 @@
+"""
+Managed process pool for CPU-bound image preprocessing.
+
+Decoding, resizing, JPEG re-encoding and ResNet preprocessing hold the GIL, so they
+run in worker processes instead of on the request path. Compressed input bytes and
+the compact outputs (downscaled JPEG, 224x224 float tensor) cross the process
+boundary through shared memory blocks; only the block names and shapes are pickled.
+
+This module is imported by the workers, so it must stay light (PIL + NumPy only).
+"""
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+from fastapi import HTTPException
+from dotenv import load_dotenv
+
+from services import deadline
+from services.deadline import DeadlineExceeded
+from services.image_utils import decode_image
+
+load_dotenv()
+
+# ImageNet normalisation used by the ResNet50 embedding model
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32).reshape(3, 1, 1)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32).reshape(3, 1, 1)
+
+
+class ImagePoolBusy(HTTPException):
+    """Raised when the preprocessing queue is full (backpressure)."""
+
+    def __init__(self):
+        super().__init__(status_code=503, detail="Image processing queue is full, retry shortly", headers={"Retry-After": "2"})
+
+
+# ---------------------------------------------------------------------------
+# Shared memory helpers
+# ---------------------------------------------------------------------------
+
+def _write_block(data) -> str:
+    """Copies bytes / an ndarray into a new shared memory block and returns its name."""
+    view = memoryview(data).cast("B")
+    block = shared_memory.SharedMemory(create=True, size=max(1, view.nbytes))
+    block.buf[:view.nbytes] = view
+    block.close()
+    return block.name
+
+
+def _take_block(name: str, nbytes: int) -> bytearray:
+    """Copies out and frees a block written by a worker (bytearray so NumPy views stay writable)."""
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return bytearray(block.buf[:nbytes])
+    finally:
+        block.close()
+        block.unlink()
+
+
+def _read_block(name: str, nbytes: int) -> bytes:
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(block.buf[:nbytes])
+    finally:
+        block.close()
+
+
+# ---------------------------------------------------------------------------
+# Worker tasks (run inside the pool processes)
+# ---------------------------------------------------------------------------
+
+def _warmup() -> int:
+    """Touches the decoders so the first real request does not pay import/initialisation cost."""
+    buf = io.BytesIO()
+    Image.new("RGB", (512, 512)).save(buf, format="JPEG")
+    _embedding_array(buf.getvalue())
+    return os.getpid()
+
+
+def _model_blob(data: bytes, max_edge: int) -> bytes:
+    """
+    JPEG bytes no larger than max_edge. Sending an encoded blob avoids the SDK's
+    lossless WebP encode of PIL images, which costs ~0.5 s per photo on the request path.
+    """
+    with Image.open(io.BytesIO(data)) as probe:
+        if probe.format == "JPEG" and max(probe.size) <= max_edge:
+            return data
+    img = decode_image(data, max_edge=max_edge)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=92)
+    return buf.getvalue()
+
+
+def _embedding_array(data: bytes) -> np.ndarray:
+    """Mirrors torchvision Resize(256) -> CenterCrop(224) -> ToTensor -> Normalize."""
+    img = decode_image(data, min_edge=256, mode="RGB")
+    width, height = img.size
+    if width <= height:
+        size = (256, int(256 * height / width))
+    else:
+        size = (int(256 * width / height), 256)
+    img = img.resize(size, Image.Resampling.BILINEAR)
+    left = int(round((size[0] - 224) / 2.0))
+    top = int(round((size[1] - 224) / 2.0))
+    img = img.crop((left, top, left + 224, top + 224))
+
+    tensor = np.asarray(img, dtype=np.float32).transpose(2, 0, 1) / 255.0
+    return np.ascontiguousarray((tensor - IMAGENET_MEAN) / IMAGENET_STD, dtype=np.float32)
+
+
+def _model_task(in_name: str, in_len: int, max_edge: int):
+    blob = _model_blob(_read_block(in_name, in_len), max_edge)
+    return _write_block(blob), len(blob)
+
+
+def _embedding_task(in_name: str, in_len: int):
+    tensor = _embedding_array(_read_block(in_name, in_len))
+    return _write_block(tensor), tensor.nbytes, tensor.shape
+
+
+def _discard_output(future):
+    if not future.cancelled() and future.exception() is None:
+        result = future.result()
+        _take_block(result[0], result[1])
+
+
+# ---------------------------------------------------------------------------
+# Pool
+# ---------------------------------------------------------------------------
+
+class ImagePool:
+    def __init__(self):
+        self.workers = int(os.getenv("IMAGE_POOL_WORKERS", min(4, os.cpu_count() or 1)))
+        # Backpressure: at most this many tasks queued or running; callers wait up to queue_timeout
+        self.max_pending = int(os.getenv("IMAGE_POOL_MAX_PENDING", self.workers * 4))
+        self.queue_timeout = float(os.getenv("IMAGE_POOL_QUEUE_TIMEOUT", 5))
+        # Longest a caller waits for a submitted task (capped by the request deadline)
+        self.task_timeout = float(os.getenv("IMAGE_POOL_TASK_TIMEOUT", 30))
+        self._slots = threading.BoundedSemaphore(max(1, self.max_pending))
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _context(self):
+        # forkserver avoids forking a threaded server and does not re-import the app in workers
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            ctx = multiprocessing.get_context("forkserver")
+            ctx.set_forkserver_preload(["services.image_pool"])
+            return ctx
+        return multiprocessing.get_context("spawn")
+
+    def start(self, warmup: bool = True):
+        """
+        Starts the workers (idempotent) and returns the executor; callers submit to the
+        returned one, since a concurrent shutdown() may clear self._executor at any time.
+        With warmup, blocks until every worker has run once.
+        """
+        if self.workers <= 0:
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=self._context())
+            executor = self._executor
+        if warmup:
+            pids = {f.result() for f in [executor.submit(_warmup) for _ in range(self.workers * 2)]}
+            print(f"Image pool ready: {len(pids)} worker(s)")
+        return executor
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _run(self, task, data: bytes, *args, wait: float | None = None):
+        """
+        Runs a worker task on the pool; returns None when the pool is disabled (IMAGE_POOL_WORKERS=0).
+        `wait` bounds the slot wait plus the task wait together, for callers with a tighter
+        budget than the request deadline (ImagePoolBusy once it runs out).
+        """
+        if self.workers <= 0:
+            return None
+        give_up = None if wait is None else time.monotonic() + max(0.0, wait)
+        queue_timeout = self.queue_timeout if wait is None else min(self.queue_timeout, max(0.0, wait))
+        if not self._slots.acquire(timeout=deadline.timeout(queue_timeout, "image pool")):
+            raise ImagePoolBusy()
+        block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        try:
+            block.buf[:len(data)] = data
+            try:
+                future = self.start(warmup=False).submit(task, block.name, len(data), *args)
+            except RuntimeError:
+                # Shut down between start() and submit(): retry once on a fresh pool
+                future = self.start(warmup=False).submit(task, block.name, len(data), *args)
+            task_timeout = self.task_timeout if give_up is None else min(self.task_timeout, max(0.0, give_up - time.monotonic()))
+            try:
+                return future.result(timeout=deadline.timeout(task_timeout, "image pool"))
+            except FutureTimeout:
+                if not future.cancel():
+                    # Already running: free its output block whenever it finishes
+                    future.add_done_callback(_discard_output)
+                if deadline.expired():
+                    raise DeadlineExceeded("image pool: request deadline passed while the task was queued or running")
+                raise ImagePoolBusy()
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM on a hostile image); replace the pool for the next request
+            self.shutdown()
+            raise
+        finally:
+            block.close()
+            block.unlink()
+            self._slots.release()
+
+    def prepare_for_model(self, image_bytes: bytes, max_edge: int) -> dict:
+        """Downscaled JPEG blob in the {mime_type, data} form accepted by generate_content."""
+        result = self._run(_model_task, image_bytes, max_edge)
+        if result is None:
+            return {"mime_type": "image/jpeg", "data": _model_blob(image_bytes, max_edge)}
+        out_name, nbytes = result
+        return {"mime_type": "image/jpeg", "data": bytes(_take_block(out_name, nbytes))}
+
+    def preprocess_for_embedding(self, image_bytes: bytes, wait: float | None = None) -> np.ndarray:
+        """Normalised 3x224x224 float32 array ready for the ResNet embedding model."""
+        result = self._run(_embedding_task, image_bytes, wait=wait)
+        if result is None:
+            return _embedding_array(image_bytes)
+        out_name, nbytes, shape = result
+        return np.frombuffer(_take_block(out_name, nbytes), dtype=np.float32).reshape(shape)
+
+
+image_pool = ImagePool()
@@ -0,0 +1,75 @@
+import io
+import math
+
+import numpy as np
+from PIL import Image
+
+# Modes Image.reduce() accepts; palette, bilevel and 16/32-bit integer images are converted first
+REDUCE_MODES = {"L", "LA", "RGB", "RGBA", "RGBX", "CMYK", "YCbCr", "F"}
+
+
+def _eight_bit(img: Image.Image) -> Image.Image:
+    """The image in a mode reduce() supports, keeping transparency and 16-bit tonal range."""
+    if img.mode.startswith("I"):
+        # PIL's own I;16 -> L conversion clips at 255, which turns most 16-bit photos white
+        return Image.fromarray((np.asarray(img).astype(np.uint32) >> 8).clip(0, 255).astype(np.uint8), "L")
+    if img.mode in ("P", "PA"):
+        return img.convert("RGBA" if img.mode == "PA" or "transparency" in img.info else "RGB")
+    return img.convert("L" if img.mode == "1" else "RGB")
+
+
+def _scale(width: int, height: int, max_edge: int = None, min_edge: int = None) -> float:
+    if min_edge:
+        return min(width, height) / min_edge
+    if max_edge:
+        return max(width, height) / max_edge
+    return 1.0
+
+
+def decoded_size(width: int, height: int, fmt: str, max_edge: int = None, min_edge: int = None) -> tuple:
+    """
+    Size of the largest bitmap decode_image materialises for a width x height image: JPEGs
+    are decoded at the DCT scale draft() picks (1/2, 1/4 or 1/8); other formats are loaded
+    in full before reduce().
+    """
+    scale = _scale(width, height, max_edge, min_edge)
+    if fmt != "JPEG" or scale < 2:
+        return width, height
+    # Mirrors JpegImageFile.draft()
+    requested = (math.ceil(width / scale), math.ceil(height / scale))
+    fit = min(width // requested[0], height // requested[1])
+    factor = next(f for f in (8, 4, 2, 1) if fit >= f)
+    return math.ceil(width / factor), math.ceil(height / factor)
+
+
+def decode_image(image_bytes: bytes, max_edge: int = None, min_edge: int = None, mode: str = None) -> Image.Image:
+    """
+    Decodes image bytes at no more resolution than the caller needs.
+
+    max_edge: the longest side of the result is at most this (model input path).
+    min_edge: the shortest side of the result is at least this (embedding path, e.g. Resize(256)).
+
+    When the target is at least 2x below the source, JPEGs are decoded in draft mode
+    (libjpeg DCT scaling by 1/2, 1/4 or 1/8), and other formats are box-reduced, so the
+    full-size bitmap is never materialised for phone camera images.
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    width, height = img.size
+
+    scale = _scale(width, height, max_edge, min_edge)
+    if scale >= 2:
+        if img.format == "JPEG":
+            # draft() picks the largest DCT scale that keeps both sides >= the requested size
+            img.draft(mode or img.mode, (math.ceil(width / scale), math.ceil(height / scale)))
+        else:
+            if img.mode not in REDUCE_MODES:
+                img = _eight_bit(img)
+            img = img.reduce(int(scale))
+
+    if mode and img.mode != mode:
+        img = img.convert(mode)
+
+    if max_edge and max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+    return img
@@ -0,0 +1,158 @@
+"""
+Deterministic banned / hazardous ingredient screener.
+
+Builds an Aho-Corasick automaton over banned_ingredients.json (names, synonyms and
+E/INS numbers) and scans OCR'd label text in a single linear pass. Results fill
+health_safety_assessment.flagged_components without relying on the model.
+"""
+import json
+import os
+import re
+from collections import deque
+from dotenv import load_dotenv
+
+from services.ocr_service import ocr_service
+from services.response_models import as_list, health_assessment
+
+load_dotenv()
+
+RISK_ORDER = ["Safe", "Caution", "High Risk", "Critical"]
+
+
+def normalize_label_text(text: str) -> str:
+    """Lowercase, punctuation to spaces, and 'E-924' / 'INS 924' folded to 'e924'."""
+    text = re.sub(r"[^a-z0-9]+", " ", text.lower())
+    text = re.sub(r"\b(?:e|ins)\s?(\d{3,4}[a-z]?)\b", r"e\1", text)
+    return f" {text.strip()} "
+
+
+class AhoCorasick:
+    """Multi-pattern matcher: one pass over the text finds every occurrence of every pattern."""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+    def add(self, pattern: str, value):
+        node = 0
+        for ch in pattern:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = nxt
+        self.output[node].append((len(pattern), value))
+
+    def build(self):
+        """Computes failure links breadth-first (depth-1 nodes fail to the root)."""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def iter(self, text: str):
+        """Yields (end_index, pattern_length, value) for every match."""
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for length, value in self.output[node]:
+                yield i, length, value
+
+
+class IngredientScreener:
+    def __init__(self, list_path: str = None):
+        self.enabled = os.getenv("INGREDIENT_SCREENER", "1") != "0"
+        self.automaton = AhoCorasick()
+        self.ingredients = []
+
+        path = list_path or os.getenv(
+            "BANNED_INGREDIENTS_PATH",
+            os.path.join(os.path.dirname(os.path.dirname(__file__)), "banned_ingredients.json")
+        )
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.ingredients = json.load(f).get("ingredients", [])
+        except Exception as e:
+            print(f"Banned ingredient list not loaded ({path}): {e}")
+
+        for index, item in enumerate(self.ingredients):
+            for term in [item["name"]] + item.get("synonyms", []):
+                # Patterns carry their own spaces so matches land on word boundaries
+                self.automaton.add(normalize_label_text(term), index)
+        self.automaton.build()
+
+    def screen_text(self, text: str) -> list:
+        """Banned/hazardous ingredients found in the text, most severe first."""
+        found = {}
+        normalized = normalize_label_text(text)
+        for end, length, index in self.automaton.iter(normalized):
+            item = self.ingredients[index]
+            if index not in found:
+                found[index] = {
+                    "name": item["name"],
+                    "matched": normalized[end - length + 1:end + 1].strip(),
+                    "category": item.get("category", "Unknown"),
+                    "severity": item.get("severity", "Caution"),
+                    "reason": item.get("reason", ""),
+                }
+        return sorted(found.values(), key=lambda f: RISK_ORDER.index(f["severity"]) if f["severity"] in RISK_ORDER else 0, reverse=True)
+
+    def assess(self, text: str) -> dict:
+        """health_safety_assessment block built purely from the local screen."""
+        findings = self.screen_text(text)
+        risk = "Safe"
+        for f in findings:
+            if f["severity"] in RISK_ORDER and RISK_ORDER.index(f["severity"]) > RISK_ORDER.index(risk):
+                risk = f["severity"]
+        return {
+            "risk_level": risk,
+            "flagged_components": [f["name"] for f in findings],
+            "safety_warnings": [f"{f['name']} ('{f['matched']}'): {f['reason']}" for f in findings],
+            "findings": findings,
+        }
+
+    def screen_images(self, images_data: list[bytes]):
+        """OCR + screen. None when local OCR is unavailable (the model audit is then the only check)."""
+        if not (self.enabled and ocr_service.available):
+            return None
+        try:
+            return self.assess(ocr_service.text(images_data))
+        except Exception as e:
+            print(f"Ingredient screener error: {e}")
+            return None
+
+    def merge_into(self, cot_result: dict, assessment: dict):
+        """Merges local findings into a verify_product_authenticity result in place."""
+        if not assessment or not assessment["flagged_components"]:
+            return cot_result
+        # The model's part of the result is not trusted to be well-formed (strings for lists or objects)
+        raw = cot_result.get("raw_forensic_analysis")
+        raw = cot_result["raw_forensic_analysis"] = raw if isinstance(raw, dict) else {}
+        health = raw["health_safety_assessment"] = health_assessment(raw.get("health_safety_assessment"))
+        flagged = as_list(health.get("flagged_components"))
+        health["flagged_components"] = flagged + [c for c in assessment["flagged_components"] if c not in flagged]
+        health["safety_warnings"] = as_list(health.get("safety_warnings")) + assessment["safety_warnings"]
+        current = health.get("risk_level", "Safe")
+        if current not in RISK_ORDER or RISK_ORDER.index(assessment["risk_level"]) > RISK_ORDER.index(current):
+            health["risk_level"] = assessment["risk_level"]
+
+        verification = cot_result.get("verification")
+        verification = cot_result["verification"] = verification if isinstance(verification, dict) else {}
+        verification["anomalies_detected"] = as_list(verification.get("anomalies_detected")) + assessment["safety_warnings"]
+        return cot_result
+
+
+ingredient_screener = IngredientScreener()
@@ -0,0 +1,83 @@
+"""
+Offline OCR shared by the local fast paths (typosquat check, ingredient screener).
+
+Uses Tesseract via pytesseract (optional: needs the tesseract binary). Results are
+cached by image hash so one request's images are only OCR'd once.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+from services.image_utils import decode_image
+
+load_dotenv()
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+
+class OcrService:
+    def __init__(self):
+        self.max_edge = 2000
+        self.timeout = float(os.getenv("OCR_TIMEOUT_SECONDS", 10))
+        self.cache_size = 64
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.available = False
+        if pytesseract:
+            try:
+                pytesseract.get_tesseract_version()
+                self.available = True
+            except Exception:
+                print("Local OCR disabled: tesseract binary not found.")
+
+    def _image_words(self, img_bytes: bytes) -> list:
+        key = hashlib.sha1(img_bytes).hexdigest()
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        image = decode_image(img_bytes, max_edge=self.max_edge, mode="L")
+        data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT, timeout=self.timeout)
+        words = []
+        for i, text in enumerate(data["text"]):
+            if not text.strip():
+                continue
+            words.append({
+                "text": text.strip(),
+                "conf": float(data["conf"][i]),
+                "height": int(data["height"][i]),
+                "line": (data["block_num"][i], data["par_num"][i], data["line_num"][i]),
+            })
+
+        with self._lock:
+            self._cache[key] = words
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return words
+
+    def words(self, images_data: list[bytes]) -> list:
+        """Word boxes [{text, conf, height, line}]; line is unique across images."""
+        if not self.available:
+            return []
+        out = []
+        for index, img_bytes in enumerate(images_data):
+            for word in self._image_words(img_bytes):
+                out.append({**word, "line": (index,) + word["line"]})
+        return out
+
+    def text(self, images_data: list[bytes]) -> str:
+        """Plain text, one OCR line per line, all images concatenated."""
+        lines = {}
+        for word in self.words(images_data):
+            lines.setdefault(word["line"], []).append(word["text"])
+        return "\n".join(" ".join(words) for words in lines.values())
+
+
+ocr_service = OcrService()
@@ -0,0 +1,177 @@
+"""
+Concurrent, polite fetching of retailer product pages for price extraction.
+
+Pages are fetched on a pool of PAGE_FETCH_WORKERS threads. Per retailer domain at most
+PAGE_FETCH_PER_DOMAIN requests run at once, and they start at least
+PAGE_FETCH_DOMAIN_INTERVAL seconds apart; a page that cannot get its turn within the
+caller's timeout is skipped rather than queued. Extracted offers (not the HTML) are cached
+per URL for PAGE_CACHE_SECONDS; pages without a readable price for PAGE_MISS_CACHE_SECONDS,
+so a blocked or changed page is not re-fetched on every search. Pages and every redirect hop
+go through the same public-address check as thumbnails (see image_fetcher).
+
+PRICE_PAGE_FIXTURES=<dir> serves <dir>/<retailer>.html (e.g. fixtures/pages/amazon.html)
+for every page of that retailer instead of going to the network.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from dotenv import load_dotenv
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services import deadline
+from services.image_fetcher import BlockedAddress, get_public
+from services.price_extractor import retailer_for, extract_offer
+
+load_dotenv()
+
+MB = 1024 * 1024
+
+
+class PageFetcher:
+    def __init__(self):
+        self.timeout = float(os.getenv("PAGE_FETCH_TIMEOUT", 6))
+        self.max_bytes = int(os.getenv("PAGE_FETCH_MAX_BYTES", 4 * MB))
+        self.max_workers = int(os.getenv("PAGE_FETCH_WORKERS", 8))
+        self.per_domain = int(os.getenv("PAGE_FETCH_PER_DOMAIN", 2))
+        self.domain_interval = float(os.getenv("PAGE_FETCH_DOMAIN_INTERVAL", 0.5))
+        self.cache_seconds = float(os.getenv("PAGE_CACHE_SECONDS", 1800))
+        self.miss_cache_seconds = float(os.getenv("PAGE_MISS_CACHE_SECONDS", 300))
+        self.cache_size = int(os.getenv("PAGE_CACHE_SIZE", 2048))
+        self.fixture_dir = os.getenv("PRICE_PAGE_FIXTURES")
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "User-Agent": "Mozilla/5.0 (compatible; Countify/1.0)",
+            "Accept": "text/html,application/xhtml+xml",
+            "Accept-Language": "en-IN,en;q=0.8",
+        })
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="page-fetch")
+        self.lock = threading.Lock()
+        self.domains = {}               # domain -> [semaphore, earliest next start]
+        self.cache = OrderedDict()      # url -> (offer or None, expires_at)
+        self.stats = {"hits": 0, "fetched": 0, "extracted": 0, "no_price": 0, "failed": 0, "blocked": 0, "skipped_polite": 0}
+
+    def _count(self, key: str):
+        with self.lock:
+            self.stats[key] += 1
+
+    def _cached(self, url: str):
+        with self.lock:
+            entry = self.cache.get(url)
+            if entry is None or entry[1] <= time.time():
+                return False, None
+            self.cache.move_to_end(url)
+            return True, entry[0]
+
+    def _store(self, url: str, offer):
+        with self.lock:
+            self.cache[url] = (offer, time.time() + (self.cache_seconds if offer else self.miss_cache_seconds))
+            self.cache.move_to_end(url)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def _turn(self, domain: str, budget: float):
+        """Waits for a slot on the domain; returns the semaphore to release, or None if out of time."""
+        with self.lock:
+            slot = self.domains.setdefault(domain, [threading.Semaphore(self.per_domain), 0.0])
+        give_up = time.monotonic() + budget
+        if not slot[0].acquire(timeout=max(0.0, budget)):
+            return None
+        with self.lock:
+            start = max(time.monotonic(), slot[1])
+            if start >= give_up:
+                slot[0].release()
+                return None
+            slot[1] = start + self.domain_interval
+        time.sleep(max(0.0, start - time.monotonic()))
+        return slot[0]
+
+    def _download(self, url: str, timeout: float):
+        with get_public(self.session, url, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            buffer = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                buffer.extend(chunk)
+                if len(buffer) > self.max_bytes:
+                    break       # prices and JSON-LD sit well before this on product pages
+            return bytes(buffer).decode(response.encoding or "utf-8", errors="replace")
+
+    def _fixture(self, retailer) -> str:
+        path = os.path.join(self.fixture_dir, f"{retailer.name.lower()}.html")
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+
+    def extract(self, url: str, timeout: float = None):
+        """Offer {seller, price, currency, title, rating, thumbnail} for a product page, or None."""
+        retailer = retailer_for(url)
+        if retailer is None:
+            return None
+        hit, offer = self._cached(url)
+        if hit:
+            self._count("hits")
+            return offer
+
+        budget = timeout or self.timeout
+        started = time.monotonic()
+        try:
+            if self.fixture_dir:
+                html = self._fixture(retailer)
+            else:
+                slot = self._turn(urlsplit(url).netloc.lower(), budget)
+                if slot is None:
+                    self._count("skipped_polite")
+                    return None
+                try:
+                    html = self._download(url, max(0.5, budget - (time.monotonic() - started)))
+                finally:
+                    slot.release()
+            self._count("fetched")
+            offer = extract_offer(html, retailer) if html else None
+        except BlockedAddress as e:
+            self._count("blocked")
+            print(f"Page fetch refused for {url[:80]}: {e}")
+            return None
+        except Exception as e:
+            self._count("failed")
+            print(f"Page fetch failed for {url[:80]}: {e}")
+            return None
+
+        self._count("extracted" if offer else "no_price")
+        self._store(url, offer)
+        return offer
+
+    def extract_many(self, urls: list, timeout: float = None) -> dict:
+        """
+        Extracts offers from the pages concurrently; returns {url: offer} for those that had a
+        price within the timeout (capped at the request deadline).
+        """
+        left = deadline.remaining()
+        if left is not None:
+            timeout = left if timeout is None else min(timeout, left)
+        timeout = self.timeout if timeout is None else timeout
+        unique = list(dict.fromkeys(u for u in urls if retailer_for(u)))
+        futures = {self.executor.submit(self.extract, url, timeout): url for url in unique}
+        done, _ = wait(futures, timeout=timeout)
+        results = {}
+        for future in done:
+            offer = future.result()
+            if offer:
+                results[futures[future]] = offer
+        return results
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {**self.stats, "cached_pages": len(self.cache)}
+
+
+page_fetcher = PageFetcher()
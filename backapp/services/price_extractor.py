@@ -0,0 +1,354 @@
+"""
+Prices from retailer product pages.
+
+An offer (price, currency, title, rating, thumbnail) is read from, in order:
+1. schema.org Product JSON-LD, which most retailers embed for search engines;
+2. the retailer's own markup: price elements (Amazon, Flipkart) or the JSON state the page
+   is rendered from (Myntra's window.__myx, Ajio's window.__PRELOADED_STATE__, Meesho's
+   __NEXT_DATA__);
+3. OpenGraph / microdata price meta tags.
+
+Pages are parsed with selectolax (Lexbor) when it is installed, else with the standard
+library's html.parser, which only understands the simple selectors used here (tag, #id,
+.class and descendant combinations).
+
+Saved pages can be checked without the network:
+    python -m services.price_extractor fixtures/pages/amazon.html https://www.amazon.in/dp/X
+"""
+import json
+import re
+import sys
+from collections import namedtuple
+from html.parser import HTMLParser as StdlibParser
+from urllib.parse import urlsplit
+
+try:
+    from selectolax.parser import HTMLParser as FastParser
+except ImportError:
+    FastParser = None
+
+from services.regions import detect_currency, parse_amount
+
+Retailer = namedtuple("Retailer", ["name", "domains", "selectors", "extract"])
+
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+
+def _compound(text: str):
+    match = re.fullmatch(r"([\w-]+)?((?:[#.][\w-]+)*)", text)
+    if not match:
+        raise ValueError(f"Unsupported selector: {text}")
+    parts = re.findall(r"([#.])([\w-]+)", match.group(2))
+    return (match.group(1),
+            next((value for kind, value in parts if kind == "#"), None),
+            {value for kind, value in parts if kind == "."})
+
+
+def _matches(compound, element) -> bool:
+    tag, id_, classes = compound
+    return ((tag is None or tag == element[0]) and (id_ is None or id_ == element[1])
+            and classes <= element[2])
+
+
+class _Collector(StdlibParser):
+    """Single pass over the page collecting what Page needs, for when selectolax is missing."""
+
+    def __init__(self, selectors):
+        super().__init__(convert_charrefs=True)
+        self.selectors = {s: [_compound(part) for part in s.split()] for s in selectors}
+        self.stack = []         # (tag, id, classes) of open elements
+        self.capturing = []     # [selector, depth, chunks] for elements whose text is wanted
+        self.script = None      # (type, id, chunks) of the open <script>
+        self.texts, self.meta, self.scripts = {}, {}, []
+
+    def _selected(self, element):
+        for selector, compounds in self.selectors.items():
+            if selector in self.texts or any(c[0] == selector for c in self.capturing):
+                continue
+            if not _matches(compounds[-1], element):
+                continue
+            wanted = len(compounds) - 2
+            for ancestor in reversed(self.stack):
+                if wanted < 0:
+                    break
+                if _matches(compounds[wanted], ancestor):
+                    wanted -= 1
+            if wanted < 0:
+                yield selector
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "meta":
+            key = attrs.get("property") or attrs.get("name") or attrs.get("itemprop")
+            if key and attrs.get("content") is not None:
+                self.meta.setdefault(key.lower(), attrs["content"])
+            return
+        if tag == "script":
+            self.script = ((attrs.get("type") or "").lower(), attrs.get("id"), [])
+        if tag in VOID_TAGS:
+            return
+        element = (tag, attrs.get("id"), set((attrs.get("class") or "").split()))
+        for selector in list(self._selected(element)):
+            self.capturing.append([selector, len(self.stack), []])
+        self.stack.append(element)
+
+    def handle_endtag(self, tag):
+        if tag == "script" and self.script:
+            self.scripts.append((self.script[0], self.script[1], "".join(self.script[2])))
+            self.script = None
+        # Tolerate unclosed elements: pop back to the matching open tag
+        if not any(element[0] == tag for element in self.stack):
+            return
+        while self.stack:
+            element = self.stack.pop()
+            for capture in [c for c in self.capturing if c[1] >= len(self.stack)]:
+                self.capturing.remove(capture)
+                self.texts.setdefault(capture[0], " ".join("".join(capture[2]).split()))
+            if element[0] == tag:
+                break
+
+    def handle_data(self, data):
+        if self.script:
+            self.script[2].append(data)
+        for capture in self.capturing:
+            capture[2].append(data)
+
+
+class Page:
+    """A parsed product page: JSON-LD objects, meta tags, scripts by id and the text of `selectors`."""
+
+    def __init__(self, html: str, selectors=()):
+        self.html = html
+        if FastParser is not None:
+            tree = FastParser(html)
+            self.meta = {}
+            for node in tree.css("meta"):
+                attrs = node.attributes
+                key = attrs.get("property") or attrs.get("name") or attrs.get("itemprop")
+                if key and attrs.get("content") is not None:
+                    self.meta.setdefault(key.lower(), attrs["content"])
+            scripts = [((node.attributes.get("type") or "").lower(), node.attributes.get("id"), node.text(deep=True))
+                       for node in tree.css("script")]
+            self.texts = {}
+            for selector in selectors:
+                node = tree.css_first(selector)
+                if node is not None:
+                    self.texts[selector] = " ".join(node.text(deep=True).split())
+        else:
+            collector = _Collector(selectors)
+            collector.feed(html)
+            collector.close()
+            self.meta, self.texts, scripts = collector.meta, collector.texts, collector.scripts
+        self.scripts = {script_id: text for _, script_id, text in scripts if script_id}
+        self.json_ld = []
+        for script_type, _, text in scripts:
+            if script_type == "application/ld+json":
+                try:
+                    self.json_ld.extend(_flatten(json.loads(text)))
+                except ValueError:
+                    continue
+
+    def text(self, *selectors):
+        """Text of the first selector that matched, or None."""
+        return next((self.texts[s] for s in selectors if self.texts.get(s)), None)
+
+    def state(self, name: str):
+        """The object assigned to window.<name> in an inline script, or None."""
+        match = re.search(r"(?:window\.)?" + re.escape(name) + r"\s*=\s*(?=[{\[])", self.html)
+        if not match:
+            return None
+        try:
+            return json.JSONDecoder().raw_decode(self.html, match.end())[0]
+        except ValueError:
+            return None
+
+    def script_json(self, script_id: str):
+        try:
+            return json.loads(self.scripts.get(script_id) or "null")
+        except ValueError:
+            return None
+
+
+def _flatten(data) -> list:
+    if isinstance(data, list):
+        return [item for entry in data for item in _flatten(entry)]
+    if isinstance(data, dict):
+        return [data] + _flatten(data.get("@graph", []))
+    return []
+
+
+def _find(data, predicate, depth: int = 0):
+    """First dict in a nested JSON structure for which predicate(dict) is true."""
+    if depth > 25:
+        return None
+    if isinstance(data, dict):
+        if predicate(data):
+            return data
+        values = data.values()
+    elif isinstance(data, list):
+        values = data
+    else:
+        return None
+    for value in values:
+        found = _find(value, predicate, depth + 1)
+        if found is not None:
+            return found
+    return None
+
+
+def _amount(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        return parse_amount(value)
+    return None
+
+
+def _first_url(image):
+    if isinstance(image, list):
+        image = image[0] if image else None
+    if isinstance(image, dict):
+        image = image.get("url") or image.get("contentUrl")
+    return image if isinstance(image, str) else None
+
+
+def _offer(price, currency=None, title=None, rating=None, thumbnail=None):
+    amount = _amount(price)
+    if not amount or amount <= 0:
+        return None
+    if not currency and isinstance(price, str):
+        currency = detect_currency(price, None)
+    try:
+        rating = round(float(str(rating).split()[0]), 1) if rating not in (None, "") else None
+    except ValueError:
+        rating = None
+    return {"price": amount, "currency": currency, "title": (title or "").strip() or None,
+            "rating": rating, "thumbnail": thumbnail}
+
+
+def from_json_ld(page: Page):
+    def is_product(item):
+        kind = item.get("@type")
+        return "Product" in (kind if isinstance(kind, list) else [kind])
+
+    for product in filter(is_product, page.json_ld):
+        offers = product.get("offers")
+        offers = offers if isinstance(offers, list) else [offers]
+        for offer in filter(lambda o: isinstance(o, dict), offers):
+            price = offer.get("price", offer.get("lowPrice"))
+            if price is None and isinstance(offer.get("priceSpecification"), dict):
+                price = offer["priceSpecification"].get("price")
+            rating = product.get("aggregateRating") or {}
+            found = _offer(price, offer.get("priceCurrency"), product.get("name"),
+                           rating.get("ratingValue") if isinstance(rating, dict) else None, _first_url(product.get("image")))
+            if found:
+                return found
+    return None
+
+
+def from_meta(page: Page):
+    meta = page.meta
+    price = meta.get("product:price:amount") or meta.get("og:price:amount") or meta.get("price")
+    currency = meta.get("product:price:currency") or meta.get("og:price:currency") or meta.get("pricecurrency")
+    return _offer(price, currency, meta.get("og:title"), None, meta.get("og:image")) if price else None
+
+
+def _amazon(page: Page):
+    price = page.text("#corePrice_feature_div .a-offscreen", "#corePriceDisplay_desktop_feature_div .a-offscreen",
+                      "#priceblock_dealprice", "#priceblock_ourprice", ".a-price .a-offscreen")
+    return _offer(price, None, page.text("#productTitle"), page.text("#acrPopover .a-icon-alt"),
+                  page.meta.get("og:image")) if price else None
+
+
+def _flipkart(page: Page):
+    price = page.text("div.Nx9bqj", "div._30jeq3")
+    return _offer(price, "INR", page.text("span.VU-ZEz", "span.B_NuCI"), page.text("div.XQDdHH", "div._3LWZlK"),
+                  page.meta.get("og:image")) if price else None
+
+
+def _myntra(page: Page):
+    product = _find(page.state("__myx"), lambda d: isinstance(d.get("price"), dict) and "discounted" in d["price"])
+    if not product:
+        return None
+    price = product["price"].get("discounted") or product["price"].get("mrp")
+    image = _find(product.get("media"), lambda d: isinstance(d.get("imageURL"), str))
+    return _offer(price, "INR", product.get("name"), (product.get("ratings") or {}).get("averageRating"),
+                  image and image["imageURL"])
+
+
+def _ajio(page: Page):
+    product = _find(page.state("__PRELOADED_STATE__"),
+                    lambda d: isinstance(d.get("price"), dict) and "value" in d["price"] and "name" in d)
+    if product:
+        image = _find(product.get("images"), lambda d: isinstance(d.get("url"), str))
+        return _offer(product["price"]["value"], "INR", product.get("name"),
+                      (product.get("ratingsResponse") or {}).get("aggregateRating", {}).get("averageRating"),
+                      image and image["url"])
+    price = page.text(".prod-sp")
+    return _offer(price, "INR", page.text(".prod-name")) if price else None
+
+
+def _meesho(page: Page):
+    keys = ("min_product_price", "min_catalog_price", "price")
+    product = _find(page.script_json("__NEXT_DATA__"),
+                    lambda d: isinstance(d.get("name"), str) and any(isinstance(d.get(k), (int, float)) for k in keys))
+    if not product:
+        return None
+    price = next(product[k] for k in keys if isinstance(product.get(k), (int, float)))
+    summary = _find(product.get("review_summary"), lambda d: "average_rating" in d)
+    images = product.get("images") or []
+    return _offer(price, "INR", product["name"], summary and summary["average_rating"],
+                  images[0] if isinstance(images, list) and images and isinstance(images[0], str) else None)
+
+
+# Amazon's storefronts; matched as host == domain or a subdomain of it, never as a prefix
+# (which would also match amazon.evil-shop.com)
+AMAZON_DOMAINS = (
+    "amazon.in", "amazon.com", "amazon.co.uk", "amazon.de", "amazon.fr", "amazon.it", "amazon.es",
+    "amazon.nl", "amazon.se", "amazon.pl", "amazon.com.be", "amazon.ie", "amazon.ca", "amazon.com.mx",
+    "amazon.com.br", "amazon.co.jp", "amazon.com.au", "amazon.sg", "amazon.ae", "amazon.sa",
+    "amazon.com.tr", "amazon.eg", "amazon.cn",
+)
+
+RETAILERS = (
+    Retailer("Amazon", AMAZON_DOMAINS, ("#corePrice_feature_div .a-offscreen", "#corePriceDisplay_desktop_feature_div .a-offscreen",
+                                      "#priceblock_dealprice", "#priceblock_ourprice", ".a-price .a-offscreen",
+                                      "#productTitle", "#acrPopover .a-icon-alt"), _amazon),
+    Retailer("Flipkart", ("flipkart.com",), ("div.Nx9bqj", "div._30jeq3", "span.VU-ZEz", "span.B_NuCI",
+                                             "div.XQDdHH", "div._3LWZlK"), _flipkart),
+    Retailer("Myntra", ("myntra.com",), (), _myntra),
+    Retailer("Ajio", ("ajio.com",), (".prod-sp", ".prod-name"), _ajio),
+    Retailer("Meesho", ("meesho.com",), (), _meesho),
+)
+
+
+def retailer_for(url: str):
+    """The Retailer whose domain the URL is on, or None."""
+    host = urlsplit(url or "").netloc.lower().split(":")[0]
+    host = host[4:] if host.startswith("www.") else host
+    for retailer in RETAILERS:
+        for domain in retailer.domains:
+            if host == domain or host.endswith("." + domain):
+                return retailer
+    return None
+
+
+def extract_offer(html: str, retailer: Retailer):
+    """{price, currency, title, rating, thumbnail} from a product page, or None if no price was found."""
+    page = Page(html, retailer.selectors)
+    for extractor in (from_json_ld, retailer.extract, from_meta):
+        offer = extractor(page)
+        if offer:
+            offer["seller"] = retailer.name
+            return offer
+    return None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m services.price_extractor <page.html> <product url>")
+    found = retailer_for(sys.argv[2])
+    if not found:
+        sys.exit(f"No extractor for {sys.argv[2]}")
+    with open(sys.argv[1], encoding="utf-8") as f:
+        print(json.dumps(extract_offer(f.read(), found), ensure_ascii=False, indent=2))
@@ -0,0 +1,82 @@
+"""
+Visual re-ranking of /price shopping results.
+
+Shopping results often lead with look-alikes or the wrong variant. The result thumbnails
+are fetched concurrently (shared cached ImageFetcher), embedded together with the user's
+photo in one batch, and each result gets a visual_similarity score. Everything runs
+inside PRICE_RERANK_BUDGET_SECONDS: thumbnails that miss the fetch window are skipped
+(they keep downloading into the cache for next time), and if there is no time left to
+embed, or the image pool cannot take the thumbnails within what is left of the budget,
+results are returned unranked.
+"""
+import os
+import time
+from dotenv import load_dotenv
+
+from services import deadline
+from services.image_fetcher import image_fetcher
+from services.image_pool import ImagePoolBusy
+from services.verification_service import verification_service
+
+load_dotenv()
+
+
+class PriceRanker:
+    def __init__(self):
+        self.enabled = os.getenv("PRICE_RERANK", "1") != "0"
+        self.budget = float(os.getenv("PRICE_RERANK_BUDGET_SECONDS", 1.5))
+        self.min_similarity = float(os.getenv("PRICE_MIN_SIMILARITY", 0.55))
+        self.max_thumbnails = 12
+        self.fetch_share = 0.6              # part of the budget spent waiting for thumbnails
+        self.embed_seconds_per_image = 0.2  # running estimate (conservative until measured) of ResNet time per image
+
+    def rerank(self, input_image: bytes, prices: list) -> dict:
+        """
+        Adds visual_similarity / visual_match to each price entry in place.
+        Returns a summary {status, thumbnails, elapsed_ms}.
+        """
+        start = time.perf_counter()
+        # Never spend more than the request has left
+        left = deadline.remaining()
+        budget = self.budget if left is None else min(self.budget, left)
+        urls = list(dict.fromkeys(p["thumbnail"] for p in prices if p.get("thumbnail")))[:self.max_thumbnails]
+        if not self.enabled or not urls:
+            return {"status": "skipped", "thumbnails": 0, "elapsed_ms": 0}
+
+        fetched = image_fetcher.fetch_many(urls, timeout=budget * self.fetch_share)
+        ordered = [u for u in urls if u in fetched]
+        remaining = budget - (time.perf_counter() - start)
+        # Embed as many thumbnails (top results first) as the remaining budget allows
+        fits = int(remaining / self.embed_seconds_per_image) - 1
+        if not ordered or fits < 1:
+            print(f"Price re-rank skipped: {len(ordered)}/{len(urls)} thumbnails, {remaining * 1000:.0f} ms left")
+            return {"status": "budget_exhausted" if ordered else "no_thumbnails", "thumbnails": len(ordered),
+                    "elapsed_ms": round((time.perf_counter() - start) * 1000)}
+        ordered = ordered[:fits]
+
+        embed_start = time.perf_counter()
+        try:
+            # Preprocessing may wait for the image pool only as long as the re-rank budget has left
+            embeddings = verification_service.get_embeddings([input_image] + [fetched[u] for u in ordered],
+                                                             wait=remaining)
+        except ImagePoolBusy:
+            print(f"Price re-rank skipped: image pool busy for {len(ordered) + 1} images")
+            return {"status": "pool_busy", "thumbnails": len(ordered),
+                    "elapsed_ms": round((time.perf_counter() - start) * 1000)}
+        per_image = (time.perf_counter() - embed_start) / (len(ordered) + 1)
+        self.embed_seconds_per_image = 0.7 * self.embed_seconds_per_image + 0.3 * per_image
+
+        query = embeddings[0]
+        if query is None:
+            return {"status": "failed", "thumbnails": len(ordered), "elapsed_ms": round((time.perf_counter() - start) * 1000)}
+        similarity = {u: float(query @ e) for u, e in zip(ordered, embeddings[1:]) if e is not None}
+        for p in prices:
+            score = similarity.get(p.get("thumbnail"))
+            p["visual_similarity"] = round(score, 4) if score is not None else None
+            p["visual_match"] = None if score is None else score >= self.min_similarity
+
+        return {"status": "ranked" if len(ordered) == len(urls) else "partial", "thumbnails": len(similarity),
+                "elapsed_ms": round((time.perf_counter() - start) * 1000)}
+
+
+price_ranker = PriceRanker()
@@ -0,0 +1,160 @@
+"""
+Background refresh of popular price lookups.
+
+/price records each identified product, per region, here. Popularity is an exponentially
+decaying request count (half-life PRICE_POPULARITY_HALF_LIFE seconds), so a product asked for a lot
+yesterday but not today cools off on its own. Every PRICE_REFRESH_INTERVAL seconds an
+asyncio task takes the PRICE_REFRESH_TOP most popular products with a score of at least
+PRICE_REFRESH_MIN_SCORE and re-fetches those whose cached prices are missing or within
+PRICE_REFRESH_AHEAD_SECONDS of expiring (search_service, PRICE_CACHE_SECONDS), most popular
+first. Refreshes run one at a time and draw on a token bucket of PRICE_REFRESH_PER_MINUTE,
+so the refresher never spends more of the search quota than that; nothing is refreshed
+while the search providers' breakers are open.
+
+The cache and counters are per process. GET /health/prices shows cache hits/misses,
+refresh counts and the hottest products.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+from fastapi.concurrency import run_in_threadpool
+
+from services.search_service import search_service, price_key
+from services.circuit_breaker import CircuitOpenError
+
+load_dotenv()
+
+
+class PopularityCounter:
+    """Decayed hit counts: each hit adds 1, and scores halve every `half_life` seconds."""
+
+    def __init__(self, half_life: float, max_entries: int = 5000):
+        self.decay = math.log(2) / half_life
+        self.max_entries = max_entries
+        self.scores = {}        # key -> (score, as_of)
+        self.lock = threading.Lock()
+
+    def _current(self, entry, now: float) -> float:
+        score, as_of = entry
+        return score * math.exp(-self.decay * (now - as_of))
+
+    def hit(self, key: str, now: float = None):
+        now = time.time() if now is None else now
+        with self.lock:
+            entry = self.scores.get(key)
+            self.scores[key] = ((self._current(entry, now) if entry else 0.0) + 1.0, now)
+            if len(self.scores) > self.max_entries:
+                # Forget the coldest half rather than one key per hit
+                ranked = sorted(self.scores, key=lambda k: self._current(self.scores[k], now))
+                for cold in ranked[:len(ranked) // 2]:
+                    del self.scores[cold]
+
+    def top(self, n: int, now: float = None) -> list:
+        """[(key, score)] for the n highest current scores."""
+        now = time.time() if now is None else now
+        with self.lock:
+            scored = [(key, self._current(entry, now)) for key, entry in self.scores.items()]
+        return sorted(scored, key=lambda item: item[1], reverse=True)[:n]
+
+
+class PriceRefresher:
+    def __init__(self, search=search_service):
+        self.search = search
+        self.enabled = os.getenv("PRICE_REFRESH", "1") != "0" and search.price_cache_seconds > 0
+        self.interval = float(os.getenv("PRICE_REFRESH_INTERVAL", 30))
+        self.top_n = int(os.getenv("PRICE_REFRESH_TOP", 50))
+        self.min_score = float(os.getenv("PRICE_REFRESH_MIN_SCORE", 2))
+        self.ahead = float(os.getenv("PRICE_REFRESH_AHEAD_SECONDS", 300))
+        self.per_minute = float(os.getenv("PRICE_REFRESH_PER_MINUTE", 10))
+        self.popularity = PopularityCounter(float(os.getenv("PRICE_POPULARITY_HALF_LIFE", 6 * 3600)))
+        self.tokens = self.per_minute
+        self.tokens_at = time.monotonic()
+        self.task = None
+        self.stats = {"refreshed": 0, "failed": 0, "skipped_budget": 0, "ticks": 0}
+
+    def record(self, query: str, regions: list):
+        if self.enabled and query and query != "unknown product":
+            for region in regions:
+                self.popularity.hit((query, region))
+
+    def _take_token(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.per_minute, self.tokens + (now - self.tokens_at) * self.per_minute / 60.0)
+        self.tokens_at = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    def due(self) -> list:
+        """Popular (query, region) pairs whose cached prices are missing or about to expire, hottest first."""
+        refresh_after = max(0.0, self.search.price_cache_seconds - self.ahead)
+        due = []
+        for (query, region), score in self.popularity.top(self.top_n):
+            if score < self.min_score:
+                break
+            age = self.search.cache_age("prices", price_key(query, region))
+            if age is None or age >= refresh_after:
+                due.append((query, region))
+        return due
+
+    def _providers_down(self) -> bool:
+        enabled = [breaker for breaker, on in ((self.search.serpapi_breaker, self.search.serpapi_enabled),
+                                               (self.search.duckduckgo_breaker, self.search.duckduckgo_enabled)) if on]
+        return not enabled or all(breaker.is_open() for breaker in enabled)
+
+    async def tick(self):
+        self.stats["ticks"] += 1
+        if self._providers_down():
+            return
+        for query, region in self.due():
+            if not self._take_token():
+                self.stats["skipped_budget"] += 1
+                break
+            try:
+                results = await run_in_threadpool(self.search.region_prices, query, region, True)
+                self.stats["refreshed" if results else "failed"] += 1
+            except CircuitOpenError:
+                return
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"Price refresh failed for {price_key(query, region)}: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"Price refresher error: {e}")
+
+    def start(self):
+        if self.enabled and self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "cache_seconds": self.search.price_cache_seconds,
+            "cache": self.search.cache_snapshot(),
+            "refresh": {**self.stats, "budget_tokens": round(self.tokens, 1)},
+            "popular": [{"query": q, "region": r, "score": round(s, 2),
+                         "cache_age_seconds": round(a) if (a := self.search.cache_age("prices", price_key(q, r))) is not None else None}
+                        for (q, r), s in self.popularity.top(10)],
+        }
+
+
+price_refresher = PriceRefresher()
@@ -0,0 +1,438 @@
+"""
+Provider layer for the external APIs used by GeminiService and SearchService.
+
+PROVIDER_MODE selects the backend:
+    live    - call Gemini / SerpApi / DuckDuckGo directly (default)
+    record  - call the live APIs and capture every request/response pair to disk
+    replay  - serve captured pairs from disk with their original timing, no network
+
+Captured pairs ("cassettes") are stored as JSON under PROVIDER_CASSETTE_DIR.
+PROVIDER_REPLAY_SPEED scales the replayed latency (1.0 = original, 0 = instant).
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from services import deadline
+from services.deadline import DeadlineExceeded
+from services.circuit_breaker import is_quota_error
+
+load_dotenv()
+
+
+class ProviderError(Exception):
+    """Raised in replay mode for a recorded failure, or when no recording matches."""
+
+
+class GeminiProvider:
+    """
+    Interface: turns a list of prompt strings / images (PIL or {mime_type, data} blobs) into
+    the model's text answer. system_instruction carries the static part of a prompt.
+    """
+
+    def generate_content(self, contents: list, model_name: str = None, system_instruction: str = None) -> str:
+        raise NotImplementedError
+
+
+class SearchProvider:
+    """Interface: raw search backends used by SearchService."""
+
+    def serpapi_search(self, params: dict) -> dict:
+        raise NotImplementedError
+
+    def ddg_text(self, keywords: str, **kwargs) -> list:
+        raise NotImplementedError
+
+    def ddg_images(self, keywords: str, **kwargs) -> list:
+        raise NotImplementedError
+
+
+class LiveGeminiProvider(GeminiProvider):
+    def __init__(self, api_key: str, default_model: str = "gemini-2.5-flash"):
+        from google import genai
+        from google.genai import types
+
+        self.types = types
+        self.default_model = default_model
+        # Upper bound per call; the request deadline shortens it further
+        self.timeout = float(os.getenv("GEMINI_TIMEOUT", 60))
+        # genai.Client is bound to this key, rather than to process-wide configuration,
+        # so several keys can live side by side in a GeminiClientPool.
+        # Optional endpoint override so the service can be pointed at a local stand-in (see stub_providers.py)
+        endpoint = os.getenv("GEMINI_API_ENDPOINT")
+        http_options = types.HttpOptions(base_url=endpoint) if endpoint else None
+        self.client = genai.Client(api_key=api_key, http_options=http_options)
+
+    def _part(self, part):
+        # image_pool hands over {mime_type, data} blobs; text and PIL images pass through as they are
+        if isinstance(part, dict) and "data" in part:
+            return self.types.Part.from_bytes(data=part["data"], mime_type=part.get("mime_type", "image/jpeg"))
+        return part
+
+    def generate_content(self, contents: list, model_name: str = None, system_instruction: str = None) -> str:
+        timeout = deadline.timeout(self.timeout, "gemini")
+        config = self.types.GenerateContentConfig(
+            system_instruction=system_instruction,
+            http_options=self.types.HttpOptions(timeout=int(timeout * 1000)),
+        )
+        response = self.client.models.generate_content(
+            model=model_name or self.default_model, contents=[self._part(p) for p in contents], config=config
+        )
+        if response.text is None:
+            reason = response.candidates[0].finish_reason if response.candidates else "no candidates"
+            raise ValueError(f"Gemini returned no text ({reason})")
+        return response.text
+
+
+def _is_transient_error(error: Exception) -> bool:
+    return getattr(error, "code", None) in (500, 502, 503, 504) or isinstance(error, (ConnectionError, TimeoutError))
+
+
+class _PoolClient:
+    """One (API key, model) pair in a GeminiClientPool with its health counters."""
+
+    def __init__(self, label: str, provider: GeminiProvider, model_name: str, tier: int, key: str = None):
+        self.label = label
+        self.provider = provider
+        self.model_name = model_name
+        self.tier = tier                # 0 = primary model, 1.. = fallback models in order
+        self.key = key or label         # clients sharing a key share its per-model quota
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.throttled = 0
+        self.consecutive_failures = 0
+        self.latency_ewma = None
+
+    def load(self) -> float:
+        # Expected wait if this client is picked: queue depth times its recent latency
+        return (self.in_flight + 1) * (self.latency_ewma or 1.0)
+
+
+class GeminiClientPool(GeminiProvider):
+    """
+    Spreads generate_content calls over several API keys and fallback models.
+
+    Clients are (key, model) pairs. Calls go to the primary model's clients first, picked
+    least-loaded (in-flight x latency EWMA) or round-robin; a 429 ejects that key for that
+    model only (quotas are per key and model) for GEMINI_POOL_EJECT_SECONDS, and the call is
+    retried on the next one. Fallback models are used only while every primary client is ejected.
+    """
+
+    def __init__(self, clients: list, strategy: str = "least_loaded", eject_seconds: float = 60.0,
+                 max_consecutive_failures: int = 3):
+        self.clients = clients
+        self.strategy = strategy
+        self.eject_seconds = eject_seconds
+        self.max_consecutive_failures = max_consecutive_failures
+        self.lock = threading.Lock()
+        self.cursor = 0
+        self.ejected_until = {}         # (key, model) -> monotonic time
+
+    def _ejection(self, client: _PoolClient, model_name: str = None) -> float:
+        return self.ejected_until.get((client.key, model_name or client.model_name), 0.0)
+
+    def _acquire(self, model_name: str, tried: set):
+        now = time.monotonic()
+        with self.lock:
+            candidates = [c for c in self.clients if (c.key, model_name or c.model_name) not in tried]
+            if model_name:
+                # An explicitly requested model keeps to clients serving that model
+                candidates = [c for c in candidates if c.model_name == model_name] or candidates
+            if not candidates:
+                return None
+            healthy = [c for c in candidates if now >= self._ejection(c, model_name)]
+            if healthy:
+                best_tier = min(c.tier for c in healthy)
+                pool = [c for c in healthy if c.tier == best_tier]
+                if self.strategy == "round_robin":
+                    self.cursor += 1
+                    client = pool[self.cursor % len(pool)]
+                else:
+                    client = min(pool, key=lambda c: c.load())
+            else:
+                # Everything is ejected: try the client whose ejection ends first rather than fail outright
+                client = min(candidates, key=lambda c: self._ejection(c, model_name))
+            client.in_flight += 1
+            client.calls += 1
+            return client
+
+    def _release(self, client: _PoolClient, model_name: str, elapsed: float = None, error: Exception = None):
+        with self.lock:
+            client.in_flight -= 1
+            if error is None:
+                client.consecutive_failures = 0
+                client.latency_ewma = elapsed if client.latency_ewma is None else 0.8 * client.latency_ewma + 0.2 * elapsed
+                return
+            client.failures += 1
+            client.consecutive_failures += 1
+            if is_quota_error(error):
+                client.throttled += 1
+                self.ejected_until[(client.key, model_name)] = time.monotonic() + self.eject_seconds
+                print(f"Gemini pool: {client.key}/{model_name} quota exhausted, ejected for {self.eject_seconds:.0f}s")
+            elif client.consecutive_failures >= self.max_consecutive_failures:
+                self.ejected_until[(client.key, model_name)] = time.monotonic() + self.eject_seconds / 4
+                print(f"Gemini pool: {client.key}/{model_name} failing repeatedly, ejected for {self.eject_seconds / 4:.0f}s")
+
+    def generate_content(self, contents: list, model_name: str = None, system_instruction: str = None) -> str:
+        tried = set()
+        last_error = None
+        while True:
+            # Don't move on to the next key once the request has run out of time
+            deadline.check("gemini")
+            client = self._acquire(model_name, tried)
+            if client is None:
+                raise last_error
+            # A requested model outside the pool (e.g. a cascade tier) still rides on this client's key
+            served = model_name or client.model_name
+            tried.add((client.key, served))
+            start = time.perf_counter()
+            try:
+                text = client.provider.generate_content(contents, served, system_instruction)
+            except Exception as e:
+                self._release(client, served, error=e)
+                last_error = e
+                if is_quota_error(e) or _is_transient_error(e):
+                    continue
+                raise
+            self._release(client, served, elapsed=time.perf_counter() - start)
+            return text
+
+    def stats(self) -> list:
+        now = time.monotonic()
+        with self.lock:
+            return [{
+                "client": c.label,
+                "model": c.model_name,
+                "healthy": now >= self._ejection(c),
+                "ejected_for_seconds": round(max(0.0, self._ejection(c) - now), 1),
+                "in_flight": c.in_flight,
+                "calls": c.calls,
+                "failures": c.failures,
+                "throttled": c.throttled,
+                "latency_ewma_seconds": round(c.latency_ewma, 3) if c.latency_ewma is not None else None,
+            } for c in self.clients]
+
+
+def build_gemini_pool(api_keys: list, models: list) -> GeminiProvider:
+    """A single key and model needs no pool; otherwise one client per (key, model)."""
+    if len(api_keys) == 1 and len(models) == 1:
+        return LiveGeminiProvider(api_keys[0], models[0])
+    # One client per key, shared by that key's (key, model) entries
+    providers = {api_key: LiveGeminiProvider(api_key, models[0]) for api_key in api_keys}
+    labels = {}
+    for n, api_key in enumerate(api_keys):
+        label = f"key ...{api_key[-4:]}"
+        labels[api_key] = label if label not in labels.values() else f"{label}#{n + 1}"
+    clients = []
+    for tier, model_name in enumerate(models):
+        for api_key in api_keys:
+            key = labels[api_key]
+            clients.append(_PoolClient(f"{key}/{model_name}", providers[api_key], model_name, tier, key))
+    return GeminiClientPool(
+        clients,
+        strategy=os.getenv("GEMINI_POOL_STRATEGY", "least_loaded"),
+        eject_seconds=float(os.getenv("GEMINI_POOL_EJECT_SECONDS", 60)),
+    )
+
+
+class LiveSearchProvider(SearchProvider):
+    def __init__(self):
+        # Overridable so load tests can run against a local SerpApi stand-in (see stub_providers.py)
+        self.serpapi_base_url = os.getenv("SERPAPI_BASE_URL", "https://serpapi.com").rstrip("/")
+        # The serpapi client's own default timeout is 60000 seconds
+        self.serpapi_timeout = float(os.getenv("SERPAPI_TIMEOUT", 15))
+
+    def serpapi_search(self, params: dict) -> dict:
+        from serpapi import GoogleSearch
+
+        search = GoogleSearch(dict(params))
+        search.BACKEND = self.serpapi_base_url
+        search.timeout = deadline.timeout(self.serpapi_timeout, "serpapi")
+        return search.get_dict()
+
+    def ddg_text(self, keywords: str, **kwargs) -> list:
+        from duckduckgo_search import DDGS
+
+        with DDGS(timeout=max(1, int(deadline.timeout(10, "duckduckgo")))) as ddgs:
+            return list(ddgs.text(keywords, **kwargs))
+
+    def ddg_images(self, keywords: str, **kwargs) -> list:
+        from duckduckgo_search import DDGS
+
+        with DDGS(timeout=max(1, int(deadline.timeout(10, "duckduckgo")))) as ddgs:
+            return list(ddgs.images(keywords=keywords, **kwargs))
+
+
+def _describe_part(part) -> dict:
+    """JSON-safe description of a prompt part; images are reduced to a content hash."""
+    if isinstance(part, str):
+        return {"text": part}
+    if hasattr(part, "tobytes") and hasattr(part, "size"):
+        digest = hashlib.sha256(part.tobytes()).hexdigest()
+        return {"image": {"size": list(part.size), "mode": part.mode, "sha256": digest}}
+    if isinstance(part, dict) and "data" in part:
+        return {"blob": {"mime_type": part.get("mime_type"), "sha256": hashlib.sha256(part["data"]).hexdigest()}}
+    if isinstance(part, (bytes, bytearray)):
+        return {"bytes": hashlib.sha256(part).hexdigest()}
+    return {"repr": repr(part)}
+
+
+class CassetteStore:
+    """One JSON file per request key; each file holds the list of recorded interactions."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.cursors = {}
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(provider: str, request: dict) -> str:
+        blob = json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        return f"{provider}-{hashlib.sha256(blob).hexdigest()[:24]}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def append(self, key: str, interaction: dict):
+        with self.lock:
+            path = self._path(key)
+            entries = []
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    entries = json.load(f)
+            entries.append(interaction)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, indent=2, ensure_ascii=False)
+
+    def next(self, key: str) -> dict:
+        """Returns recorded interactions in order, cycling once all have been served."""
+        with self.lock:
+            path = self._path(key)
+            if not os.path.exists(path):
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            if not entries:
+                return None
+            index = self.cursors.get(key, 0)
+            self.cursors[key] = index + 1
+            return entries[index % len(entries)]
+
+
+class _Cassette:
+    """Shared record/replay mechanics for both provider kinds."""
+
+    def __init__(self, store: CassetteStore, mode: str, speed: float = 1.0):
+        self.store = store
+        self.mode = mode
+        self.speed = speed
+
+    def call(self, provider: str, request: dict, live_call):
+        key = self.store.key(provider, request)
+
+        if self.mode == "replay":
+            interaction = self.store.next(key)
+            if interaction is None:
+                raise ProviderError(f"No recording for {provider} request {key}")
+            if self.speed > 0:
+                wait = interaction.get("elapsed", 0) * self.speed
+                left = deadline.remaining()
+                if left is not None and wait > left:
+                    # Behave like the live call timing out against the request deadline
+                    time.sleep(left)
+                    raise DeadlineExceeded(f"{provider} replay skipped: recorded {wait:.1f}s exceeds the deadline")
+                time.sleep(wait)
+            if "error" in interaction:
+                raise ProviderError(interaction["error"])
+            return interaction["response"]
+
+        start = time.perf_counter()
+        try:
+            response = live_call()
+        except Exception as e:
+            self.store.append(key, {
+                "request": request,
+                "error": f"{type(e).__name__}: {e}",
+                "elapsed": round(time.perf_counter() - start, 4),
+            })
+            raise
+        self.store.append(key, {
+            "request": request,
+            "response": response,
+            "elapsed": round(time.perf_counter() - start, 4),
+        })
+        return response
+
+
+class CassetteGeminiProvider(GeminiProvider):
+    def __init__(self, cassette: _Cassette, live: GeminiProvider = None):
+        self.cassette = cassette
+        self.live = live
+
+    def generate_content(self, contents: list, model_name: str = None, system_instruction: str = None) -> str:
+        request = {"model": model_name, "contents": [_describe_part(p) for p in contents]}
+        if system_instruction:
+            request["system"] = hashlib.sha256(system_instruction.encode("utf-8")).hexdigest()
+        return self.cassette.call("gemini", request, lambda: self.live.generate_content(contents, model_name, system_instruction))
+
+
+class CassetteSearchProvider(SearchProvider):
+    def __init__(self, cassette: _Cassette, live: SearchProvider = None):
+        self.cassette = cassette
+        self.live = live
+
+    def serpapi_search(self, params: dict) -> dict:
+        # Never write the key to disk, and keep it out of the lookup key
+        request = {k: v for k, v in params.items() if k != "api_key"}
+        return self.cassette.call("serpapi", request, lambda: self.live.serpapi_search(params))
+
+    def ddg_text(self, keywords: str, **kwargs) -> list:
+        request = {"keywords": keywords, **kwargs}
+        return self.cassette.call("ddg_text", request, lambda: self.live.ddg_text(keywords, **kwargs))
+
+    def ddg_images(self, keywords: str, **kwargs) -> list:
+        request = {"keywords": keywords, **kwargs}
+        return self.cassette.call("ddg_images", request, lambda: self.live.ddg_images(keywords, **kwargs))
+
+
+def _cassette_from_env() -> _Cassette:
+    mode = os.getenv("PROVIDER_MODE", "live").lower()
+    directory = os.getenv("PROVIDER_CASSETTE_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "cassettes"))
+    speed = float(os.getenv("PROVIDER_REPLAY_SPEED", "1.0"))
+    return _Cassette(CassetteStore(directory), mode, speed)
+
+
+def get_gemini_provider(api_key: str) -> GeminiProvider:
+    """
+    Builds the Gemini provider selected by PROVIDER_MODE. GEMINI_API_KEYS (comma-separated)
+    adds keys and GEMINI_FALLBACK_MODELS adds fallback models to a GeminiClientPool.
+    """
+    mode = os.getenv("PROVIDER_MODE", "live").lower()
+    if mode == "replay":
+        return CassetteGeminiProvider(_cassette_from_env())
+    api_keys = [k.strip() for k in os.getenv("GEMINI_API_KEYS", "").split(",") if k.strip()]
+    if api_key and api_key not in api_keys:
+        api_keys.insert(0, api_key)
+    models = [os.getenv("GEMINI_MODEL", "gemini-2.5-flash")]
+    models += [m.strip() for m in os.getenv("GEMINI_FALLBACK_MODELS", "").split(",") if m.strip() and m.strip() not in models]
+    live = build_gemini_pool(api_keys, models)
+    if mode == "record":
+        return CassetteGeminiProvider(_cassette_from_env(), live)
+    return live
+
+
+def get_search_provider() -> SearchProvider:
+    """Builds the search provider selected by PROVIDER_MODE."""
+    mode = os.getenv("PROVIDER_MODE", "live").lower()
+    if mode == "replay":
+        return CassetteSearchProvider(_cassette_from_env())
+    live = LiveSearchProvider()
+    if mode == "record":
+        return CassetteSearchProvider(_cassette_from_env(), live)
+    return live
@@ -0,0 +1,121 @@
+"""
+Reference-image comparison for /verify/reference.
+
+Finds several candidate reference images for the identified product, downloads them
+concurrently through the cached ImageFetcher, embeds the user's photo and all candidates
+in one ResNet batch, and only calls the Gemini visual comparison when the best
+embedding similarity falls in the inconclusive band.
+
+While Gemini's circuit breaker is open the embedding similarity is all there is, and
+fallback_verification() turns it into the degraded /verify answer.
+"""
+import os
+from dotenv import load_dotenv
+
+from services.circuit_breaker import CircuitOpenError, note_degraded
+from services.gemini_service import gemini_service
+from services.image_fetcher import image_fetcher
+from services.search_service import search_service
+from services.verification_service import verification_service
+
+load_dotenv()
+
+
+class ReferenceService:
+    def __init__(self):
+        self.candidates = int(os.getenv("REFERENCE_CANDIDATES", 5))
+        self.fetch_timeout = float(os.getenv("REFERENCE_FETCH_TIMEOUT", 8))
+        # Cosine similarity of ResNet50 embeddings: above `match` the photo clearly shows the
+        # reference product, below `mismatch` the references show something else
+        self.match_threshold = float(os.getenv("REFERENCE_MATCH_THRESHOLD", 0.80))
+        self.mismatch_threshold = float(os.getenv("REFERENCE_MISMATCH_THRESHOLD", 0.55))
+
+    def compare(self, input_image: bytes, query: str) -> dict:
+        result = {"query": query, "references": [], "best_reference": None, "similarity": None,
+                  "gemini_comparison": None}
+
+        urls = search_service.find_reference_images(query, self.candidates)
+        fetched = image_fetcher.fetch_many(urls, timeout=self.fetch_timeout)
+        ordered = [url for url in urls if url in fetched]
+        if not ordered:
+            return {**result, "verdict": "No Reference", "method": "Reference Search",
+                    "reasoning": "No reference images could be found or downloaded for this product."}
+
+        embeddings = verification_service.get_embeddings([input_image] + [fetched[url] for url in ordered])
+        query_embedding = embeddings[0]
+        if query_embedding is None:
+            return {**result, "verdict": "Error", "method": "Embedding Pre-screen",
+                    "reasoning": "The uploaded image could not be processed."}
+
+        scored = sorted(
+            ({"url": url, "similarity": round(float(query_embedding @ emb), 4)}
+             for url, emb in zip(ordered, embeddings[1:]) if emb is not None),
+            key=lambda r: r["similarity"], reverse=True
+        )
+        if not scored:
+            return {**result, "verdict": "No Reference", "method": "Reference Search",
+                    "reasoning": "None of the downloaded reference images could be decoded."}
+
+        best = scored[0]
+        result.update({"references": scored, "best_reference": best["url"], "similarity": best["similarity"]})
+
+        if best["similarity"] >= self.match_threshold:
+            return {**result, "verdict": "Consistent", "method": "Embedding Pre-screen",
+                    "reasoning": f"The photo closely matches an official reference image (similarity {best['similarity']:.2f})."}
+        if best["similarity"] < self.mismatch_threshold:
+            return {**result, "verdict": "No Matching Reference", "method": "Embedding Pre-screen",
+                    "reasoning": "The reference images found show a different product, so no visual comparison was made."}
+
+        print(f"Reference similarity {best['similarity']:.2f} inconclusive, escalating to Gemini comparison")
+        try:
+            comparison = gemini_service.compare_products(input_image, fetched[best["url"]])
+        except CircuitOpenError as e:
+            note_degraded("gemini", "embedding similarity only")
+            return {**result, "verdict": "Inconclusive", "method": "Embedding Pre-screen (degraded)",
+                    "reasoning": f"The embedding similarity ({best['similarity']:.2f}) is inconclusive and the "
+                                 f"visual comparison is unavailable: {e}"}
+        return {**result, "verdict": comparison.get("verdict", "Error"),
+                "method": "Embedding Pre-screen + Gemini Visual Comparison",
+                "reasoning": comparison.get("reasoning", ""), "gemini_comparison": comparison}
+
+    def fallback_verification(self, images_data: list, product_name: str = None) -> dict:
+        """
+        Degraded /verify answer while Gemini is unavailable, shaped like
+        GeminiService.verify_product_authenticity. Without the forensic model no verdict can be
+        given, so the result is always Unverifiable; a reference-image comparison (when the
+        product is known from its barcode) is reported as evidence.
+        """
+        note_degraded("gemini", "embedding-only verification")
+        reasoning = "The forensic model is temporarily unavailable, so only local checks were run."
+        anomalies = []
+        reference = None
+        if product_name:
+            try:
+                reference = self.compare(images_data[0], product_name)
+            except CircuitOpenError as e:
+                print(f"Reference search unavailable for fallback verification: {e}")
+            except Exception as e:
+                print(f"Fallback verification reference error: {e}")
+        if reference and reference.get("similarity") is not None:
+            reasoning += f" Reference check for '{product_name}': {reference['reasoning']}"
+            if reference["verdict"] == "No Matching Reference":
+                anomalies.append(f"The photo does not resemble official images of '{product_name}'")
+        elif product_name:
+            reasoning += f" No reference images of '{product_name}' could be compared."
+        else:
+            reasoning += " The product could not be identified from its barcode for a reference comparison."
+
+        return {
+            "product_info": {"brand": product_name or "Unknown", "model": "Unknown", "category": "Unknown"},
+            "verification": {
+                "is_authentic_guess": "Unverifiable",
+                "confidence_score": 0,
+                "anomalies_detected": anomalies,
+                "detailed_reasoning": reasoning,
+            },
+            "method": "Embedding-only Verification (degraded)",
+            "raw_forensic_analysis": {"reference_check": reference},
+        }
+
+
+reference_service = ReferenceService()
@@ -0,0 +1,107 @@
+"""
+Shopping markets for price lookups and currency conversion between them.
+
+Each region maps to the Google Shopping locale (google_domain / gl / hl) for SerpApi, the
+DuckDuckGo region, and the local currency. /price takes
+`regions=in,us,uk` (default PRICE_REGIONS, at most PRICE_MAX_REGIONS); results from all of
+them are converted into the first region's currency.
+
+Rates are static, in INR per unit, and only meant for ranking offers against each other;
+override them with FX_RATES="USD=83.5,EUR=90" (values in INR).
+"""
+import os
+import re
+from collections import namedtuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+Region = namedtuple("Region", ["code", "google_domain", "gl", "hl", "ddg_region", "country", "currency"])
+
+REGIONS = {r.code: r for r in (
+    Region("in", "google.co.in", "in", "en", "in-in", "india", "INR"),
+    Region("us", "google.com", "us", "en", "us-en", "usa", "USD"),
+    Region("uk", "google.co.uk", "uk", "en", "uk-en", "uk", "GBP"),
+    Region("de", "google.de", "de", "de", "de-de", "germany", "EUR"),
+    Region("fr", "google.fr", "fr", "fr", "fr-fr", "france", "EUR"),
+    Region("ae", "google.ae", "ae", "en", "xa-en", "uae", "AED"),
+    Region("sg", "google.com.sg", "sg", "en", "sg-en", "singapore", "SGD"),
+    Region("au", "google.com.au", "au", "en", "au-en", "australia", "AUD"),
+    Region("ca", "google.ca", "ca", "en", "ca-en", "canada", "CAD"),
+    Region("jp", "google.co.jp", "jp", "ja", "jp-jp", "japan", "JPY"),
+)}
+
+SYMBOLS = {"INR": "₹", "USD": "$", "GBP": "£", "EUR": "€", "AED": "AED", "SGD": "S$", "AUD": "A$", "CAD": "C$", "JPY": "¥"}
+
+# Symbols that name a single currency wherever they appear; "$" depends on the market
+UNAMBIGUOUS = (("₹", "INR"), ("Rs", "INR"), ("€", "EUR"), ("£", "GBP"), ("¥", "JPY"), ("AED", "AED"),
+               ("US$", "USD"), ("S$", "SGD"), ("A$", "AUD"), ("C$", "CAD"))
+
+INR_PER_UNIT = {"INR": 1.0, "USD": 83.0, "GBP": 105.0, "EUR": 90.0, "AED": 22.6, "SGD": 61.5,
+                "AUD": 55.0, "CAD": 61.0, "JPY": 0.56}
+
+
+def _load_rates() -> dict:
+    rates = dict(INR_PER_UNIT)
+    for item in os.getenv("FX_RATES", "").split(","):
+        code, _, value = item.partition("=")
+        if value:
+            rates[code.strip().upper()] = float(value)
+    return rates
+
+
+RATES = _load_rates()
+DEFAULT_REGIONS = [code.strip() for code in os.getenv("PRICE_REGIONS", "in").split(",") if code.strip()]
+MAX_REGIONS = int(os.getenv("PRICE_MAX_REGIONS", 5))
+
+
+def parse_regions(value: str = None) -> list:
+    """Region codes from a comma-separated list, de-duplicated in order; ValueError if unknown."""
+    codes = [code.strip().lower() for code in value.split(",")] if value else DEFAULT_REGIONS
+    codes = list(dict.fromkeys(code for code in codes if code))
+    unknown = [code for code in codes if code not in REGIONS]
+    if unknown:
+        raise ValueError(f"Unknown region(s) {', '.join(unknown)}; expected any of {', '.join(REGIONS)}")
+    if not codes:
+        raise ValueError("At least one region is required")
+    if len(codes) > MAX_REGIONS:
+        raise ValueError(f"At most {MAX_REGIONS} regions per request")
+    return codes
+
+
+def detect_currency(price: str, default: str) -> str:
+    """Currency code named in a price string, else the market's own currency."""
+    for token, code in UNAMBIGUOUS:
+        if token in price:
+            return code
+    return default
+
+
+def parse_amount(price: str) -> float:
+    """Number in a price string, for both 1,234.56 and 1.234,56 styles; 0.0 if none."""
+    match = re.search(r"\d[\d.,\s]*", price)
+    if not match:
+        return 0.0
+    digits = re.sub(r"\s", "", match.group()).rstrip(".,")
+    if "," in digits and "." in digits:
+        decimal = "," if digits.rfind(",") > digits.rfind(".") else "."
+    else:
+        # A lone separator is a decimal point unless three digits follow it:
+        # 19.99 and 12,50 are decimals; 1,250, 1.250 and 1,25,000 are grouping
+        separator = "," if "," in digits else "."
+        parts = digits.split(separator)
+        decimal = separator if len(parts) == 2 and len(parts[1]) != 3 else None
+    whole, _, fraction = digits.rpartition(decimal) if decimal else (digits, "", "")
+    try:
+        return float(re.sub(r"[.,]", "", whole) + "." + (fraction or "0"))
+    except ValueError:
+        return 0.0
+
+
+def convert(amount: float, from_code: str, to_code: str):
+    """Amount in `to_code`, or None when either rate is unknown."""
+    if from_code == to_code:
+        return amount
+    if from_code not in RATES or to_code not in RATES:
+        return None
+    return round(amount * RATES[from_code] / RATES[to_code], 2)
@@ -0,0 +1,248 @@
+"""
+Typed response models for the main endpoints, serialized with orjson.
+
+The models are slotted dataclasses, which orjson encodes natively without the
+jsonable_encoder walk FastAPI does for dicts returned from an endpoint. /verify
+returns a compact ForensicSummary in `raw_forensic_analysis` by default: flag
+observations, safety warnings and the reasoning are already in
+`verification_result.anomalies` / `.reasoning`, so only what the app renders and
+nothing else is repeated. `?verbose=true` returns the model's full forensic output.
+
+`?fields=` trims any response to a comma-separated list of dotted paths; list
+elements are selected into, e.g. `fields=product_name,prices.price,prices.seller`.
+"""
+from dataclasses import dataclass, field, fields as dataclass_fields, is_dataclass
+from typing import Optional
+
+import orjson
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+
+def as_list(value) -> list:
+    """A list field from the model's JSON as a list: missing -> [], a lone string or object -> [value]."""
+    if value is None or value == "":
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def health_assessment(value) -> dict:
+    """health_safety_assessment as a dict; a bare string from the model is kept as its only warning."""
+    if isinstance(value, dict):
+        return value
+    return {"safety_warnings": as_list(value)} if isinstance(value, str) else {}
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered by orjson; handles dataclasses and numpy scalars/arrays natively."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+@dataclass(slots=True)
+class ProductInfo:
+    brand: str = "Unknown"
+    model: str = "Unknown"
+    category: str = "Unknown"
+
+
+@dataclass(slots=True)
+class VerificationResult:
+    is_authentic: bool
+    verdict: str
+    confidence_score: float
+    anomalies: list
+    reasoning: str
+    method: str
+
+
+@dataclass(slots=True)
+class FlagSummary:
+    check: str
+    status: str
+
+
+@dataclass(slots=True)
+class SafetySummary:
+    risk_level: str = "Unknown"
+    flagged_components: list = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class ForensicSummary:
+    forensic_flags: list
+    health_safety_assessment: SafetySummary
+    recommendation: Optional[str] = None
+
+    @classmethod
+    def from_raw(cls, raw: dict) -> "ForensicSummary":
+        raw = raw if isinstance(raw, dict) else {}
+        health = health_assessment(raw.get("health_safety_assessment"))
+        recommendation = raw.get("recommendation")
+        return cls(
+            forensic_flags=[FlagSummary(str(f.get("check", "")), str(f.get("status", "")))
+                            for f in as_list(raw.get("forensic_flags")) if isinstance(f, dict)],
+            health_safety_assessment=SafetySummary(str(health.get("risk_level") or "Unknown"),
+                                                   [str(c) for c in as_list(health.get("flagged_components"))]),
+            recommendation=str(recommendation) if recommendation is not None else None,
+        )
+
+
+@dataclass(slots=True)
+class VerifyResponse:
+    filename: str
+    product_info: ProductInfo
+    verification_result: VerificationResult
+    raw_forensic_analysis: object       # ForensicSummary, or the full dict with ?verbose=true
+    cascade: Optional[dict] = None
+    degraded: Optional[list] = None
+    video_scan: Optional[dict] = None
+    scan_id: Optional[str] = None       # history row id, for signed-in callers
+
+
+@dataclass(slots=True)
+class PriceEntry:
+    seller: str
+    price: float
+    currency: str
+    link: str
+    rating: float
+    title: str = ""
+    thumbnail: Optional[str] = None
+    visual_similarity: Optional[float] = None
+    visual_match: Optional[bool] = None
+    region: Optional[str] = None
+    original_price: Optional[float] = None
+    original_currency: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, p: dict) -> "PriceEntry":
+        return cls(p.get("seller", "Unknown"), p.get("price", 0.0), p.get("currency", ""), p.get("link", ""),
+                   p.get("rating") or 0, p.get("title", ""), p.get("thumbnail") or None,
+                   p.get("visual_similarity"), p.get("visual_match"), p.get("region"),
+                   p.get("original_price"), p.get("original_currency"))
+
+
+@dataclass(slots=True)
+class PriceResponse:
+    product_name: str
+    gtin: Optional[str]
+    prices: list
+    visual_rerank: Optional[dict] = None
+    degraded: Optional[list] = None
+    scan_id: Optional[str] = None
+    regions: Optional[list] = None
+
+
+@dataclass(slots=True)
+class Spec:
+    label: str
+    value: str
+
+
+@dataclass(slots=True)
+class DetailsResponse:
+    description: str
+    specs: list
+    filename: str
+    scan_id: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, details: dict, filename: str) -> "DetailsResponse":
+        specs = [Spec(str(s.get("label", "")), str(s.get("value", "")))
+                 for s in details.get("specs", []) or [] if isinstance(s, dict)]
+        return cls(details.get("description") or details.get("error") or "", specs, filename)
+
+
+@dataclass(slots=True)
+class HistoryEntry:
+    scan_id: str
+    created_at: str
+    intent: str
+    input_type: str
+    image_url: Optional[str] = None
+    website_url: Optional[str] = None
+    product_name: Optional[str] = None
+    brand: Optional[str] = None
+    authenticity_status: Optional[str] = None
+    confidence_score: Optional[float] = None
+    best_price: Optional[float] = None
+    currency: Optional[str] = None
+    metadata: object = None             # the stored response, with ?verbose=true
+
+
+@dataclass(slots=True)
+class HistoryPage:
+    items: list
+    next_cursor: Optional[str] = None   # pass as ?cursor= for the next (older) page
+
+
+@dataclass(slots=True)
+class StatCounts:
+    scans: int = 0
+    verify: int = 0
+    price: int = 0
+    details: int = 0
+    genuine: int = 0
+    fake: int = 0
+    uncertain: int = 0
+
+    def add(self, intent: str, counts: dict):
+        self.scans += counts.get("scans") or 0
+        if intent in ("verify", "price", "details"):
+            setattr(self, intent, getattr(self, intent) + (counts.get("scans") or 0))
+        self.genuine += counts.get("genuine") or 0
+        self.fake += counts.get("fake") or 0
+        self.uncertain += counts.get("uncertain") or 0
+
+
+@dataclass(slots=True)
+class DailyStats:
+    day: str
+    counts: StatCounts
+
+
+@dataclass(slots=True)
+class StatsResponse:
+    total: StatCounts                   # all time
+    period: StatCounts                  # the last `days` days (UTC), today included
+    days: int
+    since: str
+    daily: list                         # DailyStats per day of the period, oldest first
+
+
+def _field_tree(selector: str) -> dict:
+    tree = {}
+    for path in selector.split(","):
+        node = tree
+        for part in (p.strip() for p in path.split(".")):
+            if part:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def _select(value, tree: dict, path: str = ""):
+    if not tree or value is None:
+        return value
+    if isinstance(value, list):
+        return [_select(item, tree, path) for item in value]
+    selected = {}
+    for name, subtree in tree.items():
+        if is_dataclass(value):
+            if name not in value.__dataclass_fields__:
+                known = ", ".join(f.name for f in dataclass_fields(value))
+                raise HTTPException(status_code=400, detail=f"Unknown field '{path}{name}' (expected one of: {known})")
+            selected[name] = _select(getattr(value, name), subtree, f"{path}{name}.")
+        elif isinstance(value, dict):
+            # Free-form parts (cascade, verbose forensic output) just skip missing keys
+            if name in value:
+                selected[name] = _select(value[name], subtree, f"{path}{name}.")
+    return selected
+
+
+def respond(payload, fields: str = None) -> FastJSONResponse:
+    """Serializes a response model (or plain dict) with orjson, keeping only `fields` if given."""
+    if fields and fields.strip():
+        payload = _select(payload, _field_tree(fields))
+    return FastJSONResponse(payload)
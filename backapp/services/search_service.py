@@ -1,83 +1,221 @@
-import requests
+import contextvars
 import os
-from duckduckgo_search import DDGS
-from serpapi import GoogleSearch
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
 from dotenv import load_dotenv
+from services.providers import SearchProvider, get_search_provider
+from services.circuit_breaker import breakers, CircuitOpenError, note_degraded
+from services import deadline
+from services.deadline import DeadlineExceeded
+from services.page_fetcher import page_fetcher
+from services.regions import REGIONS, DEFAULT_REGIONS, SYMBOLS, convert, detect_currency, parse_amount
 
 load_dotenv()
 
 class SearchService:
-    def __init__(self):
+    def __init__(self, provider: SearchProvider = None):
         self.api_key = os.getenv("SEARCH_API_KEY")
+        self.provider = provider or get_search_provider()
+        # Replay mode serves recorded SerpApi responses, so it works without a key
+        self.serpapi_enabled = bool(self.api_key) or os.getenv("PROVIDER_MODE", "live").lower() == "replay"
+        self.duckduckgo_enabled = os.getenv("DUCKDUCKGO_ENABLED", "1") != "0"
+        self.serpapi_breaker = breakers["serpapi"]
+        self.duckduckgo_breaker = breakers["duckduckgo"]
+        # Last good answer per query: prices are served from it for PRICE_CACHE_SECONDS, and
+        # anything in it is served (as degraded) when every search provider's breaker is open
+        self.fallback_cache_size = int(os.getenv("SEARCH_FALLBACK_CACHE_SIZE", 256))
+        self.fallback_cache = OrderedDict()     # (kind, query) -> (results, fetched_at)
+        self.cache_lock = threading.Lock()
+        self.price_cache_seconds = float(os.getenv("PRICE_CACHE_SECONDS", 1800))
+        self.cache_stats = {"hits": 0, "misses": 0}
+        self.region_executor = ThreadPoolExecutor(max_workers=int(os.getenv("PRICE_REGION_WORKERS", 4)),
+                                                  thread_name_prefix="price-region")
 
-    def find_reference_image(self, query: str) -> str:
+    def _count(self, key: str):
+        with self.cache_lock:
+            self.cache_stats[key] += 1
+
+    def cache_snapshot(self) -> dict:
+        with self.cache_lock:
+            return dict(self.cache_stats)
+
+    def _remember(self, kind: str, query: str, results: list, fresh: bool = True):
+        # A degraded answer is kept for fallback but never served as a fresh cache hit
+        with self.cache_lock:
+            self.fallback_cache[(kind, query)] = ([dict(r) if isinstance(r, dict) else r for r in results],
+                                                  time.time() if fresh else 0.0)
+            self.fallback_cache.move_to_end((kind, query))
+            while len(self.fallback_cache) > self.fallback_cache_size:
+                self.fallback_cache.popitem(last=False)
+
+    def _fresh(self, kind: str, query: str, max_age: float):
+        with self.cache_lock:
+            entry = self.fallback_cache.get((kind, query))
+            if entry is None or time.time() - entry[1] >= max_age:
+                return None
+            self.fallback_cache.move_to_end((kind, query))
+            return [dict(r) if isinstance(r, dict) else r for r in entry[0]]
+
+    def cache_age(self, kind: str, query: str):
+        """Seconds since the cached answer was fetched; None if not cached (or only as a fallback)."""
+        with self.cache_lock:
+            entry = self.fallback_cache.get((kind, query))
+        return time.time() - entry[1] if entry and entry[1] else None
+
+    def _unavailable(self, kind: str, query: str, skipped: list) -> list:
         """
-        Searches for a reference image URL using SerpApi (Google Images) OR DuckDuckGo.
+        Called when no provider produced results. If that is because every enabled provider's
+        breaker is open, serve the last cached answer (marked degraded) or fail fast.
         """
+        enabled = [name for name, on in (("serpapi", self.serpapi_enabled), ("duckduckgo", self.duckduckgo_enabled)) if on]
+        if not enabled or any(name not in [e.provider for e in skipped] for name in enabled):
+            return []
+        with self.cache_lock:
+            cached = self.fallback_cache.get((kind, query), (None,))[0]
+        if cached is not None:
+            print(f"Search providers unavailable, serving cached {kind} for: {query}")
+            for error in skipped:
+                note_degraded(error.provider, f"cached {kind}")
+            return [dict(r) if isinstance(r, dict) else r for r in cached]
+        raise skipped[-1]
+
+    def find_reference_images(self, query: str, limit: int = 5) -> list:
+        """
+        Searches for candidate reference image URLs using SerpApi (Google Images) OR DuckDuckGo.
+        Returns up to `limit` URLs, best first; empty if nothing was found.
+        """
+        skipped = []
         # 1. Try SerpApi if Key is present
-        if self.api_key:
+        if self.serpapi_enabled:
             print(f"Using SerpApi for: {query}")
             params = {
                 "engine": "google_images",
                 "q": query,
                 "api_key": self.api_key,
-                "num": 1
+                "num": limit
             }
             try:
-                response = requests.get("https://serpapi.com/search", params=params)
-                results = response.json()
-                if "images_results" in results and len(results["images_results"]) > 0:
-                    return results["images_results"][0]["original"]
-                else:
-                    print(f"SerpApi returned no images or error: {results.get('error')}")
+                results = self.serpapi_breaker.call(self.provider.serpapi_search, params)
+                urls = [r["original"] for r in results.get("images_results", []) if r.get("original")]
+                if urls:
+                    self._remember("images", query, urls[:limit])
+                    return urls[:limit]
+                print(f"SerpApi returned no images or error: {results.get('error')}")
+            except DeadlineExceeded:
+                raise
+            except CircuitOpenError as e:
+                print(f"SerpApi skipped: {e}")
+                skipped.append(e)
             except Exception as e:
                 print(f"SerpApi Error: {e}")
 
         # 2. Fallback to DuckDuckGo (Free, no key needed)
-        print(f"Using DuckDuckGo (Free Mode) for: {query}")
-        try:
-            with DDGS() as ddgs:
-                results = list(ddgs.images(
-                    keywords=query,
+        if self.duckduckgo_enabled:
+            try:
+                print(f"Using DuckDuckGo (Free Mode) for: {query}")
+                results = self.duckduckgo_breaker.call(
+                    self.provider.ddg_images,
+                    query,
                     region="wt-wt",
                     safesearch="off",
-                    max_results=1
-                ))
-                if results:
-                    print(f"DuckDuckGo found image: {results[0]['image'][:50]}...")
-                    return results[0]['image']
-                else:
-                    print("DuckDuckGo returned no results.")
-        except Exception as e:
-            print(f"DuckDuckGo Error: {e}")
+                    max_results=limit
+                )
+                urls = [r["image"] for r in results if r.get("image")]
+                if urls:
+                    print(f"DuckDuckGo found {len(urls)} images")
+                    if skipped:
+                        note_degraded("serpapi", "duckduckgo")
+                    self._remember("images", query, urls[:limit])
+                    return urls[:limit]
+                print("DuckDuckGo returned no results.")
+            except DeadlineExceeded:
+                raise
+            except CircuitOpenError as e:
+                print(f"DuckDuckGo skipped: {e}")
+                skipped.append(e)
+            except Exception as e:
+                print(f"DuckDuckGo Error: {e}")
+
+        print("Reference image search yielded no results.")
+        return self._unavailable("images", query, skipped)
+
+    def find_reference_image(self, query: str):
+        """Single best reference image URL, or None."""
+        urls = self.find_reference_images(query, limit=1)
+        return urls[0] if urls else None
 
-        # 3. Fallback for DEMO purposes (force success if search fails)
-        print("Search failed (or yielded no results). Using DEMO fallback image.")
-        # Return a generic high-quality product image (Nike Air Max)
-        return "https://images.unsplash.com/photo-1552346154-21d32810aba3?auto=format&fit=crop&w=1000&q=80"
+    def find_product_prices(self, query: str, regions: list = None, refresh: bool = False) -> list:
+        """
+        Finds online prices for the product query in each of `regions` (codes from
+        services/regions.py; default PRICE_REGIONS) and merges them into one list, cheapest
+        first, de-duplicated and converted into the first region's currency.
+        Returns list of dicts: {seller, price, currency, link, rating, title, thumbnail, region}
+        plus original_price / original_currency for converted entries.
+        Regions are looked up concurrently (PRICE_REGION_WORKERS at a time) and cached
+        separately, so overlapping region lists share cache entries.
+        Raises CircuitOpenError if every provider's breaker is open and nothing is cached,
+        and DeadlineExceeded once the request has run out of time.
+        """
+        regions = list(regions or DEFAULT_REGIONS)
+        if len(regions) == 1:
+            per_region = {regions[0]: self.region_prices(query, regions[0], refresh)}
+        else:
+            per_region = self._fan_out(query, regions, refresh)
+        return merge_prices(per_region, regions)
+
+    def _fan_out(self, query: str, regions: list, refresh: bool) -> dict:
+        # Each task runs in a copy of the request context, so providers still see its deadline
+        futures = {self.region_executor.submit(contextvars.copy_context().run, self.region_prices, query, region, refresh): region
+                   for region in regions}
+        done, pending = wait(futures, timeout=deadline.remaining())
+        per_region, failures = {}, []
+        for future in done:
+            try:
+                per_region[futures[future]] = future.result()
+            except (CircuitOpenError, DeadlineExceeded) as e:
+                failures.append(e)
+        if pending:
+            print(f"Price search: no answer from {', '.join(futures[f] for f in pending)} before the deadline")
+        if not per_region:
+            raise failures[0] if failures else DeadlineExceeded("price search skipped: no region answered before the deadline")
+        return per_region
 
-    def find_product_prices(self, query: str) -> list:
+    def region_prices(self, query: str, region: str, refresh: bool = False) -> list:
         """
-        Finds online prices for the product query.
-        Returns list of dicts: {seller, price, currency, link, rating, thumbnail}
+        Prices from one market, in its own currency.
+        An answer fetched less than PRICE_CACHE_SECONDS ago is served from cache unless
+        `refresh` is set (the background price refresher does that).
         """
+        market = REGIONS[region]
+        key = price_key(query, region)
+        if not refresh:
+            cached = self._fresh("prices", key, self.price_cache_seconds) if self.price_cache_seconds > 0 else None
+            if cached is not None:
+                self._count("hits")
+                print(f"Serving cached prices for: {key}")
+                return cached
+            self._count("misses")
+
         results_list = []
+        skipped = []
         
         # 1. Try SerpApi (Google Shopping) if Key is present
-        if self.api_key:
-            print(f"Using SerpApi (Google Shopping) for prices: {query}")
+        if self.serpapi_enabled:
+            print(f"Using SerpApi (Google Shopping) for prices: {key}")
             params = {
                 "engine": "google_shopping",
                 "q": query,
                 "api_key": self.api_key,
-                "google_domain": "google.co.in",
-                "gl": "in",
-                "hl": "en",
+                "google_domain": market.google_domain,
+                "gl": market.gl,
+                "hl": market.hl,
                 "num": 10
             }
             try:
-                search = GoogleSearch(params)
-                results = search.get_dict()
+                results = self.serpapi_breaker.call(self.provider.serpapi_search, params)
                 shopping_results = results.get("shopping_results", [])
                 
                 for res in shopping_results:
@@ -90,19 +228,13 @@ class SearchService:
                     
                     # Normalize price
                     price_val = 0.0
-                    currency = "₹"
+                    currency = market.currency
                     if isinstance(price, (int, float)):
                          price_val = float(price)
                     elif isinstance(price, str):
-                        # Extract number
-                        import re
-                        # simple extraction
-                        clean = re.sub(r'[^\d.]', '', price)
-                        try: price_val = float(clean)
-                        except: price_val = 0.0
-                        if "$" in price: currency = "$"
-                        elif "€" in price: currency = "€"
-                        elif "£" in price: currency = "£"
+                        currency = detect_currency(price, market.currency)
+                        extracted = res.get("extracted_price")
+                        price_val = float(extracted) if isinstance(extracted, (int, float)) else parse_amount(price)
                         
                     results_list.append({
                         "seller": seller,
@@ -111,60 +243,107 @@ class SearchService:
                         "link": link,
                         "rating": rating,
                         "title": title,
-                        "thumbnail": thumbnail
+                        "thumbnail": thumbnail,
+                        "region": region
                     })
                     
                 if results_list:
+                    self._remember("prices", key, results_list)
                     return results_list
                 else:
                     print("SerpApi Shopping returned no results.")
                     
+            except DeadlineExceeded:
+                raise
+            except CircuitOpenError as e:
+                print(f"SerpApi skipped: {e}")
+                skipped.append(e)
             except Exception as e:
                 print(f"SerpApi Project Price Error: {e}")
 
         # 2. Fallback to DuckDuckGo
-        if not results_list:
-            print(f"Using DuckDuckGo (Free Mode) for prices: {query}")
+        if not results_list and self.duckduckgo_enabled:
+            print(f"Using DuckDuckGo (Free Mode) for prices: {key}")
             try:
-                with DDGS() as ddgs:
-                    # Search for "buy <product> online india"
-                    search_results = list(ddgs.text(f"buy {query} online price india", region="in-in", safesearch="off", max_results=8))
-                    
-                    for res in search_results:
-                        title = res.get('title', '')
-                        href = res.get('href', '')
-                        
-                        price = 0.0
-                        seller = "Unknown"
-                        
-                        # Detect Seller
-                        if "amazon" in href: seller = "Amazon"
-                        elif "flipkart" in href: seller = "Flipkart"
-                        elif "myntra" in href: seller = "Myntra"
-                        elif "ajio" in href: seller = "Ajio"
-                        elif "meesho" in href: seller = "Meesho"
-                        else: seller = title.split(' ')[0] # Fallback
-                        
-                        # Simulate Price (Real extraction is hard with just DDG text API)
-                        import random
-                        base_price = 500 + len(query) * 50 # varied base in INR
-                        price = round(base_price * (0.9 + 0.2 * random.random()), 2) 
-                        
-                        results_list.append({
-                            "seller": seller,
-                            "price": price,
-                            "currency": "₹",
-                            "link": href,
-                            "rating": round(3.5 + 1.5 * random.random(), 1),
-                            "title": title,
-                        })
+                # Search for "buy <product> online <country>"
+                search_results = self.duckduckgo_breaker.call(
+                    self.provider.ddg_text, f"buy {query} online price {market.country}", region=market.ddg_region,
+                    safesearch="off", max_results=8
+                )
+                
+                # Real prices from the retailer pages among the results; other results are dropped
+                offers = page_fetcher.extract_many([res.get('href', '') for res in search_results])
+                for res in search_results:
+                    href = res.get('href', '')
+                    offer = offers.get(href)
+                    if not offer:
+                        continue
+                    results_list.append({
+                        "seller": offer["seller"],
+                        "price": offer["price"],
+                        "currency": offer["currency"] or market.currency,
+                        "link": href,
+                        "rating": offer["rating"] or 0,
+                        "title": offer["title"] or res.get('title', ''),
+                        "thumbnail": offer["thumbnail"] or "",
+                        "region": region,
+                    })
 
+            except DeadlineExceeded:
+                raise
+            except CircuitOpenError as e:
+                print(f"DuckDuckGo skipped: {e}")
+                skipped.append(e)
             except Exception as e:
                 print(f"DuckDuckGo Price Search Error: {e}")
 
         if not results_list:
-            return []
-            
+            return self._unavailable("prices", key, skipped)
+
+        if skipped:
+            note_degraded("serpapi", "duckduckgo")
+        self._remember("prices", key, results_list, fresh=not skipped)
         return results_list
 
+
+def price_key(query: str, region: str) -> str:
+    """Cache (and popularity) key of one market's prices for a query."""
+    return f"{region}:{query}"
+
+
+def _link_key(link: str) -> str:
+    parts = urlsplit(link or "")
+    return f"{parts.netloc.lower().removeprefix('www.')}{parts.path.rstrip('/')}?{parts.query}"
+
+
+def merge_prices(per_region: dict, regions: list) -> list:
+    """
+    One list from per-market results: prices converted into the first region's currency
+    (original_price / original_currency keep the listed amount), the same offer returned by
+    several markets kept once, cheapest first.
+    """
+    target = REGIONS[regions[0]].currency
+    merged, seen = [], set()
+    for region in regions:
+        for entry in per_region.get(region) or []:
+            entry = dict(entry)
+            code = entry.get("currency") or REGIONS[region].currency
+            converted = convert(entry.get("price") or 0.0, code, target)
+            if converted is None:
+                continue
+            if code != target:
+                entry["original_price"], entry["original_currency"] = entry["price"], SYMBOLS.get(code, code)
+            entry["price"], entry["currency"] = converted, SYMBOLS.get(target, target)
+            merged.append(entry)
+    merged.sort(key=lambda e: (e["price"] <= 0, e["price"]))
+    unique = []
+    for entry in merged:
+        keys = {(entry.get("seller", "").lower(), entry.get("title", "").lower(), entry["price"])}
+        if entry.get("link"):
+            keys.add(_link_key(entry["link"]))
+        if not keys & seen:
+            unique.append(entry)
+        seen |= keys
+    return unique
+
 search_service = SearchService()
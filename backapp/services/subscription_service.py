@@ -0,0 +1,103 @@
+"""
+Caller identity and subscription tier (admission priority, history ownership).
+
+The app sends the user's Supabase access token as `Authorization: Bearer <jwt>`. The user id
+and plan are read from the `subscriptions` table through Supabase's REST API with that same
+token, so row-level security ("Users can view own subscription") returns only the caller's
+row and an invalid or expired token is simply rejected: no key beyond the anon key is needed
+to authenticate. Answers are cached per token for SUBSCRIPTION_CACHE_SECONDS; any failure
+means an anonymous free-tier caller.
+
+HISTORY_DEV_USER_ID attributes unauthenticated requests to a fixed user; it is meant for the
+local SQLite history stand-in and must stay unset in production.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from dotenv import load_dotenv
+
+import requests
+
+load_dotenv()
+
+FREE, PAID = "free", "paid"
+
+Caller = namedtuple("Caller", ["user_id", "tier"])
+ANONYMOUS = Caller(None, FREE)
+
+
+class SubscriptionService:
+    def __init__(self):
+        self.url = (os.getenv("SUPABASE_URL") or os.getenv("EXPO_PUBLIC_SUPABASE_URL") or "").rstrip("/")
+        self.anon_key = os.getenv("SUPABASE_ANON_KEY") or os.getenv("EXPO_PUBLIC_SUPABASE_ANON_KEY") or ""
+        self.enabled = bool(self.url and self.anon_key)
+        self.paid_plans = {p.strip() for p in os.getenv("PAID_PLANS", "pro,enterprise").split(",") if p.strip()}
+        self.cache_seconds = float(os.getenv("SUBSCRIPTION_CACHE_SECONDS", 300))
+        self.timeout = float(os.getenv("SUBSCRIPTION_LOOKUP_TIMEOUT", 2))
+        self.cache = OrderedDict()
+        self.cache_size = 10000
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        dev_user = os.getenv("HISTORY_DEV_USER_ID")
+        self.dev_caller = Caller(dev_user, FREE) if dev_user else None
+
+    @staticmethod
+    def bearer_token(authorization: str):
+        if authorization and authorization[:7].lower() == "bearer ":
+            return authorization[7:].strip() or None
+        return None
+
+    def _cached(self, key: str):
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry and entry[1] > time.monotonic():
+                return entry[0]
+        return None
+
+    def _store(self, key: str, caller: Caller):
+        with self.lock:
+            self.cache[key] = (caller, time.monotonic() + self.cache_seconds)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def caller(self, authorization: str) -> Caller:
+        """(user_id, tier) for the bearer token; tier is 'paid' for an active pro/enterprise plan."""
+        token = self.bearer_token(authorization)
+        if not (self.enabled and token):
+            return self.dev_caller or ANONYMOUS
+        key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        cached = self._cached(key)
+        if cached:
+            return cached
+
+        caller = ANONYMOUS
+        try:
+            response = self.session.get(
+                f"{self.url}/rest/v1/subscriptions",
+                params={"select": "user_id,plan,status", "limit": "1"},
+                headers={"apikey": self.anon_key, "Authorization": f"Bearer {token}"},
+                timeout=self.timeout,
+            )
+            if response.status_code == 200:
+                rows = response.json()
+                if rows:
+                    paid = rows[0].get("status", "active") == "active" and rows[0].get("plan") in self.paid_plans
+                    caller = Caller(rows[0].get("user_id"), PAID if paid else FREE)
+            elif response.status_code not in (401, 403):
+                # Don't remember an identity we could not actually look up
+                print(f"Subscription lookup failed: HTTP {response.status_code}")
+                return ANONYMOUS
+        except Exception as e:
+            print(f"Subscription lookup error: {e}")
+            return ANONYMOUS
+        self._store(key, caller)
+        return caller
+
+    def tier(self, authorization: str) -> str:
+        return self.caller(authorization).tier
+
+
+subscription_service = SubscriptionService()
@@ -0,0 +1,248 @@
+"""
+Local typosquat fast path for /verify.
+
+OCRs the uploads (services/ocr_service.py, optional Tesseract) and fuzzy-matches the
+prominent text against a brand lexicon indexed in a BK-tree. The tree is keyed on plain
+Levenshtein distance, which is a metric, so its pruning never drops a match; candidates are
+then re-scored with transpositions counted as one edit ('Parel' for 'Parle').
+Candidates that are ordinary English words (AMPLE/Apple, Peaks/Pears) are skipped using
+wordfreq's frequency list (optional dependency). A lexical near-miss is never a verdict on
+its own: blatant cases (e.g. 'Parle-J' printed as the logo where 'Parle-G' never appears)
+become a hint that sends /verify straight to the full forensic tier and is merged into its
+answer as a failed Spelling Check; the verdict is the model's.
+"""
+import json
+import os
+import re
+from dotenv import load_dotenv
+
+try:
+    from wordfreq import zipf_frequency
+except ImportError:
+    zipf_frequency = None
+
+from services.ocr_service import ocr_service
+from services.response_models import as_list
+
+load_dotenv()
+
+# OCR misreads that must not be mistaken for a deliberate typo (e.g. 'Parle-6')
+OCR_CONFUSABLES = [("rn", "m"), ("vv", "w"), ("0", "o"), ("1", "l"), ("i", "l"), ("5", "s"), ("6", "g"), ("8", "b"), ("2", "z")]
+
+# Everyday pack words that sit within one edit of a brand (Apply/Apple, Tigers/Tiger), used
+# on top of wordfreq (and on their own when it is not installed)
+COMMON_WORDS = {"apply", "applied", "tigers", "boosts", "boosted", "wheels", "pearl", "pearls", "medium", "primer"}
+
+
+def normalize(text: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", text.lower())
+
+
+def _confusable_form(text: str) -> str:
+    for src, dst in OCR_CONFUSABLES:
+        text = text.replace(src, dst)
+    return text
+
+
+def levenshtein(a: str, b: str) -> int:
+    """Insertions, deletions and substitutions; a metric, as the BK-tree requires."""
+    if a == b:
+        return 0
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (a[i - 1] != b[j - 1]))
+        prev = cur
+    return prev[len(b)]
+
+
+def edit_distance(a: str, b: str) -> int:
+    """
+    Optimal string alignment distance (Levenshtein + adjacent transpositions). Not a metric
+    (osa('ca', 'abc') = 3 > osa('ca', 'ac') + osa('ac', 'abc') = 2), so it is only used to
+    re-score BK-tree results, never to build or prune the tree.
+    """
+    if a == b:
+        return 0
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        prev2, prev = prev, cur
+    return prev[len(b)]
+
+
+class BKTree:
+    """Burkhard-Keller tree: edit-distance lookups visit only branches within the radius."""
+
+    def __init__(self, distance=levenshtein):
+        self.distance = distance
+        self.root = None
+        self.size = 0
+
+    def add(self, word: str):
+        if self.root is None:
+            self.root = (word, {})
+            self.size = 1
+            return
+        node = self.root
+        while True:
+            d = self.distance(word, node[0])
+            if d == 0:
+                return
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = (word, {})
+                self.size += 1
+                return
+            node = child
+
+    def search(self, word: str, max_distance: int) -> list:
+        """Returns [(distance, word)] within max_distance, closest first."""
+        if self.root is None:
+            return []
+        results = []
+        stack = [self.root]
+        while stack:
+            term, children = stack.pop()
+            d = self.distance(word, term)
+            if d <= max_distance:
+                results.append((d, term))
+            for edge in range(d - max_distance, d + max_distance + 1):
+                child = children.get(edge)
+                if child is not None:
+                    stack.append(child)
+        return sorted(results)
+
+
+class TyposquatService:
+    def __init__(self, lexicon_path: str = None):
+        self.enabled = os.getenv("TYPOSQUAT_FAST_PATH", "1") != "0"
+        self.min_confidence = float(os.getenv("TYPOSQUAT_MIN_OCR_CONFIDENCE", 85))
+        self.min_fuzzy_length = 5   # shorter brands (Lux, Vim, Dove) only match exactly
+        # Zipf frequency (log10 per billion words) from which a candidate counts as a real word;
+        # 2.0 keeps names seen in English text (Fortuna, Santoro) and drops typos (Britania, 1.3)
+        self.word_zipf = float(os.getenv("TYPOSQUAT_WORD_ZIPF", 2.0))
+        self.prominent_lines = 3    # lines with the tallest text, i.e. the logo / product name
+        self.brands = {}
+        self.tree = BKTree()
+
+        path = lexicon_path or os.getenv(
+            "BRAND_LEXICON_PATH",
+            os.path.join(os.path.dirname(os.path.dirname(__file__)), "brand_lexicon.json")
+        )
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for brand in json.load(f).get("brands", []):
+                    key = normalize(brand)
+                    if key:
+                        self.brands[key] = brand
+                        self.tree.add(key)
+        except Exception as e:
+            print(f"Brand lexicon not loaded ({path}): {e}")
+
+    def _candidates(self, line_words: list) -> list:
+        """Single words plus adjacent pairs/triples, so 'Parle - G' and 'Parle-G' both normalise to 'parleg'."""
+        out = []
+        for size in (1, 2, 3):
+            for i in range(len(line_words) - size + 1):
+                group = line_words[i:i + size]
+                out.append({
+                    "text": " ".join(w["text"] for w in group),
+                    "key": normalize("".join(w["text"] for w in group)),
+                    "conf": min(w["conf"] for w in group),
+                })
+        return [c for c in out if c["key"]]
+
+    def is_word(self, key: str) -> bool:
+        """True for ordinary words and names, which are never treated as a typo of a brand."""
+        if key in COMMON_WORDS:
+            return True
+        return zipf_frequency is not None and zipf_frequency(key, "en") >= self.word_zipf
+
+    def _near_brands(self, key: str, max_distance: int) -> list:
+        """[(distance, brand key)] within max_distance, counting an adjacent transposition as one edit."""
+        # A transposition is two Levenshtein edits, so the tree is searched twice as wide
+        found = ((edit_distance(key, brand_key), brand_key) for _, brand_key in self.tree.search(key, 2 * max_distance))
+        return sorted(m for m in found if m[0] <= max_distance)
+
+    def analyze_words(self, words: list):
+        """
+        Returns a typosquat finding {observed, expected, distance} for blatant cases, else None.
+        Blatant = a high-confidence token in the most prominent text lines is within edit
+        distance 1-2 of a lexicon brand, is not itself a brand or an English word, is not
+        explainable as an OCR misread, and the genuine brand name appears nowhere on the pack.
+        """
+        lines = {}
+        for w in words:
+            lines.setdefault(w["line"], []).append(w)
+
+        all_candidates = [c for line in lines.values() for c in self._candidates(line)]
+        seen_exact = {c["key"] for c in all_candidates if c["key"] in self.brands}
+
+        prominent = sorted(lines.values(), key=lambda line: max(w["height"] for w in line), reverse=True)
+        for line in prominent[:self.prominent_lines]:
+            for cand in self._candidates(line):
+                key = cand["key"]
+                if cand["conf"] < self.min_confidence or key in self.brands or len(key) < self.min_fuzzy_length:
+                    continue
+                if self.is_word(key):
+                    continue
+                max_distance = 1 if len(key) <= 7 else 2
+                matches = self._near_brands(key, max_distance)
+                # Any brand that explains the text as an OCR misread makes the whole candidate ambiguous
+                if any(_confusable_form(key) == _confusable_form(brand_key) for _, brand_key in matches):
+                    continue
+                # Prefer same-length brands: 'parlej' is a typo of 'parleg', not an extension of 'parle'
+                matches.sort(key=lambda m: (m[0], abs(len(m[1]) - len(key))))
+                for distance, brand_key in matches:
+                    if distance == 0 or len(brand_key) < self.min_fuzzy_length or brand_key in seen_exact:
+                        continue
+                    # Typosquats keep the first letter so the logo still reads as the brand at a glance
+                    if brand_key[0] != key[0]:
+                        continue
+                    # Extensions / truncations ('Colgates', 'Adida') are sub-brands or cropped text, not blatant
+                    if key.startswith(brand_key) or brand_key.startswith(key):
+                        continue
+                    return {"observed": cand["text"], "expected": self.brands[brand_key], "distance": distance}
+        return None
+
+    def check(self, images_data: list[bytes]):
+        """
+        Runs the fast path. Returns the finding for a blatant near-miss, as a hint for the full
+        model check and merge_into(), or None.
+        """
+        if not (self.enabled and ocr_service.available and self.tree.size):
+            return None
+        try:
+            finding = self.analyze_words(ocr_service.words(images_data))
+        except Exception as e:
+            print(f"Typosquat fast path error: {e}")
+            return None
+        if finding:
+            print(f"Typosquat hint: '{finding['observed']}' near '{finding['expected']}'")
+        return finding
+
+    def merge_into(self, cot_result: dict, finding: dict):
+        """Adds a finding to a verify_product_authenticity result in place as a failed Spelling Check flag."""
+        if not finding:
+            return cot_result
+        observation = (f"Found '{finding['observed']}' near the brand '{finding['expected']}' "
+                       f"(edit distance {finding['distance']}) and the genuine name nowhere on the pack")
+        raw = cot_result.get("raw_forensic_analysis")
+        raw = cot_result["raw_forensic_analysis"] = raw if isinstance(raw, dict) else {}
+        raw["forensic_flags"] = as_list(raw.get("forensic_flags")) + [
+            {"check": "Spelling Check", "status": "FAIL", "observation": observation}]
+        verification = cot_result.get("verification")
+        verification = cot_result["verification"] = verification if isinstance(verification, dict) else {}
+        verification["anomalies_detected"] = as_list(verification.get("anomalies_detected")) + [observation]
+        return cot_result
+
+
+typosquat_service = TyposquatService()
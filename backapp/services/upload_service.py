@@ -0,0 +1,311 @@
+"""
+Upload limits.
+
+UploadLimitMiddleware bounds what the server accepts at all: a POST whose Content-Length is
+over the cap (MAX_REQUEST_BYTES, or MAX_VIDEO_BYTES for /verify/video, plus multipart
+overhead) is answered 413 before any of the body is read, and a body that streams past the
+cap (chunked, or a lying Content-Length) is cut off with 413 at that point. Starlette still
+spools each accepted multipart body (memory up to 1 MB per file, then a temp file) before the
+endpoint runs, so the ByteBudget in UploadService.ingest bounds the bytes the request then
+copies into memory and decodes, not the spool. The decode share is the bitmap decode_image
+builds for the in-process scans and goes back as soon as they finish (release_decode).
+"""
+import asyncio
+import io
+import os
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from PIL import Image
+from dotenv import load_dotenv
+
+from services.image_utils import decoded_size
+
+load_dotenv()
+
+MB = 1024 * 1024
+
+# Magic bytes of the formats the Gemini/PIL pipeline accepts
+IMAGE_SIGNATURES = {
+    b"\xff\xd8\xff": "JPEG",
+    b"\x89PNG\r\n\x1a\n": "PNG",
+}
+
+
+def detect_image_format(head: bytes):
+    for signature, name in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return name
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+def detect_video_format(head: bytes):
+    if head[4:8] == b"ftyp":
+        return "QuickTime" if head[8:10] == b"qt" else "MP4"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "WebM"
+    return None
+
+
+class ByteBudget:
+    """
+    Global cap on bytes held by in-flight requests (raw uploads + estimated decoded pixels).
+    Works like a counting semaphore whose permits are bytes; a request reserves its whole
+    amount at once so concurrent requests can never deadlock holding partial budgets.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, amount: int, timeout: float):
+        amount = min(amount, self.limit)
+        async with self._condition:
+            await asyncio.wait_for(
+                self._condition.wait_for(lambda: self.in_flight + amount <= self.limit),
+                timeout
+            )
+            self.in_flight += amount
+        return amount
+
+    async def release(self, amount: int):
+        async with self._condition:
+            self.in_flight -= amount
+            self._condition.notify_all()
+
+
+# The decode share of the current request's reservation, {"amount": bytes}, until released
+_decode_hold: ContextVar = ContextVar("decode_hold", default=None)
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+class UploadLimitMiddleware:
+    """Pure ASGI middleware rejecting oversized POST bodies from Content-Length and from the bytes received."""
+
+    # Multipart boundaries and part headers on top of the file bytes
+    OVERHEAD = 1 * MB
+
+    def __init__(self, app):
+        self.app = app
+
+    def _limit(self, path: str) -> int:
+        service = upload_service
+        return (service.max_video_bytes if path == "/verify/video" else service.max_request_bytes) + self.OVERHEAD
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") != "POST":
+            return await self.app(scope, receive, send)
+        limit = self._limit(scope.get("path", ""))
+        reject = JSONResponse(status_code=413, content={"detail": f"Request body exceeds {limit // MB} MB"},
+                              headers={"Connection": "close"})
+
+        declared = next((v for k, v in scope.get("headers", []) if k == b"content-length"), None)
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            return await reject(scope, receive, send)
+
+        received = 0
+        state = {"too_large": False, "started": False}
+
+        async def counting_receive():
+            nonlocal received
+            if state["too_large"]:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Stop feeding the parser; the app sees a disconnect and its answer is replaced below
+                    state["too_large"] = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if state["too_large"]:
+                return
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, guarded_send)
+        except Exception:
+            if not state["too_large"]:
+                raise
+        if state["too_large"] and not state["started"]:
+            await reject(scope, receive, send)
+
+
+class UploadService:
+    def __init__(self):
+        self.max_image_bytes = int(os.getenv("MAX_IMAGE_BYTES", 12 * MB))
+        self.max_request_bytes = int(os.getenv("MAX_REQUEST_BYTES", 30 * MB))
+        self.max_image_pixels = int(os.getenv("MAX_IMAGE_PIXELS", 50_000_000))
+        self.max_video_bytes = int(os.getenv("MAX_VIDEO_BYTES", 40 * MB))
+        self.budget_wait = float(os.getenv("UPLOAD_BUDGET_WAIT_SECONDS", 15))
+        self.header_bytes = 64 * 1024
+        self.chunk_bytes = 256 * 1024
+        # Largest in-process decode target (barcode_service / ocr_service scan at 2000 px);
+        # the model and embedding paths decode in image_pool workers
+        self.decode_edge = 2000
+        self.budget = ByteBudget(int(os.getenv("UPLOAD_BUDGET_BYTES", 256 * MB)))
+
+    def _dimensions(self, filename: str, data: bytes):
+        """Reads width/height from the image header only; None if the header is incomplete."""
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                return img.size
+        except Image.DecompressionBombError:
+            raise HTTPException(status_code=413, detail=f"{filename}: image dimensions too large")
+        except Exception:
+            return None
+
+    def _check_dimensions(self, filename: str, size):
+        if size and size[0] * size[1] > self.max_image_pixels:
+            raise HTTPException(
+                status_code=413,
+                detail=f"{filename}: {size[0]}x{size[1]} exceeds the {self.max_image_pixels // 1_000_000} MP limit"
+            )
+
+    async def _inspect(self, upload) -> dict:
+        """Early rejection from the declared size and the first bytes, before anything is buffered."""
+        if upload.size is not None and upload.size > self.max_image_bytes:
+            raise HTTPException(status_code=413, detail=f"{upload.filename}: image exceeds {self.max_image_bytes // MB} MB")
+
+        head = await upload.read(self.header_bytes)
+        await upload.seek(0)
+        if not head:
+            raise HTTPException(status_code=400, detail=f"{upload.filename}: empty file")
+        if not detect_image_format(head):
+            raise HTTPException(status_code=415, detail=f"{upload.filename}: unsupported file type (JPEG, PNG or WEBP expected)")
+
+        dimensions = self._dimensions(upload.filename, head)
+        self._check_dimensions(upload.filename, dimensions)
+        return {"upload": upload, "dimensions": dimensions, "format": detect_image_format(head)}
+
+    async def _read(self, upload, request_total: int) -> bytes:
+        """Chunked read that enforces the caps even when the declared size was missing or wrong."""
+        buffer = bytearray()
+        while True:
+            chunk = await upload.read(self.chunk_bytes)
+            if not chunk:
+                break
+            buffer.extend(chunk)
+            if len(buffer) > self.max_image_bytes:
+                raise HTTPException(status_code=413, detail=f"{upload.filename}: image exceeds {self.max_image_bytes // MB} MB")
+            if request_total + len(buffer) > self.max_request_bytes:
+                raise HTTPException(status_code=413, detail=f"Request exceeds {self.max_request_bytes // MB} MB of images")
+        return bytes(buffer)
+
+    def _decode_bytes(self, item: dict) -> int:
+        """RGB bitmap decode_image builds for this upload at the in-process scan size."""
+        if not item["dimensions"]:
+            return 0
+        width, height = decoded_size(*item["dimensions"], item["format"], max_edge=self.decode_edge)
+        return width * height * 3
+
+    @asynccontextmanager
+    async def ingest(self, uploads: list):
+        """
+        Reads the given UploadFiles (None entries are skipped) within the size caps and
+        the global byte budget. Yields (images_data, filenames); the raw bytes stay reserved
+        until the block exits, the decode share until release_decode() or the exit.
+        The files are already spooled by Starlette at this point (bounded by
+        UploadLimitMiddleware); the caps here limit what is copied out of the spool.
+        """
+        uploads = [u for u in uploads if u]
+        inspected = [await self._inspect(u) for u in uploads]
+
+        declared = sum(u.size if u.size is not None else self.max_image_bytes for u in uploads)
+        if declared > self.max_request_bytes and all(u.size is not None for u in uploads):
+            raise HTTPException(status_code=413, detail=f"Request exceeds {self.max_request_bytes // MB} MB of images")
+
+        # Raw bytes plus the decoded bitmaps, taken together so requests never wait holding half
+        raw = min(declared, self.max_request_bytes)
+        decoded = sum(self._decode_bytes(i) for i in inspected)
+        try:
+            reserved = await self.budget.acquire(raw + decoded, self.budget_wait)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Server busy processing uploads, retry shortly", headers={"Retry-After": "5"})
+        # acquire() caps the amount at the limit; the cut comes off the decode share
+        decode_reserved = max(0, reserved - raw)
+        hold = {"amount": decode_reserved}
+        token = _decode_hold.set(hold)
+
+        try:
+            images_data = []
+            filenames = []
+            total = 0
+            for item in inspected:
+                upload = item["upload"]
+                data = await self._read(upload, total)
+                total += len(data)
+                if item["dimensions"] is None:
+                    self._check_dimensions(upload.filename, self._dimensions(upload.filename, data))
+                images_data.append(data)
+                filenames.append(upload.filename)
+            yield images_data, filenames
+        finally:
+            _decode_hold.reset(token)
+            await self.budget.release(reserved - decode_reserved)
+            await self._release_hold(hold)
+
+    async def _release_hold(self, hold: dict):
+        amount, hold["amount"] = hold["amount"], 0
+        if amount:
+            await self.budget.release(amount)
+
+    async def release_decode(self, *scans):
+        """
+        Returns the current request's decode share of the budget, after the given in-process
+        scans (futures) finish. Safe to call more than once; the rest is released by ingest.
+        """
+        hold = _decode_hold.get()
+        if hold is None:
+            return
+        if scans:
+            await asyncio.wait(scans)
+        await self._release_hold(hold)
+
+    @asynccontextmanager
+    async def ingest_video(self, upload):
+        """
+        Reads one video clip (MP4/MOV/WebM) within MAX_VIDEO_BYTES and the byte budget.
+        Yields (video_data, filename). Decoded frames are not reserved: the frame selector
+        holds only a handful of them at a time.
+        """
+        if upload.size is not None and upload.size > self.max_video_bytes:
+            raise HTTPException(status_code=413, detail=f"{upload.filename}: video exceeds {self.max_video_bytes // MB} MB")
+        head = await upload.read(64)
+        await upload.seek(0)
+        if not head:
+            raise HTTPException(status_code=400, detail=f"{upload.filename}: empty file")
+        if not detect_video_format(head):
+            raise HTTPException(status_code=415, detail=f"{upload.filename}: unsupported file type (MP4, MOV or WebM expected)")
+
+        try:
+            reserved = await self.budget.acquire(upload.size or self.max_video_bytes, self.budget_wait)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Server busy processing uploads, retry shortly", headers={"Retry-After": "5"})
+
+        try:
+            buffer = bytearray()
+            while True:
+                chunk = await upload.read(self.chunk_bytes)
+                if not chunk:
+                    break
+                buffer.extend(chunk)
+                if len(buffer) > self.max_video_bytes:
+                    raise HTTPException(status_code=413, detail=f"{upload.filename}: video exceeds {self.max_video_bytes // MB} MB")
+            yield bytes(buffer), upload.filename
+        finally:
+            await self.budget.release(reserved)
+
+
+upload_service = UploadService()
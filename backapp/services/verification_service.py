@@ -1,8 +1,11 @@
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import torch
 import torch.nn as nn
-from torchvision import models, transforms
-from PIL import Image
-import io
+from torchvision import models
+from services.image_pool import image_pool, ImagePoolBusy
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 
@@ -13,18 +16,14 @@ class VerificationService:
         # Remove the last fully connected layer to get embeddings
         self.model = nn.Sequential(*list(self.model.children())[:-1])
         self.model.eval()
-        
-        self.preprocess = transforms.Compose([
-            transforms.Resize(256),
-            transforms.CenterCrop(224),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-        ])
+        # Preprocessing (Resize 256 -> CenterCrop 224 -> Normalize) runs in image_pool workers;
+        # these threads only submit a batch's images to the pool together and wait on them
+        self.preprocess_executor = ThreadPoolExecutor(max_workers=int(os.getenv("EMBEDDING_PREPROCESS_THREADS", 8)),
+                                                      thread_name_prefix="embed-prep")
 
     def get_embedding(self, image_bytes: bytes):
         try:
-            image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-            input_tensor = self.preprocess(image)
+            input_tensor = torch.from_numpy(image_pool.preprocess_for_embedding(image_bytes))
             input_batch = input_tensor.unsqueeze(0)  # Add batch dimension
 
             with torch.no_grad():
@@ -32,10 +31,41 @@ class VerificationService:
             
             # Flatten to 1D array
             return embedding.numpy().flatten()
+        except ImagePoolBusy:
+            raise
         except Exception as e:
             print(f"Error generating embedding: {e}")
             return None
 
+    def _preprocess(self, image_bytes: bytes, wait: float | None):
+        try:
+            return image_pool.preprocess_for_embedding(image_bytes, wait=wait)
+        except ImagePoolBusy:
+            raise
+        except Exception as e:
+            print(f"Error preprocessing image for embedding: {e}")
+            return None
+
+    def get_embeddings(self, images: list[bytes], wait: float | None = None) -> list:
+        """
+        Embeds several images in one forward pass. Returns L2-normalised vectors in input
+        order, with None for images that could not be decoded. The images are preprocessed
+        concurrently; `wait` bounds each one's wait for the image pool (ImagePoolBusy after).
+        """
+        futures = [self.preprocess_executor.submit(contextvars.copy_context().run, self._preprocess, image_bytes, wait)
+                   for image_bytes in images]
+        arrays = [f.result() for f in futures]
+
+        valid = [a for a in arrays if a is not None]
+        if not valid:
+            return [None] * len(images)
+        with torch.no_grad():
+            batch = self.model(torch.from_numpy(np.stack(valid))).flatten(1).numpy()
+        batch /= np.linalg.norm(batch, axis=1, keepdims=True) + 1e-12
+
+        embeddings = iter(batch)
+        return [next(embeddings) if a is not None else None for a in arrays]
+
     def compare_images(self, img1_bytes: bytes, img2_bytes: bytes) -> dict:
         emb1 = self.get_embedding(img1_bytes)
         emb2 = self.get_embedding(img2_bytes)
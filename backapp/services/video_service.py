@@ -0,0 +1,106 @@
+"""
+Video-scan mode: picks the sharpest distinct frames from a short handheld clip.
+
+Frames are decoded one at a time with PyAV (optional: `pip install av`, ships FFmpeg),
+sampled at a few fps, scored on a small greyscale copy and kept in a bounded set of the
+best mutually distinct frames, so memory stays flat regardless of clip length. Only the
+selected frames are JPEG-encoded and passed on to the regular multi-image /verify flow.
+"""
+import io
+import os
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+
+from services.quality_service import quality_service, laplacian, tile_variances, difference_hash
+
+load_dotenv()
+
+try:
+    import av
+except ImportError:
+    av = None
+
+
+class VideoService:
+    def __init__(self):
+        self.available = av is not None
+        self.max_frames = int(os.getenv("VIDEO_SCAN_FRAMES", 3))
+        self.sample_fps = float(os.getenv("VIDEO_SCAN_SAMPLE_FPS", 5))
+        self.max_seconds = float(os.getenv("VIDEO_SCAN_MAX_SECONDS", 20))
+        self.score_edge = 640
+        self.output_edge = int(os.getenv("GEMINI_MAX_IMAGE_EDGE", 1536))
+
+    def _score(self, frame):
+        """Sharpness + dHash on a downscaled greyscale copy (scaled by swscale, not in Python)."""
+        scale = self.score_edge / max(frame.width, frame.height)
+        width, height = frame.width, frame.height
+        if scale < 1:
+            width, height = max(2, int(width * scale)) // 2 * 2, max(2, int(height * scale)) // 2 * 2
+        gray = frame.to_ndarray(format="gray", width=width, height=height)
+        sharpness = float(np.percentile(tile_variances(laplacian(gray.astype(np.float32)), quality_service.grid), 90))
+        return sharpness, difference_hash(Image.fromarray(gray))
+
+    def _encode(self, frame) -> bytes:
+        img = frame.to_image()
+        rotation = getattr(frame, "rotation", 0) or 0
+        if rotation:
+            # Phone clips are stored sideways with a display-matrix rotation
+            img = img.rotate(rotation, expand=True)
+        if max(img.size) > self.output_edge:
+            img.thumbnail((self.output_edge, self.output_edge), Image.Resampling.LANCZOS)
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=92)
+        return buf.getvalue()
+
+    def select_frames(self, video_data: bytes):
+        """
+        Returns (frames, scan_info): up to max_frames JPEGs in clip order and a summary
+        {frames_decoded, frames_sampled, selected: [{time, sharpness}]}.
+        """
+        if not self.available:
+            return [], {"error": "video decoding unavailable"}
+
+        kept = []  # [{time, sharpness, dhash, jpeg}]
+        decoded = sampled = 0
+        next_sample = 0.0
+        with av.open(io.BytesIO(video_data)) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = "AUTO"
+            for frame in container.decode(stream):
+                decoded += 1
+                t = float(frame.time) if frame.time is not None else decoded / float(stream.average_rate or 30)
+                if t > self.max_seconds:
+                    break
+                if t < next_sample:
+                    continue
+                next_sample = t + 1.0 / self.sample_fps
+                sampled += 1
+
+                sharpness, dhash = self._score(frame)
+                similar = [k for k in kept if bin(k["dhash"] ^ dhash).count("1") <= quality_service.duplicate_distance]
+                if similar:
+                    # Same view as an already kept frame: only replace it if this one is sharper
+                    victim = max(similar, key=lambda k: k["sharpness"])
+                    if sharpness <= victim["sharpness"]:
+                        continue
+                    for k in similar:
+                        kept.remove(k)
+                elif len(kept) >= self.max_frames:
+                    victim = min(kept, key=lambda k: k["sharpness"])
+                    if sharpness <= victim["sharpness"]:
+                        continue
+                    kept.remove(victim)
+                kept.append({"time": t, "sharpness": sharpness, "dhash": dhash, "jpeg": self._encode(frame)})
+
+        kept.sort(key=lambda k: k["time"])
+        scan_info = {
+            "frames_decoded": decoded,
+            "frames_sampled": sampled,
+            "selected": [{"time": round(k["time"], 2), "sharpness": round(k["sharpness"], 1)} for k in kept],
+        }
+        print(f"Video scan: {decoded} frames decoded, {sampled} scored, kept {[s['time'] for s in scan_info['selected']]}")
+        return [k["jpeg"] for k in kept], scan_info
+
+
+video_service = VideoService()
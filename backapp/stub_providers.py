@@ -0,0 +1,285 @@
+"""
+Local stand-ins for the Gemini and SerpApi HTTP APIs.
+
+Used by load_test.py so the FastAPI app can be exercised offline and
+repeatably. Point the app at the stubs with:
+
+    GEMINI_API_ENDPOINT=http://127.0.0.1:9001
+    SERPAPI_BASE_URL=http://127.0.0.1:9002
+    DUCKDUCKGO_ENABLED=0
+
+Run standalone:
+    python stub_providers.py --latency 1.5 --jitter 0.5 --error-rate 0.05 --payload-kb 4
+"""
+import argparse
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class StubConfig:
+    def __init__(self, latency=1.0, jitter=0.0, error_rate=0.0, payload_kb=0, seed=None, exhausted_keys=()):
+        self.latency = latency          # mean seconds per call
+        self.jitter = jitter            # +/- uniform seconds
+        self.error_rate = error_rate    # fraction of calls answered with 429
+        self.payload_kb = payload_kb    # extra padding added to each response body
+        self.exhausted_keys = set(exhausted_keys)  # API keys whose quota is always exhausted
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+        self.calls_by_client = {}       # (api key, model) -> calls, to check how a client pool spreads load
+
+    def delay(self) -> float:
+        with self.lock:
+            return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def should_throttle(self, client=None) -> bool:
+        with self.lock:
+            self.calls += 1
+            if client:
+                self.calls_by_client[client] = self.calls_by_client.get(client, 0) + 1
+            if (client and client[0] in self.exhausted_keys) or self.random.random() < self.error_rate:
+                self.throttled += 1
+                return True
+            return False
+
+    def padding(self) -> str:
+        return "x" * (self.payload_kb * 1024)
+
+
+def _gemini_reply(prompt: str, padding: str) -> str:
+    """Builds a plausible model answer based on which service prompt was sent."""
+    if "Forensic" in prompt:
+        return json.dumps({
+            "verdict": "Authentic",
+            "confidence_score": 0.92,
+            "detected_brand": "Parle",
+            "category_detected": "Food",
+            "forensic_flags": [
+                {"check": "Spelling Check", "status": "PASS", "observation": "Brand name spelled correctly"}
+            ],
+            "health_safety_assessment": {
+                "risk_level": "Safe",
+                "flagged_components": [],
+                "safety_warnings": []
+            },
+            "reasoning": "Stub forensic analysis. " + padding,
+            "recommendation": "No action needed."
+        })
+    if "specs" in prompt:
+        return json.dumps({
+            "description": "Stub product description. " + padding,
+            "specs": [
+                {"label": "Brand", "value": "Parle"},
+                {"label": "Model", "value": "Parle-G Original Glucose Biscuits"},
+                {"label": "Type", "value": "Biscuit"},
+                {"label": "Key Ingredient/Material", "value": "Wheat Flour"},
+                {"label": "Packaging", "value": "Plastic wrapper"}
+            ]
+        })
+    if "counterfeit investigator" in prompt:
+        return json.dumps({
+            "is_authentic": True,
+            "confidence_score": 0.8,
+            "verdict": "Authentic",
+            "discrepancies": [],
+            "reasoning": "Stub comparison. " + padding
+        })
+    if "Identify this product" in prompt:
+        return "Parle-G Original Glucose Biscuits 800g"
+    return json.dumps({
+        "brand": "Parle",
+        "product_name": "Parle-G",
+        "features": ["stub"],
+        "search_query": "Parle-G biscuits " + padding
+    })
+
+
+def _stub_image(name: str) -> bytes:
+    """Deterministic JPEG for a stub image URL (reference images, thumbnails)."""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(name)
+    img = Image.new("RGB", (480, 480), color=tuple(rng.randrange(0, 256) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(5):
+        x, y = rng.randrange(0, 380), rng.randrange(0, 380)
+        draw.rectangle([x, y, x + rng.randrange(40, 100), y + rng.randrange(40, 100)],
+                       fill=tuple(rng.randrange(0, 256) for _ in range(3)))
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+def _serpapi_reply(params: dict, padding: str, base_url: str = "http://127.0.0.1") -> dict:
+    engine = params.get("engine", [""])[0]
+    query = params.get("q", [""])[0]
+    if engine == "google_images":
+        count = int(params.get("num", ["1"])[0])
+        return {"images_results": [
+            {"original": f"{base_url}/stub/images/reference-{i}.jpg", "title": query} for i in range(count)
+        ]}
+    market = params.get("gl", ["in"])[0]
+    symbol = {"us": "$", "uk": "£", "de": "€", "fr": "€"}.get(market, "₹")
+    results = []
+    for i, seller in enumerate(["Amazon", "Flipkart", "Myntra", "Ajio", "Meesho", "BigBasket", "JioMart", "Blinkit"]):
+        results.append({
+            "source": seller,
+            "price": f"{symbol}{100 + i * 15:,}.00",
+            "extracted_price": float(100 + i * 15),
+            "product_link": f"https://example.com/{seller.lower()}/{i}" if market == "in" else f"https://example.com/{market}/{seller.lower()}/{i}",
+            "rating": round(3.5 + (i % 4) * 0.4, 1),
+            "thumbnail": f"{base_url}/stub/images/thumb-{i}.jpg",
+            "title": f"{query} ({seller})",
+        })
+    return {"shopping_results": results, "search_metadata": {"status": "Success", "padding": padding}}
+
+
+def make_handler(kind: str, config: StubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body: dict):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _throttle(self, client=None) -> bool:
+            time.sleep(config.delay())
+            if config.should_throttle(client):
+                self._send(429, {"error": {
+                    "code": 429,
+                    "message": "Resource has been exhausted (e.g. check quota).",
+                    "status": "RESOURCE_EXHAUSTED"
+                }})
+                return True
+            return False
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length) if length else b"{}"
+            if kind != "gemini" or ":generateContent" not in self.path:
+                self._send(404, {"error": {"code": 404, "message": "not found"}})
+                return
+            key = self.headers.get("x-goog-api-key") or parse_qs(urlparse(self.path).query).get("key", [""])[0]
+            model = self.path.split("/models/")[-1].split(":")[0]
+            if self._throttle((key, model)):
+                return
+            try:
+                request = json.loads(raw)
+                system = request.get("systemInstruction") or request.get("system_instruction") or {}
+                prompt = " ".join(
+                    part.get("text", "")
+                    for content in [system] + request.get("contents", [])
+                    for part in content.get("parts", [])
+                )
+            except Exception:
+                prompt = ""
+            self._send(200, {
+                "candidates": [{
+                    "content": {"parts": [{"text": _gemini_reply(prompt, config.padding())}], "role": "model"},
+                    "finishReason": "STOP",
+                    "index": 0
+                }],
+                "usageMetadata": {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": 200}
+            })
+
+        def _send_image(self, name: str):
+            etag = '"' + hashlib.sha1(name.encode("utf-8")).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            payload = _stub_image(name)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if kind == "serpapi" and url.path.startswith("/stub/images/"):
+                self._send_image(url.path.rsplit("/", 1)[-1])
+                return
+            if kind != "serpapi" or url.path != "/search":
+                self._send(404, {"error": "not found"})
+                return
+            if self._throttle():
+                return
+            base_url = f"http://{self.headers.get('Host', '127.0.0.1')}"
+            self._send(200, _serpapi_reply(parse_qs(url.query), config.padding(), base_url))
+
+    return Handler
+
+
+class StubServer:
+    """A provider stand-in running on a background thread."""
+
+    def __init__(self, kind: str, port: int, config: StubConfig, host: str = "127.0.0.1"):
+        self.kind = kind
+        self.config = config
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(kind, config))
+        self.httpd.daemon_threads = True
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=1.0, help="Mean provider latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Uniform latency jitter in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls answered with 429")
+    parser.add_argument("--payload-kb", type=int, default=0, help="Extra KB of padding per response")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for repeatable runs")
+    parser.add_argument("--exhausted-keys", default="", help="Comma-separated Gemini API keys that always get 429")
+    parser.add_argument("--gemini-port", type=int, default=9001)
+    parser.add_argument("--serpapi-port", type=int, default=9002)
+
+
+def start_stubs(args):
+    """Starts both stubs, each with its own config so call and 429 counts are per provider."""
+    exhausted = [k for k in getattr(args, "exhausted_keys", "").split(",") if k]
+    gemini_config = StubConfig(args.latency, args.jitter, args.error_rate, args.payload_kb, args.seed, exhausted)
+    serpapi_config = StubConfig(args.latency, args.jitter, args.error_rate, args.payload_kb,
+                                None if args.seed is None else args.seed + 1)
+    gemini = StubServer("gemini", args.gemini_port, gemini_config).start()
+    serpapi = StubServer("serpapi", args.serpapi_port, serpapi_config).start()
+    return gemini, serpapi
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Gemini/SerpApi stand-ins")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    gemini, serpapi = start_stubs(args)
+    print(f"Gemini stub:  {gemini.url}")
+    print(f"SerpApi stub: {serpapi.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        gemini.stop()
+        serpapi.stop()
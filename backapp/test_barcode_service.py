@@ -0,0 +1,146 @@
+"""
+GTIN check digits, UPC-E expansion, GS1 payload parsing and the product index.
+
+    cd backapp && python -m pytest -q test_barcode_service.py
+"""
+import sqlite3
+import time
+
+import pytest
+
+from services.barcode_service import (
+    BarcodeService, ProductIndex, gtin_check_digit, is_valid_gtin, to_gtin14, upce_to_upca
+)
+
+
+@pytest.mark.parametrize("code,valid", [
+    ("5449000000996", True),        # EAN-13
+    ("5449000000997", False),
+    ("96385074", True),             # EAN-8
+    ("042100005264", True),         # UPC-A
+    ("00012345600012", True),       # GTIN-14
+    ("544900000099", False),        # 12 digits, wrong check digit
+    ("544900000099a", False),
+    ("1234567", False),             # no GTIN has 7 digits
+])
+def test_is_valid_gtin(code, valid):
+    assert is_valid_gtin(code) is valid
+
+
+def test_check_digit():
+    assert gtin_check_digit("544900000099") == 6
+    assert gtin_check_digit("9638507") == 4
+
+
+@pytest.mark.parametrize("upce,upca", [
+    ("04252614", "042100005264"),   # last digit 0-2: manufacturer digits split around it
+    ("01234505", "012000003455"),
+    ("01234514", "012100003454"),
+    ("01234523", "012200003453"),
+    ("01234531", "012300000451"),   # 3: three manufacturer digits
+    ("01234543", "012340000053"),   # 4: four manufacturer digits
+    ("01234558", "012345000058"),   # 5-9: last digit is the item number
+])
+def test_upce_to_upca(upce, upca):
+    assert upce_to_upca(upce) == upca
+    assert is_valid_gtin(upca)
+
+
+def test_to_gtin14():
+    assert to_gtin14("5449000000996") == "05449000000996"
+    assert to_gtin14("96385074") == "00000096385074"
+
+
+@pytest.fixture
+def barcodes(tmp_path):
+    return BarcodeService(str(tmp_path / "products.db"))
+
+
+@pytest.mark.parametrize("symbol_type,data,gtin", [
+    ("EAN13", "5449000000996", "5449000000996"),
+    ("UPCE", "04252614", "042100005264"),
+    ("QRCODE", "(01)05449000000996(17)261231", "05449000000996"),
+    ("QRCODE", "https://id.example.com/01/05449000000996/10/ABC", "05449000000996"),
+    ("DATAMATRIX", "]d20105449000000996", "05449000000996"),   # GS1 DataMatrix identifier
+    ("QRCODE", "]Q30105449000000996", "05449000000996"),
+    ("QRCODE", "https://example.com/promo", None),
+])
+def test_gtin_from_symbol(barcodes, symbol_type, data, gtin):
+    assert barcodes._gtin_from_symbol(symbol_type, data) == gtin
+
+
+def test_primary_gtin_prefers_valid_linear_codes(barcodes):
+    codes = [
+        {"type": "QRCODE", "data": "", "gtin": "05449000000996", "valid": True},
+        {"type": "EAN13", "data": "", "gtin": "5449000000997", "valid": False},
+        {"type": "EAN8", "data": "", "gtin": "96385074", "valid": True},
+    ]
+    assert barcodes.primary_gtin(codes) == "96385074"
+    assert barcodes.primary_gtin(codes[:2]) == "05449000000996"
+    assert barcodes.primary_gtin([]) is None
+
+
+def test_anomalies_flag_only_bad_check_digits(barcodes):
+    codes = [
+        {"type": "QRCODE", "data": "", "gtin": "05449000000997", "valid": False},
+        {"type": "QRCODE", "data": "", "gtin": "05449000000996", "valid": True},
+        {"type": "QRCODE", "data": "", "gtin": None, "valid": None},
+    ]
+    flags = barcodes.anomalies(codes)
+    assert len(flags) == 1
+    assert flags[0]["status"] == "FAIL" and "expected 6" in flags[0]["observation"]
+
+
+def test_product_index_expires_and_refreshes(tmp_path, monkeypatch):
+    index = ProductIndex(str(tmp_path / "products.db"), ttl_seconds=100, min_agreement=1)
+    now = [1000.0]
+    monkeypatch.setattr("services.barcode_service.time.time", lambda: now[0])
+
+    index.remember("5449000000996", "Coke")
+    assert index.lookup("05449000000996") == "Coke"     # stored as GTIN-14
+    now[0] += 101
+    assert index.lookup("5449000000996") is None
+    index.remember("5449000000996", "Coca-Cola 330 ml")
+    assert index.lookup("5449000000996") == "Coca-Cola 330 ml"
+    assert index.lookup("96385074") is None
+
+
+def test_product_index_needs_agreement(tmp_path):
+    index = ProductIndex(str(tmp_path / "products.db"), min_agreement=2)
+    assert not index.remember("5449000000996", "Rat Poison", voter="attacker")
+    assert not index.remember("5449000000996", "Rat Poison", voter="attacker")     # one voter, one vote
+    assert index.lookup("5449000000996") is None
+    assert index.hint("5449000000996") == "Rat Poison"
+
+    assert not index.remember("5449000000996", "Coca-Cola 330 ml", voter="alice")
+    assert index.remember("5449000000996", "coca cola 330ML", voter="bob")          # same name, another voter
+    assert index.lookup("5449000000996") == "coca cola 330ML"
+    assert index.hint("5449000000996") == "coca cola 330ML"
+
+    # A confirmed name is not unseated by a single disagreeing identification
+    assert not index.remember("5449000000996", "Pepsi 330 ml", voter="carol")
+    assert index.lookup("5449000000996") == "coca cola 330ML"
+
+
+def test_anonymous_callers_share_one_vote(tmp_path):
+    index = ProductIndex(str(tmp_path / "products.db"), min_agreement=2)
+    index.remember("5449000000996", "Coke")
+    index.remember("5449000000996", "Coke")
+    assert index.lookup("5449000000996") is None
+
+
+def test_verified_identification_is_confirmed_at_once(tmp_path):
+    index = ProductIndex(str(tmp_path / "products.db"), min_agreement=3)
+    assert index.remember("5449000000996", "Coca-Cola 330 ml", "reference", voter=None, verified=True)
+    assert index.lookup("5449000000996") == "Coca-Cola 330 ml"
+
+
+def test_entries_from_before_confirmation_are_hints(tmp_path):
+    path = str(tmp_path / "products.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE products (gtin TEXT PRIMARY KEY, product_name TEXT NOT NULL, source TEXT, "
+                     "hits INTEGER DEFAULT 0, created_at REAL, updated_at REAL)")
+        conn.execute("INSERT INTO products VALUES ('05449000000996', 'Coke', 'gemini', 0, ?, ?)", (time.time(), time.time()))
+    index = ProductIndex(path)
+    assert index.lookup("5449000000996") is None
+    assert index.hint("5449000000996") == "Coke"
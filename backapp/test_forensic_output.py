@@ -0,0 +1,74 @@
+"""
+Malformed model output (strings where objects or lists belong) must not reach /verify as a 500.
+
+    cd backapp && python -m pytest -q test_forensic_output.py
+"""
+import pytest
+
+from services.gemini_service import gemini_service
+from services.ingredient_screener import ingredient_screener
+from services.response_models import ForensicSummary, as_list, health_assessment
+
+MALFORMED = [
+    {"health_safety_assessment": "No hazards found"},
+    {"health_safety_assessment": {"risk_level": "Caution", "flagged_components": "Titanium Dioxide"}},
+    {"health_safety_assessment": ["Safe"], "forensic_flags": "All checks passed"},
+    {"health_safety_assessment": None, "forensic_flags": [{"check": "Font"}, "PASS", None]},
+    {"forensic_flags": {"check": "Font", "status": "FAIL"}, "recommendation": 3},
+]
+
+
+def test_helpers():
+    assert as_list(None) == [] and as_list("") == []
+    assert as_list("Titanium Dioxide") == ["Titanium Dioxide"]
+    assert as_list(("a", "b")) == ["a", "b"]
+    assert health_assessment("No hazards") == {"safety_warnings": ["No hazards"]}
+    assert health_assessment(["Safe"]) == {}
+
+
+@pytest.mark.parametrize("raw", MALFORMED + ["not even an object"])
+def test_summary_of_malformed_output(raw):
+    summary = ForensicSummary.from_raw(raw)
+    assert isinstance(summary.health_safety_assessment.risk_level, str)
+    assert all(isinstance(c, str) for c in summary.health_safety_assessment.flagged_components)
+
+
+def test_string_component_is_not_split_into_characters():
+    summary = ForensicSummary.from_raw(MALFORMED[1])
+    assert summary.health_safety_assessment.flagged_components == ["Titanium Dioxide"]
+    assert summary.health_safety_assessment.risk_level == "Caution"
+
+
+@pytest.mark.parametrize("raw", MALFORMED)
+def test_format_forensic(raw):
+    result = gemini_service._format_forensic(dict(raw, verdict="Authentic", confidence_score="0.9"), None)
+    forensic = result["raw_forensic_analysis"]
+    assert isinstance(forensic["health_safety_assessment"], dict)
+    assert all(isinstance(f, dict) for f in forensic["forensic_flags"])
+    assert result["verification"]["confidence_score"] == 90
+    ForensicSummary.from_raw(forensic)
+
+
+def test_format_forensic_keeps_a_string_assessment_as_a_warning():
+    result = gemini_service._format_forensic({"health_safety_assessment": "Contains E171"}, None)
+    assert result["verification"]["anomalies_detected"] == ["Contains E171"]
+
+
+ASSESSMENT = {"risk_level": "Critical", "flagged_components": ["Potassium Bromate"],
+              "safety_warnings": ["Potassium Bromate ('e924'): banned"], "findings": []}
+
+
+@pytest.mark.parametrize("cot_result", [
+    {"raw_forensic_analysis": {"health_safety_assessment": "Looks safe"}},
+    {"raw_forensic_analysis": {"health_safety_assessment": {"flagged_components": "Sugar", "safety_warnings": "x"}}},
+    {"raw_forensic_analysis": "free text", "verification": "oops"},
+    {},
+])
+def test_merge_into_malformed_result(cot_result):
+    merged = ingredient_screener.merge_into(cot_result, ASSESSMENT)
+    health = merged["raw_forensic_analysis"]["health_safety_assessment"]
+    assert "Potassium Bromate" in health["flagged_components"]
+    assert health["risk_level"] == "Critical"
+    assert all(len(c) > 1 for c in health["flagged_components"])
+    assert merged["verification"]["anomalies_detected"][-1] == ASSESSMENT["safety_warnings"][0]
+    ForensicSummary.from_raw(merged["raw_forensic_analysis"])
@@ -0,0 +1,50 @@
+"""
+Gemini key pool: a 429 ejects the (key, model) pair it came from, not the whole key.
+
+    cd backapp && python -m pytest -q test_gemini_pool.py
+"""
+from services.providers import GeminiClientPool, GeminiProvider, _PoolClient
+
+
+class QuotaExceeded(Exception):
+    code = 429
+
+
+class FakeKey(GeminiProvider):
+    def __init__(self, name: str, exhausted: set = ()):
+        self.name = name
+        self.exhausted = set(exhausted)
+        self.calls = []
+
+    def generate_content(self, contents, model_name=None, system_instruction=None):
+        self.calls.append(model_name)
+        if model_name in self.exhausted:
+            raise QuotaExceeded(f"429 quota for {model_name}")
+        return f"{self.name}:{model_name}"
+
+
+def _pool(*keys, models=("flash", "flash-lite")):
+    clients = [_PoolClient(f"{k.name}/{m}", k, m, tier, k.name) for tier, m in enumerate(models) for k in keys]
+    return GeminiClientPool(clients, strategy="round_robin")
+
+
+def test_quota_on_one_model_leaves_the_key_serving_other_models():
+    a, b = FakeKey("a", exhausted={"pro"}), FakeKey("b")
+    pool = _pool(a, b)
+    # 'pro' is not a pool model: it rides on a key; a's 429 moves it to b
+    answers = {pool.generate_content(["hi"], "pro") for _ in range(4)}
+    assert answers == {"b:pro"}
+    assert a.calls == ["pro"]                   # a/pro stays ejected
+    # a's primary model is untouched
+    assert {pool.generate_content(["hi"]) for _ in range(4)} == {"a:flash", "b:flash"}
+    healthy = {s["client"]: s["healthy"] for s in pool.stats()}
+    assert healthy["a/flash"] and healthy["b/flash"]
+
+
+def test_primary_quota_falls_back_on_the_same_key():
+    a = FakeKey("a", exhausted={"flash"})
+    pool = _pool(a)
+    assert pool.generate_content(["hi"]) == "a:flash-lite"
+    assert pool.generate_content(["hi"]) == "a:flash-lite"
+    assert a.calls == ["flash", "flash-lite", "flash-lite"]
+    assert {s["client"]: s["healthy"] for s in pool.stats()} == {"a/flash": False, "a/flash-lite": True}
@@ -0,0 +1,230 @@
+"""
+Write-behind history buffer and keyset-paginated history, against a throwaway SQLite store.
+
+    cd backapp && python -m pytest -q test_history_service.py
+"""
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from services.history_service import HistoryService, WriteBehindBuffer
+from services.history_store import ScanRecord, SqliteHistoryStore
+from services.response_models import DetailsResponse, PriceEntry, PriceResponse
+
+USER = "user-1"
+START = datetime(2026, 10, 1, tzinfo=timezone.utc)
+
+
+def _wait_for(predicate, timeout: float = 5.0):
+    give_up = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < give_up, "timed out"
+        time.sleep(0.01)
+
+
+class FlakyStore:
+    """write() stand-in: fails the first `outages` calls, and refuses any batch containing 'bad'."""
+
+    def __init__(self, outages: int = 0):
+        self.outages = outages
+        self.calls = []
+        self.rows = []
+        self.lock = threading.Lock()
+
+    def write(self, batch):
+        with self.lock:
+            self.calls.append(list(batch))
+            if self.outages:
+                self.outages -= 1
+                raise ConnectionError("store unreachable")
+            if "bad" in batch:
+                raise sqlite3.IntegrityError("CHECK constraint failed")
+            self.rows.extend(batch)
+
+
+def test_failed_batch_is_retried_whole():
+    store = FlakyStore(outages=1)
+    buffer = WriteBehindBuffer(store.write, batch_size=3, flush_seconds=0.01)
+    for item in ("a", "b", "c"):
+        buffer.submit(item)
+    _wait_for(lambda: buffer.snapshot()["written"] == 3)
+    buffer.stop()
+
+    assert store.calls == [["a", "b", "c"], ["a", "b", "c"]]
+    assert store.rows == ["a", "b", "c"]
+    stats = buffer.snapshot()
+    assert (stats["failed_batches"], stats["batches"], stats["pending"]) == (1, 1, 0)
+    assert stats["last_error"].startswith("ConnectionError")
+
+
+def test_rejected_batch_falls_back_to_row_by_row():
+    store = FlakyStore()
+    buffer = WriteBehindBuffer(store.write, batch_size=3, flush_seconds=0.01)
+    for item in ("a", "bad", "c"):
+        buffer.submit(item)
+    _wait_for(lambda: buffer.snapshot()["written"] + buffer.snapshot()["rejected"] == 3)
+    buffer.stop()
+
+    assert store.calls == [["a", "bad", "c"], ["a"], ["bad"], ["c"]]
+    assert store.rows == ["a", "c"]
+    stats = buffer.snapshot()
+    assert (stats["written"], stats["rejected"], stats["failed_batches"]) == (2, 1, 0)
+
+
+def test_stop_flushes_the_queue():
+    store = FlakyStore()
+    buffer = WriteBehindBuffer(store.write, batch_size=100, flush_seconds=60)
+    buffer.submit("a")
+    buffer.submit("b")
+    buffer.stop()
+    assert store.rows == ["a", "b"]
+    buffer.submit("late")
+    assert buffer.snapshot()["dropped"] == 1
+
+
+def _record(minutes: int, intent: str = "details", user_id: str = USER) -> ScanRecord:
+    if intent == "price":
+        response = PriceResponse("Parle-G 800g", None, [PriceEntry("Amazon", 95.0, "₹", "https://a/1", 4.3),
+                                                        PriceEntry("Flipkart", 92.0, "₹", "https://f/1", 4.1)])
+    else:
+        response = DetailsResponse("A biscuit", [], "front.jpg")
+    created_at = (START + timedelta(minutes=minutes)).isoformat(timespec="microseconds")
+    return ScanRecord(str(uuid.uuid4()), str(uuid.uuid4()), user_id, intent, "upload", None, created_at, response)
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setenv("SCAN_HISTORY", "1")
+    monkeypatch.setenv("HISTORY_BACKEND", "sqlite")
+    monkeypatch.setenv("HISTORY_SQLITE_PATH", str(tmp_path / "history.db"))
+    service = HistoryService()
+    # Nothing is flushed on its own, so queued records stay pending for the test
+    service.buffer = WriteBehindBuffer(service.store.write_batch, flush_seconds=3600)
+    yield service
+    service.shutdown()
+
+
+def _all_pages(service, limit: int, **filters) -> list:
+    items, cursor = [], None
+    while True:
+        page = service.page(USER, cursor=cursor, limit=limit, **filters)
+        assert len(page.items) <= limit
+        items.extend(page.items)
+        if page.next_cursor is None:
+            return items
+        cursor = page.next_cursor
+
+
+def test_cursor_round_trip():
+    entry = {"created_at": "2026-10-01T10:00:00.000000+00:00", "scan_id": str(uuid.uuid4())}
+    cursor = HistoryService.encode_cursor(entry)
+    assert "=" not in cursor
+    assert HistoryService.decode_cursor(cursor) == (entry["created_at"], entry["scan_id"])
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "bm9waXBl", HistoryService.encode_cursor(
+    {"created_at": "yesterday", "scan_id": str(uuid.uuid4())})])
+def test_bad_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        HistoryService.decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_pages_walk_stored_and_pending_scans_once(service):
+    stored = [_record(m, "price" if m % 3 == 0 else "details") for m in range(23)]
+    service.store.write_batch(stored)
+    service.store.write_batch([_record(5, user_id="someone-else")])
+    pending = [_record(m) for m in (30, 31, 11)]    # newer than everything, and one in between
+    for record in pending:
+        service.buffer.submit(record)
+    # A batch being retried can be both stored and still queued
+    service.buffer.submit(stored[-1])
+
+    items = _all_pages(service, limit=7)
+    keys = [(item.created_at, item.scan_id) for item in items]
+    assert keys == sorted(keys, reverse=True)
+    assert sorted(item.scan_id for item in items) == sorted(r.scan_id for r in stored + pending)
+
+    price_items = [item for item in items if item.intent == "price"]
+    assert price_items and all(item.best_price == 92.0 and item.currency == "₹" for item in price_items)
+
+
+def test_filtered_pages(service):
+    service.store.write_batch([_record(m, "price" if m % 2 else "details") for m in range(15)])
+    service.buffer.submit(_record(20, "price"))
+    items = _all_pages(service, limit=4, intent="price")
+    assert len(items) == 8 and {item.intent for item in items} == {"price"}
+
+    since = (START + timedelta(minutes=10)).isoformat()
+    assert len(_all_pages(service, limit=4, since=since)) == 6
+
+
+def test_deep_page_matches_the_full_listing(service):
+    service.store.write_batch([_record(m) for m in range(40)])
+    everything = service.page(USER, limit=100).items
+    first = service.page(USER, limit=30)
+    second = service.page(USER, cursor=first.next_cursor, limit=30)
+    assert [i.scan_id for i in first.items + second.items] == [i.scan_id for i in everything]
+    assert second.next_cursor is None
+
+
+def test_stats_count_pending_scans_once(service):
+    service.store.write_batch([_record(m) for m in range(3)])
+    for m in (10, 11):
+        service.buffer.submit(_record(m, "price"))
+    before = service.stats(USER, days=366).total
+    service.buffer.stop()                                   # writes the queue
+    after = service.stats(USER, days=366).total
+    assert before == after
+    assert after.scans == 5
+
+
+class GatedStore:
+    """write_batch stand-in that holds each batch until released."""
+
+    def __init__(self, store):
+        self.store = store
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def write(self, batch):
+        self.started.set()
+        self.release.wait(5)
+        self.store.write_batch(batch)
+
+
+def test_batch_being_written_stays_visible(service):
+    gate = GatedStore(service.store)
+    service.buffer = WriteBehindBuffer(gate.write, flush_seconds=0, read_wait=0.1)
+    record = _record(1)
+    service.buffer.submit(record)
+    assert gate.started.wait(5) and not service.buffer.pending   # popped from the queue, not yet stored
+    # The write outlasts read_wait: the read goes ahead with the batch from the in-flight list
+    assert [item.scan_id for item in service.page(USER).items] == [record.scan_id]
+    assert service.stats(USER, days=366).total.scans == 1
+    gate.release.set()
+
+
+def test_reads_during_a_write_neither_miss_nor_double_count(service):
+    gate = GatedStore(service.store)
+    service.buffer = WriteBehindBuffer(gate.write, flush_seconds=0, read_wait=5)
+    record = _record(1)
+    service.buffer.submit(record)
+    assert gate.started.wait(5)
+    results = {}
+
+    def read():
+        results["page"] = [item.scan_id for item in service.page(USER).items]
+        results["scans"] = service.stats(USER, days=366).total.scans
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    time.sleep(0.1)
+    gate.release.set()                                      # the write lands while the reads wait
+    reader.join(5)
+    assert results == {"page": [record.scan_id], "scans": 1}
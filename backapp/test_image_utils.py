@@ -0,0 +1,70 @@
+"""
+Reduced-resolution decoding across the image modes uploads arrive in.
+
+    cd backapp && python -m pytest -q test_image_utils.py
+"""
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from services.image_utils import decode_image
+
+WIDTH, HEIGHT = 3000, 2000
+
+
+def _png(img: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _gradient() -> np.ndarray:
+    return np.tile(np.linspace(0, 1, WIDTH), (HEIGHT, 1))
+
+
+def _palette_png(transparent: bool = False) -> bytes:
+    rgb = np.stack([_gradient() * 255] * 3, axis=-1).astype(np.uint8)
+    img = Image.fromarray(rgb, "RGB").quantize(64)
+    if transparent:
+        img.info["transparency"] = 0
+    return _png(img)
+
+
+def _sixteen_bit_png() -> bytes:
+    return _png(Image.fromarray((_gradient() * 65535).astype(np.uint16)))
+
+
+def _bilevel_png() -> bytes:
+    return _png(Image.fromarray(_gradient() > 0.5).convert("1"))
+
+
+SOURCES = {
+    "palette": _palette_png,
+    "palette-transparent": lambda: _palette_png(transparent=True),
+    "16-bit": _sixteen_bit_png,
+    "bilevel": _bilevel_png,
+}
+
+
+@pytest.mark.parametrize("name", SOURCES)
+def test_model_path(name):
+    img = decode_image(SOURCES[name](), max_edge=512)
+    assert max(img.size) == 512
+
+
+@pytest.mark.parametrize("name", SOURCES)
+def test_embedding_path(name):
+    img = decode_image(SOURCES[name](), min_edge=256, mode="RGB")
+    assert img.mode == "RGB" and min(img.size) >= 256
+
+
+def test_sixteen_bit_keeps_its_tonal_range():
+    pixels = np.asarray(decode_image(_sixteen_bit_png(), max_edge=512, mode="L"), dtype=np.float32)
+    assert pixels[:, :10].mean() < 20 and pixels[:, -10:].mean() > 235
+    assert 100 < pixels.mean() < 155
+
+
+def test_palette_transparency_is_kept():
+    assert decode_image(_palette_png(transparent=True), max_edge=512).mode == "RGBA"
@@ -0,0 +1,74 @@
+"""
+Aho-Corasick automaton and the banned-ingredient screen built on it.
+
+    cd backapp && python -m pytest -q test_ingredient_screener.py
+"""
+import json
+
+import pytest
+
+from services.ingredient_screener import AhoCorasick, IngredientScreener, normalize_label_text
+
+
+def _matches(automaton, text):
+    return sorted((end - length + 1, text[end - length + 1:end + 1], value) for end, length, value in automaton.iter(text))
+
+
+def test_overlapping_patterns():
+    automaton = AhoCorasick()
+    for word in ("he", "she", "his", "hers"):
+        automaton.add(word, word)
+    automaton.build()
+    # 'she' and 'he' end at the same character; 'hers' is only reachable through a failure link
+    assert _matches(automaton, "ushers") == [(1, "she", "she"), (2, "he", "he"), (2, "hers", "hers")]
+    assert _matches(automaton, "ahishers") == [(1, "his", "his"), (3, "she", "she"), (4, "he", "he"), (4, "hers", "hers")]
+
+
+def test_matches_the_naive_scan():
+    patterns = ["ab", "abc", "bca", "c", "caa", "aaa"]
+    automaton = AhoCorasick()
+    for p in patterns:
+        automaton.add(p, p)
+    automaton.build()
+    text = "abcaaabcabcaaaab"
+    naive = sorted((i, p, p) for p in patterns for i in range(len(text)) if text.startswith(p, i))
+    assert _matches(automaton, text) == naive
+
+
+def test_normalize_label_text():
+    assert normalize_label_text("Flour, E-924 & INS 171.") == " flour e924 e171 "
+    assert normalize_label_text("Colour (INS 127)") == " colour e127 "
+
+
+@pytest.fixture
+def screener(tmp_path):
+    path = tmp_path / "banned.json"
+    path.write_text(json.dumps({"ingredients": [
+        {"name": "Potassium Bromate", "synonyms": ["E924", "KBrO3"], "severity": "Critical", "reason": "banned"},
+        {"name": "Titanium Dioxide", "synonyms": ["E171"], "severity": "Caution", "reason": "withdrawn"},
+        {"name": "Erythrosine", "synonyms": ["Red 3"], "severity": "High Risk", "reason": "dye"},
+    ]}))
+    return IngredientScreener(str(path))
+
+
+def test_screen_finds_names_synonyms_and_e_numbers(screener):
+    findings = screener.screen_text("INGREDIENTS: Wheat flour, sugar, colour (INS 171), E-924, RED 3.")
+    assert [(f["name"], f["matched"]) for f in findings] == [
+        ("Potassium Bromate", "e924"), ("Erythrosine", "red 3"), ("Titanium Dioxide", "e171")]
+
+
+def test_screen_matches_whole_words_only(screener):
+    assert screener.screen_text("Contains E9245 and red 30 and bred 3") == []
+
+
+def test_assess_takes_the_most_severe_risk(screener):
+    assessment = screener.assess("Titanium dioxide, erythrosine")
+    assert assessment["risk_level"] == "High Risk"
+    assert assessment["flagged_components"] == ["Erythrosine", "Titanium Dioxide"]
+    assert screener.assess("Wheat flour, salt")["risk_level"] == "Safe"
+
+
+def test_shipped_list_loads():
+    screener = IngredientScreener()
+    assert screener.ingredients
+    assert screener.screen_text("Improver (E924)")[0]["name"] == "Potassium Bromate"
@@ -0,0 +1,69 @@
+"""
+Offline checks for the retailer page extractors against the saved pages in fixtures/pages.
+
+    cd backapp && python -m pytest -q test_price_extractor.py
+"""
+import os
+
+import pytest
+
+from services import price_extractor
+from services.price_extractor import extract_offer, retailer_for
+
+PAGES = os.path.join(os.path.dirname(__file__), "fixtures", "pages")
+
+CASES = [
+    ("amazon", "https://www.amazon.in/dp/B00X", 95.0, "Amazon"),
+    ("flipkart", "https://www.flipkart.com/p/itm1", 92.0, "Flipkart"),
+    ("myntra", "https://www.myntra.com/shirts/123/buy", 3325.0, "Myntra"),
+    ("ajio", "https://www.ajio.com/p/460", 2099.0, "Ajio"),
+    ("meesho", "https://www.meesho.com/p/2x", 299.0, "Meesho"),
+]
+
+
+def _page(name: str) -> str:
+    with open(os.path.join(PAGES, f"{name}.html"), encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.fixture(params=["stdlib", "selectolax"])
+def parser(request, monkeypatch):
+    if request.param == "selectolax":
+        pytest.importorskip("selectolax")
+        assert price_extractor.FastParser is not None
+    else:
+        monkeypatch.setattr(price_extractor, "FastParser", None)
+    return request.param
+
+
+@pytest.mark.parametrize("name,url,price,seller", CASES, ids=[case[0] for case in CASES])
+def test_extract_offer(parser, name, url, price, seller):
+    retailer = retailer_for(url)
+    assert retailer is not None and retailer.name == seller
+    offer = extract_offer(_page(name), retailer)
+    assert offer is not None
+    assert offer["price"] == price
+    assert offer["currency"] == "INR"
+    assert offer["seller"] == seller
+
+
+def test_page_without_price(parser):
+    retailer = retailer_for("https://www.amazon.in/dp/B00X")
+    assert extract_offer("<html><head><title>Sign in</title></head><body></body></html>", retailer) is None
+
+
+@pytest.mark.parametrize("url,seller", [
+    ("https://smile.amazon.co.uk/dp/X", "Amazon"),
+    ("https://amazon.com/dp/X", "Amazon"),
+    ("https://dl.flipkart.com/p/X", "Flipkart"),
+    ("https://notflipkart.com/p/X", None),
+    ("https://example.com/amazon.in", None),
+    ("https://amazon.evil-shop.com/dp/X", None),
+    ("https://www.amazon.in.evil-shop.com/dp/X", None),
+    ("https://fakeamazon.in/dp/X", None),
+    ("https://www.amazon.com.au/dp/X", "Amazon"),
+    ("", None),
+])
+def test_retailer_for(url, seller):
+    retailer = retailer_for(url)
+    assert (retailer.name if retailer else None) == seller
@@ -0,0 +1,62 @@
+"""
+Visual re-ranking degrades to unranked prices when the image pool is saturated.
+
+    cd backapp && python -m pytest -q test_price_ranker.py
+"""
+import copy
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from services import price_ranker as ranker_module
+from services.image_pool import ImagePool, ImagePoolBusy
+from services.price_ranker import PriceRanker
+
+PRICES = [{"title": f"Item {n}", "thumbnail": f"https://img.example/{n}.jpg"} for n in range(3)]
+
+
+@pytest.fixture
+def ranker(monkeypatch):
+    monkeypatch.setattr(ranker_module.image_fetcher, "fetch_many",
+                        lambda urls, timeout: {u: b"jpeg" for u in urls})
+    ranker = PriceRanker()
+    ranker.enabled, ranker.budget, ranker.embed_seconds_per_image = True, 1.5, 0.01
+    return ranker
+
+
+def test_pool_busy_returns_prices_unranked(ranker, monkeypatch):
+    waits = []
+
+    def busy(images, wait=None):
+        waits.append(wait)
+        raise ImagePoolBusy()
+
+    monkeypatch.setattr(ranker_module.verification_service, "get_embeddings", busy)
+    prices = copy.deepcopy(PRICES)
+    summary = ranker.rerank(b"photo", prices)
+    assert summary["status"] == "pool_busy"
+    assert prices == PRICES
+    # The pool wait is bounded by what is left of the re-rank budget, not IMAGE_POOL_QUEUE_TIMEOUT
+    assert 0 < waits[0] <= ranker.budget
+
+
+def test_ranked(ranker, monkeypatch):
+    unit = np.array([1.0, 0.0])
+    monkeypatch.setattr(ranker_module.verification_service, "get_embeddings",
+                        lambda images, wait=None: [unit, unit, np.array([0.0, 1.0]), None])
+    prices = copy.deepcopy(PRICES)
+    assert ranker.rerank(b"photo", prices)["status"] == "ranked"
+    assert [p["visual_match"] for p in prices] == [True, False, None]
+
+
+def test_pool_slot_wait_is_bounded_by_the_caller():
+    pool = ImagePool()
+    pool.workers, pool.queue_timeout = 1, 5
+    pool._slots = threading.BoundedSemaphore(1)
+    pool._slots.acquire()       # every slot taken
+    start = time.monotonic()
+    with pytest.raises(ImagePoolBusy):
+        pool.preprocess_for_embedding(b"jpeg", wait=0.2)
+    assert time.monotonic() - start < 1
@@ -0,0 +1,88 @@
+"""
+Price string parsing, currency detection and the multi-market merge behind /price?regions=.
+
+    cd backapp && python -m pytest -q test_regions.py
+"""
+import pytest
+
+from services.regions import convert, detect_currency, parse_amount, parse_regions
+from services.search_service import merge_prices
+
+
+@pytest.mark.parametrize("text,amount", [
+    ("₹95", 95.0),
+    ("₹1,299", 1299.0),
+    ("Rs. 1,25,000", 125000.0),
+    ("$19.99", 19.99),
+    ("1.234,56 €", 1234.56),
+    ("12,50 €", 12.5),
+    ("1.250 €", 1250.0),
+    ("£1,250.00", 1250.0),
+    ("¥ 1 200", 1200.0),
+    ("Rs. 299.", 299.0),
+    ("Price not available", 0.0),
+    ("", 0.0),
+])
+def test_parse_amount(text, amount):
+    assert parse_amount(text) == amount
+
+
+@pytest.mark.parametrize("text,market,code", [
+    ("₹95", "USD", "INR"),
+    ("Rs. 95", "USD", "INR"),
+    ("US$20", "SGD", "USD"),
+    ("S$20", "USD", "SGD"),
+    ("A$20", "USD", "AUD"),
+    ("C$20", "USD", "CAD"),
+    ("€20", "GBP", "EUR"),
+    ("AED 75", "INR", "AED"),
+    ("$20", "CAD", "CAD"),          # a bare $ is the market's own dollar
+    ("20.00", "GBP", "GBP"),
+])
+def test_detect_currency(text, market, code):
+    assert detect_currency(text, market) == code
+
+
+def test_parse_regions():
+    assert parse_regions("IN, us,in") == ["in", "us"]
+    with pytest.raises(ValueError):
+        parse_regions("in,xx")
+    with pytest.raises(ValueError):
+        parse_regions(" , ")
+
+
+def test_convert():
+    assert convert(10.0, "USD", "USD") == 10.0
+    assert convert(1.0, "USD", "INR") == 83.0
+    assert convert(1.0, "USD", "XYZ") is None
+
+
+def _offer(seller, price, currency, link="", title="Parle-G 800g"):
+    return {"seller": seller, "price": price, "currency": currency, "link": link, "rating": 4.0, "title": title}
+
+
+def test_merge_converts_into_the_first_region():
+    merged = merge_prices({
+        "in": [_offer("Amazon", 95.0, "INR", "https://www.amazon.in/dp/X")],
+        "us": [_offer("Walmart", 2.0, "USD", "https://www.walmart.com/ip/1")],
+    }, ["in", "us"])
+    assert [(e["seller"], e["price"], e["currency"]) for e in merged] == [("Amazon", 95.0, "₹"), ("Walmart", 166.0, "₹")]
+    walmart = merged[1]
+    assert (walmart["original_price"], walmart["original_currency"]) == (2.0, "$")
+    assert "original_price" not in merged[0]
+
+
+def test_merge_keeps_an_offer_listed_in_several_markets_once():
+    same_link = _offer("Amazon", 2.0, "USD", "https://www.amazon.com/dp/X/")
+    merged = merge_prices({
+        "us": [same_link, _offer("Target", 3.0, "USD", "https://target.com/p/1")],
+        "uk": [dict(same_link, link="https://amazon.com/dp/X?"), _offer("Tesco", 1.0, "GBP", "https://tesco.com/1")],
+    }, ["us", "uk"])
+    assert [e["seller"] for e in merged] == ["Tesco", "Amazon", "Target"]
+
+
+def test_merge_puts_unpriced_offers_last_and_drops_unknown_currencies():
+    merged = merge_prices({"in": [_offer("Meesho", 0.0, "INR", "https://meesho.com/1"),
+                                  _offer("Ajio", 2099.0, "INR", "https://ajio.com/1"),
+                                  _offer("Odd", 5.0, "XYZ", "https://odd.example/1")]}, ["in"])
+    assert [e["seller"] for e in merged] == ["Ajio", "Meesho"]
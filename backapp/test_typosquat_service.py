@@ -0,0 +1,106 @@
+"""
+BK-tree brand matching and the typosquat decision on OCR'd words (no Tesseract needed).
+
+    cd backapp && python -m pytest -q test_typosquat_service.py
+"""
+import random
+
+import pytest
+
+from services import typosquat_service as typosquat_module
+from services.typosquat_service import BKTree, TyposquatService, edit_distance, levenshtein
+
+random.seed(7)
+WORDS = sorted({"".join(random.choice("abcde") for _ in range(random.randint(2, 7))) for _ in range(500)})
+
+
+@pytest.mark.parametrize("a,b,lev,osa", [
+    ("parle", "parle", 0, 0),
+    ("parleg", "parlej", 1, 1),
+    ("colgate", "colgaet", 2, 1),
+    ("ca", "abc", 3, 3),
+    ("", "abc", 3, 3),
+])
+def test_distances(a, b, lev, osa):
+    assert levenshtein(a, b) == lev
+    assert edit_distance(a, b) == osa
+
+
+def test_osa_is_not_a_metric_but_levenshtein_is():
+    assert edit_distance("ca", "abc") > edit_distance("ca", "ac") + edit_distance("ac", "abc")
+    for a, b, c in (random.sample(WORDS, 3) for _ in range(300)):
+        assert levenshtein(a, c) <= levenshtein(a, b) + levenshtein(b, c)
+
+
+def test_bk_tree_search_matches_a_linear_scan():
+    tree = BKTree()
+    for word in WORDS:
+        tree.add(word)
+    tree.add(WORDS[0])      # duplicates are ignored
+    assert tree.size == len(WORDS)
+    for query in WORDS[:100] + ["ab", "eeeeeee", "x"]:
+        for radius in (0, 1, 2):
+            expected = sorted((levenshtein(query, w), w) for w in WORDS if levenshtein(query, w) <= radius)
+            assert tree.search(query, radius) == expected
+
+
+@pytest.fixture(scope="module")
+def service():
+    return TyposquatService()
+
+
+def test_near_brands_counts_transpositions_once(service):
+    for key in ("colgaet", "parelg", "britania", "nestel", "amul"):
+        for radius in (1, 2):
+            expected = sorted((edit_distance(key, b), b) for b in service.brands if edit_distance(key, b) <= radius)
+            assert service._near_brands(key, radius) == expected
+
+
+def _words(*lines, conf=95):
+    """OCR words; the first line is the tallest (the logo)."""
+    return [{"text": text, "conf": conf, "line": n, "height": 100 - 10 * n}
+            for n, line in enumerate(lines) for text in line.split()]
+
+
+def test_blatant_typosquat(service):
+    finding = service.analyze_words(_words("Parle-J", "Glucose Biscuits"))
+    assert finding == {"observed": "Parle-J", "expected": "Parle-G", "distance": 1}
+
+
+def test_transposed_brand(service):
+    finding = service.analyze_words(_words("Colgaet", "Toothpaste"))
+    assert finding["expected"] == "Colgate" and finding["distance"] == 1
+
+
+@pytest.mark.parametrize("words", [
+    _words("Parle-J", "Parle-G Glucose Biscuits"),     # the genuine brand is on the pack too
+    _words("Parle-6", "Glucose Biscuits"),              # OCR misread of G
+    _words("Parle-J", "Glucose Biscuits", conf=60),     # OCR not sure enough
+    _words("Colgates", "Toothpaste"),                   # extension, not a blatant typo
+    _words("Apply", "here"),                            # everyday word
+    _words("Glucose Biscuits"),
+])
+def test_not_blatant(service, words):
+    assert service.analyze_words(words) is None
+
+
+@pytest.mark.parametrize("observed", ["AMPLE", "SALON", "Peaks", "Fortuna", "Bongo", "Tigre", "Santoro"])
+def test_common_words_are_not_typosquats(service, observed):
+    pytest.importorskip("wordfreq")
+    assert service.analyze_words(_words(observed, "Net Wt 100g")) is None
+
+
+def test_near_miss_is_a_hint_not_a_verdict(service, monkeypatch):
+    monkeypatch.setattr(typosquat_module.ocr_service, "available", True)
+    monkeypatch.setattr(typosquat_module.ocr_service, "words", lambda images: _words("Parle-J", "Glucose Biscuits"))
+    finding = service.check([b"jpeg"])
+    assert finding == {"observed": "Parle-J", "expected": "Parle-G", "distance": 1}
+
+    result = {"verification": {"is_authentic_guess": "Authentic", "anomalies_detected": "none"},
+              "raw_forensic_analysis": {"verdict": "Authentic", "forensic_flags": []}}
+    service.merge_into(result, finding)
+    assert result["verification"]["is_authentic_guess"] == "Authentic"     # the model's verdict stands
+    assert result["raw_forensic_analysis"]["forensic_flags"][0]["check"] == "Spelling Check"
+    assert result["verification"]["anomalies_detected"][0] == "none"
+    assert "Parle-J" in result["verification"]["anomalies_detected"][1]
+    assert service.merge_into({}, None) == {}
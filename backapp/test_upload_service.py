@@ -0,0 +1,77 @@
+"""
+Upload byte budget: the decode share matches decode_image's target and goes back early.
+
+    cd backapp && python -m pytest -q test_upload_service.py
+"""
+import asyncio
+import io
+
+from PIL import Image
+from starlette.datastructures import UploadFile
+
+from services.image_utils import decoded_size
+from services.upload_service import ByteBudget, MB, UploadService
+
+
+def _upload(fmt: str, size=(4000, 3000)) -> UploadFile:
+    buf = io.BytesIO()
+    Image.new("RGB", size, "white").save(buf, format=fmt)
+    return UploadFile(io.BytesIO(buf.getvalue()), size=buf.tell(), filename=f"photo.{fmt.lower()}")
+
+
+def test_decoded_size_follows_the_jpeg_draft_scale():
+    assert decoded_size(4000, 3000, "JPEG", max_edge=2000) == (2000, 1500)
+    assert decoded_size(4032, 3024, "JPEG", max_edge=1024) == (2016, 1512)
+    assert decoded_size(3000, 2000, "JPEG", max_edge=2000) == (3000, 2000)
+    # reduce() needs the full bitmap loaded first
+    assert decoded_size(4000, 3000, "PNG", max_edge=2000) == (4000, 3000)
+
+
+def _ingest_and_release(fmt: str):
+    service = UploadService()
+    service.budget = ByteBudget(256 * MB)
+    upload = _upload(fmt)
+    seen = {}
+
+    async def run():
+        async with service.ingest([upload, None]) as (images_data, filenames):
+            seen["held"] = service.budget.in_flight
+            await service.release_decode()
+            await service.release_decode()      # idempotent
+            seen["after_release"] = service.budget.in_flight
+            seen["raw"] = len(images_data[0])
+        seen["after_exit"] = service.budget.in_flight
+
+    asyncio.run(run())
+    return seen
+
+
+def test_jpeg_reserves_the_draft_bitmap_until_released():
+    seen = _ingest_and_release("JPEG")
+    assert seen["held"] == seen["raw"] + 2000 * 1500 * 3
+    assert seen["after_release"] == seen["raw"]
+    assert seen["after_exit"] == 0
+
+
+def test_png_reserves_the_full_bitmap():
+    seen = _ingest_and_release("PNG")
+    assert seen["held"] == seen["raw"] + 4000 * 3000 * 3
+    assert seen["after_exit"] == 0
+
+
+def test_release_waits_for_the_scans():
+    service = UploadService()
+    service.budget = ByteBudget(256 * MB)
+
+    async def run():
+        async with service.ingest([_upload("JPEG")]) as (images_data, _):
+            scan = asyncio.get_running_loop().create_future()
+            release = asyncio.ensure_future(service.release_decode(scan))
+            await asyncio.sleep(0.01)
+            before = service.budget.in_flight
+            scan.set_result(None)
+            await release
+            return before, service.budget.in_flight, len(images_data[0])
+
+    before, after, raw = asyncio.run(run())
+    assert before == raw + 2000 * 1500 * 3 and after == raw
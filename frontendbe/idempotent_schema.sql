@@ -57,6 +57,135 @@ create table if not exists public.price_results (
   created_at timestamp with time zone default timezone('utc'::text, now()) not null
 );
 
+-- History pagination: keyset on (created_at, id), one index range scan per page
+-- (see backapp/services/history_store.py). The scans indexes only seek: the page's URL columns
+-- come from the heap, as website_url is unbounded and could exceed the btree entry size. The
+-- cheapest-price lookup is index-only.
+create index if not exists scans_user_created_idx on public.scans (user_id, created_at desc, id desc);
+create index if not exists scans_user_intent_created_idx on public.scans (user_id, intent, created_at desc, id desc);
+create index if not exists scan_results_scan_idx on public.scan_results (scan_id);
+drop index if exists public.price_results_scan_price_idx;
+create index if not exists price_results_scan_price_currency_idx on public.price_results (scan_id, price) include (currency);
+
+-- Dashboard rollups: per user and UTC day / all time, per intent, with result counts.
+-- Maintained by the triggers below as scans and results are written; GET /stats reads only these.
+create table if not exists public.scan_stats_daily (
+  user_id uuid references public.profiles(id) on delete cascade not null,
+  day date not null,
+  intent text not null,
+  scans integer not null default 0,
+  genuine integer not null default 0,
+  fake integer not null default 0,
+  uncertain integer not null default 0,
+  primary key (user_id, day, intent)
+);
+
+create table if not exists public.scan_stats_total (
+  user_id uuid references public.profiles(id) on delete cascade not null,
+  intent text not null,
+  scans integer not null default 0,
+  genuine integer not null default 0,
+  fake integer not null default 0,
+  uncertain integer not null default 0,
+  primary key (user_id, intent)
+);
+
+alter table public.scan_stats_daily enable row level security;
+drop policy if exists "Users can view own daily stats" on public.scan_stats_daily;
+create policy "Users can view own daily stats" on public.scan_stats_daily for select using (auth.uid() = user_id);
+alter table public.scan_stats_total enable row level security;
+drop policy if exists "Users can view own total stats" on public.scan_stats_total;
+create policy "Users can view own total stats" on public.scan_stats_total for select using (auth.uid() = user_id);
+
+create or replace function public.bump_scan_stats(p_user uuid, p_day date, p_intent text,
+  d_scans integer, d_genuine integer, d_fake integer, d_uncertain integer)
+returns void as $$
+begin
+  insert into public.scan_stats_daily as d (user_id, day, intent, scans, genuine, fake, uncertain)
+  values (p_user, p_day, p_intent, d_scans, d_genuine, d_fake, d_uncertain)
+  on conflict (user_id, day, intent) do update set scans = d.scans + excluded.scans,
+    genuine = d.genuine + excluded.genuine, fake = d.fake + excluded.fake, uncertain = d.uncertain + excluded.uncertain;
+
+  insert into public.scan_stats_total as t (user_id, intent, scans, genuine, fake, uncertain)
+  values (p_user, p_intent, d_scans, d_genuine, d_fake, d_uncertain)
+  on conflict (user_id, intent) do update set scans = t.scans + excluded.scans,
+    genuine = t.genuine + excluded.genuine, fake = t.fake + excluded.fake, uncertain = t.uncertain + excluded.uncertain;
+end;
+$$ language plpgsql security definer;
+-- Only the triggers may call it; functions in public are otherwise exposed as /rpc endpoints
+revoke execute on function public.bump_scan_stats(uuid, date, text, integer, integer, integer, integer) from public, anon, authenticated;
+
+create or replace function public.scan_stats_on_scan_insert()
+returns trigger as $$
+begin
+  perform public.bump_scan_stats(new.user_id, (new.created_at at time zone 'utc')::date, new.intent, 1, 0, 0, 0);
+  return new;
+end;
+$$ language plpgsql security definer;
+
+create or replace function public.scan_stats_on_result_insert()
+returns trigger as $$
+declare
+  s record;
+begin
+  if new.authenticity_status in ('Genuine', 'Fake', 'Uncertain') then
+    select user_id, intent, created_at into s from public.scans where id = new.scan_id;
+    perform public.bump_scan_stats(s.user_id, (s.created_at at time zone 'utc')::date, s.intent, 0,
+      (new.authenticity_status = 'Genuine')::int, (new.authenticity_status = 'Fake')::int,
+      (new.authenticity_status = 'Uncertain')::int);
+  end if;
+  return new;
+end;
+$$ language plpgsql security definer;
+
+-- Before delete, so the scan's results (removed by the cascade) can still be counted.
+-- When the scan goes because its profile is being deleted, the profile row is already gone
+-- and its rollups are removed by their own cascade: upserting them would recreate rows that
+-- reference the deleted profile and fail the account deletion on the foreign key.
+create or replace function public.scan_stats_on_scan_delete()
+returns trigger as $$
+declare
+  g integer; f integer; u integer;
+begin
+  if not exists (select 1 from public.profiles where id = old.user_id) then
+    return old;
+  end if;
+  select count(*) filter (where authenticity_status = 'Genuine'),
+         count(*) filter (where authenticity_status = 'Fake'),
+         count(*) filter (where authenticity_status = 'Uncertain')
+    into g, f, u from public.scan_results where scan_id = old.id;
+  perform public.bump_scan_stats(old.user_id, (old.created_at at time zone 'utc')::date, old.intent, -1, -g, -f, -u);
+  return old;
+end;
+$$ language plpgsql security definer;
+
+drop trigger if exists scan_stats_scan_insert on public.scans;
+create trigger scan_stats_scan_insert
+  after insert on public.scans
+  for each row execute procedure public.scan_stats_on_scan_insert();
+drop trigger if exists scan_stats_result_insert on public.scan_results;
+create trigger scan_stats_result_insert
+  after insert on public.scan_results
+  for each row execute procedure public.scan_stats_on_result_insert();
+drop trigger if exists scan_stats_scan_delete on public.scans;
+create trigger scan_stats_scan_delete
+  before delete on public.scans
+  for each row execute procedure public.scan_stats_on_scan_delete();
+
+-- Rebuild the rollups from existing rows (safe to re-run: they are recomputed from scratch)
+delete from public.scan_stats_daily;
+delete from public.scan_stats_total;
+insert into public.scan_stats_daily (user_id, day, intent, scans, genuine, fake, uncertain)
+select s.user_id, (s.created_at at time zone 'utc')::date, s.intent, count(distinct s.id),
+       count(*) filter (where r.authenticity_status = 'Genuine'),
+       count(*) filter (where r.authenticity_status = 'Fake'),
+       count(*) filter (where r.authenticity_status = 'Uncertain')
+from public.scans s left join public.scan_results r on r.scan_id = s.id
+group by 1, 2, 3;
+insert into public.scan_stats_total (user_id, intent, scans, genuine, fake, uncertain)
+select user_id, intent, sum(scans), sum(genuine), sum(fake), sum(uncertain)
+from public.scan_stats_daily group by 1, 2;
+
 -- 6. SUPPORT TICKETS
 create table if not exists public.support_tickets (
   id uuid default uuid_generate_v4() primary key,
@@ -1,15 +1,25 @@
-import React from 'react';
+import React, { useEffect, useState } from 'react';
 import { View, Text, StyleSheet } from 'react-native';
 import { useTheme } from '../../context/ThemeContext';
 import { spacing } from '../../theme/colors';
+import { VerificationService } from '../../services/VerificationService';
 
 export const UsageInsights = () => {
     const { colors, isDark } = useTheme();
+    const [totals, setTotals] = useState<any>(null);
 
+    useEffect(() => {
+        VerificationService.getStats(30)
+            .then(stats => setTotals(stats.total))
+            .catch(err => console.warn("Stats unavailable:", err));
+    }, []);
+
+    // Share of all-time scans per intent
+    const share = (count: number) => totals?.scans ? Math.round((count / totals.scans) * 100) : 0;
     const usages = [
-        { label: 'Verification', count: 65, total: 100, color: colors.primary },
-        { label: 'Price Checks', count: 20, total: 100, color: '#4CAF50' },
-        { label: 'Details', count: 15, total: 100, color: '#FF9800' },
+        { label: 'Verification', count: share(totals?.verify || 0), total: 100, color: colors.primary },
+        { label: 'Price Checks', count: share(totals?.price || 0), total: 100, color: '#4CAF50' },
+        { label: 'Details', count: share(totals?.details || 0), total: 100, color: '#FF9800' },
     ];
 
     return (
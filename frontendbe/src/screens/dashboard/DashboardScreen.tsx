@@ -1,9 +1,11 @@
-import React, { useState } from 'react';
+import React, { useState, useCallback } from 'react';
 import { View, Text, StyleSheet, ScrollView, RefreshControl } from 'react-native';
 import { Container } from '../../components/Container';
 import { useAuth } from '../../helpers/AuthContext';
 import { useTheme } from '../../context/ThemeContext';
 import { spacing } from '../../theme/colors';
+import { useFocusEffect } from '@react-navigation/native';
+import { VerificationService } from '../../services/VerificationService';
 
 // Components
 import { ActionCard } from '../../components/dashboard/ActionCard';
@@ -16,19 +18,35 @@ export const DashboardScreen = ({ navigation }: any) => {
     const { user } = useAuth();
     const { colors, themeMode } = useTheme();
     const [refreshing, setRefreshing] = useState(false);
+    const [totals, setTotals] = useState<any>(null);
+
+    const loadStats = useCallback(async () => {
+        if (!user) return;
+        try {
+            const stats = await VerificationService.getStats(30);
+            setTotals(stats.total);
+        } catch (err) {
+            console.warn("Stats unavailable:", err);
+        }
+    }, [user?.id]);
+
+    useFocusEffect(
+        useCallback(() => {
+            loadStats();
+        }, [loadStats])
+    );
 
-    // Mock data for QuickStats
     const statsData = [
-        { label: 'Total Scans', value: '124', accentColor: colors.primary },
-        { label: 'Verified', value: '98', accentColor: '#4CAF50' },
-        { label: 'Issues', value: '3', accentColor: '#F44336' },
+        { label: 'Total Scans', value: totals ? String(totals.scans) : '-', accentColor: colors.primary },
+        { label: 'Verified', value: totals ? String(totals.genuine) : '-', accentColor: '#4CAF50' },
+        { label: 'Issues', value: totals ? String(totals.fake) : '-', accentColor: '#F44336' },
     ];
 
-    const onRefresh = React.useCallback(() => {
+    const onRefresh = React.useCallback(async () => {
         setRefreshing(true);
-        // Simulate network request
-        setTimeout(() => setRefreshing(false), 1500);
-    }, []);
+        await loadStats();
+        setRefreshing(false);
+    }, [loadStats]);
 
     const handleUpgrade = () => {
         // Navigate to subscription screen or show modal
@@ -5,7 +5,7 @@ import { Container } from '../../components/Container';
 import { Button } from '../../components/common/Button';
 import { useTheme } from '../../context/ThemeContext';
 import { useAuth } from '../../helpers/AuthContext';
-import { SupabaseService } from '../../services/SupabaseService';
+import { VerificationService } from '../../services/VerificationService';
 import { spacing } from '../../theme/colors';
 import { FontAwesome5 } from '@expo/vector-icons';
 
@@ -19,40 +19,48 @@ export const HistoryScreen = ({ navigation }: any) => {
     const [loading, setLoading] = useState(true);
     const [searchQuery, setSearchQuery] = useState('');
     const [activeFilter, setActiveFilter] = useState('all');
-    const [page, setPage] = useState(1);
-    const [totalPages, setTotalPages] = useState(1);
+    // Keyset pagination: cursors[i] fetches page i + 1 (null for the newest page)
+    const [cursors, setCursors] = useState<(string | null)[]>([null]);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
+    const page = cursors.length;
+
+    // Intent and input-type chips filter on the server, so every page is full
+    const serverFilters = ['verify', 'price', 'details'].includes(activeFilter) ? { intent: activeFilter }
+        : ['camera', 'upload'].includes(activeFilter) ? { inputType: activeFilter } : {};
+
+    const handleFilter = (filter: string) => {
+        setActiveFilter(filter);
+        setCursors([null]);
+    };
 
     const fetchHistory = useCallback(async () => {
         if (!user) return;
         setLoading(true);
         try {
-            const response = await SupabaseService.getUserHistory(user.id, page, 5);
-            const data = response.data || [];
-            setTotalPages(response.totalPages);
+            const response = await VerificationService.getHistory(serverFilters, cursors[cursors.length - 1], 5);
+            const data = response.items || [];
+            setNextCursor(response.next_cursor);
 
             // Transform data for UI
             const formatted = data.map((item: any) => {
-                const result = item.scan_results?.[0] || {};
-                const price = item.price_results?.[0] || {};
-
                 let statusText = 'Pending';
                 let statusColor = '#666';
 
                 if (item.intent === 'verify') {
-                    statusText = result.authenticity_status || 'Unknown';
+                    statusText = item.authenticity_status || 'Unknown';
                     statusColor = statusText === 'Genuine' ? '#4CAF50' :
                         statusText === 'Fake' ? '#F44336' : '#FFC107';
                 } else if (item.intent === 'price') {
-                    statusText = price.price ? `$${price.price}` : 'No Price';
+                    statusText = item.best_price != null ? `${item.currency === 'USD' || !item.currency ? '$' : item.currency + ' '}${item.best_price}` : 'No Price';
                     statusColor = '#4CAF50';
                 } else {
                     statusText = 'Viewed';
                 }
 
                 return {
-                    id: item.id,
-                    name: result.product_name || 'Unknown Product',
-                    brand: result.brand || 'Unknown Brand',
+                    id: item.scan_id,
+                    name: item.product_name || 'Unknown Product',
+                    brand: item.brand || 'Unknown Brand',
                     image: item.image_url || 'https://via.placeholder.com/150',
                     date: new Date(item.created_at).toLocaleDateString(),
                     intent: item.intent,
@@ -67,7 +75,7 @@ export const HistoryScreen = ({ navigation }: any) => {
         } finally {
             setLoading(false);
         }
-    }, [user?.id, page]);
+    }, [user?.id, cursors, activeFilter]);
 
     useFocusEffect(
         useCallback(() => {
@@ -75,14 +83,11 @@ export const HistoryScreen = ({ navigation }: any) => {
         }, [fetchHistory])
     );
 
-    // Filter Logic
-    const filteredData = scans.filter(item => {
-        const matchesSearch = item.name.toLowerCase().includes(searchQuery.toLowerCase()) ||
-            item.brand.toLowerCase().includes(searchQuery.toLowerCase());
-
-        const matchesFilter = activeFilter === 'all' || item.intent === activeFilter;
-        return matchesSearch && matchesFilter;
-    });
+    // Search within the current page
+    const filteredData = scans.filter(item =>
+        item.name.toLowerCase().includes(searchQuery.toLowerCase()) ||
+        item.brand.toLowerCase().includes(searchQuery.toLowerCase())
+    );
 
     const handlePress = (item: any) => {
         // We pass the full scan result data to the result screen
@@ -93,7 +98,7 @@ export const HistoryScreen = ({ navigation }: any) => {
                 method: 'history',
                 intent: item.intent,
                 data: item.image,
-                mockResult: item.fullData?.scan_results?.[0]
+                mockResult: item.fullData
             }
         });
     };
@@ -136,7 +141,7 @@ export const HistoryScreen = ({ navigation }: any) => {
                 </View>
             </View>
 
-            <HistoryFilters activeFilter={activeFilter} onSelect={setActiveFilter} />
+            <HistoryFilters activeFilter={activeFilter} onSelect={handleFilter} />
 
             {loading ? (
                 <View style={{ flex: 1, justifyContent: 'center' }}>
@@ -158,18 +163,18 @@ export const HistoryScreen = ({ navigation }: any) => {
                 <View style={styles.paginationContainer}>
                     <Button
                         title="Previous"
-                        onPress={() => setPage(p => Math.max(1, p - 1))}
+                        onPress={() => setCursors(c => c.length > 1 ? c.slice(0, -1) : c)}
                         disabled={page === 1}
                         variant="outline"
                         style={{ width: 100 }}
                     />
                     <Text style={[styles.pageText, { color: colors.text }]}>
-                        Page {page} of {totalPages}
+                        Page {page}
                     </Text>
                     <Button
                         title="Next"
-                        onPress={() => setPage(p => Math.min(totalPages, p + 1))}
-                        disabled={page === totalPages}
+                        onPress={() => nextCursor && setCursors(c => [...c, nextCursor])}
+                        disabled={!nextCursor}
                         variant="outline"
                         style={{ width: 100 }}
                     />
@@ -112,6 +112,7 @@ export const ScanScreen = ({ navigation, route }: any) => {
         try {
             let apiResult = null;
             let finalImageUrl = frontImage || backImage;
+            let scanId: string | null = null;
 
             // 1. Upload & Verify
             if (method !== 'url') {
@@ -121,21 +122,31 @@ export const ScanScreen = ({ navigation, route }: any) => {
                     return;
                 }
 
-                // Use the first available image as the "main" one for display/history
-                finalImageUrl = frontImage || backImage;
+                // Use the first available image as the "main" one for display/history.
+                // Its storage URL is known before the upload, so the upload runs alongside the
+                // backend request and the backend saves the scan to history with that URL.
+                const mainImage = (frontImage || backImage) as string;
+                const { fileName, publicUrl } = SupabaseService.scanImagePath(mainImage);
+                const upload = SupabaseService.uploadImage(mainImage, 'scans', fileName)
+                    .then(() => publicUrl)
+                    .catch((err) => {
+                        console.warn("Supabase upload failed, falling back to local URI", err);
+                        return mainImage;
+                    });
+                const scan = { inputType: method, imageUrl: publicUrl };
 
                 try {
                     // Call our new Python Backend API based on intent
                     if (intent === 'price') {
                         console.log("Checking Price...");
-                        apiResult = await VerificationService.checkPrice(frontImage, backImage);
+                        apiResult = await VerificationService.checkPrice(frontImage, backImage, 'price_asc', scan);
                     } else if (intent === 'details') {
                         console.log("Getting Details...");
-                        apiResult = await VerificationService.getProductDetails(frontImage, backImage);
+                        apiResult = await VerificationService.getProductDetails(frontImage, backImage, scan);
                     } else {
                         // Default: verify
                         console.log("Verifying...");
-                        apiResult = await VerificationService.verifyProduct(frontImage, backImage);
+                        apiResult = await VerificationService.verifyProduct(frontImage, backImage, scan);
                     }
 
                     console.log("API Result:", apiResult);
@@ -146,57 +157,33 @@ export const ScanScreen = ({ navigation, route }: any) => {
                     return;
                 }
 
-                // Optional: Upload to Supabase for persistence if needed
+                finalImageUrl = await upload;
+                scanId = apiResult?.scan_id || null;
+            } else {
+                // 2. URL scans don't go through the backend: save the history record here - NON-BLOCKING
                 try {
-                    // Upload whatever we have. For history, maybe just one?
-                    // Ideally we upload both, but existing schema might be single image. 
-                    // Let's just upload the main one for now to keep history working.
-                    if (finalImageUrl) {
-                        finalImageUrl = await SupabaseService.uploadImage(finalImageUrl, 'scans');
-                    }
+                    const scanData = await SupabaseService.saveScan({
+                        user_id: user.id,
+                        input_type: method,
+                        intent: intent,
+                        website_url: url
+                    });
+                    scanId = scanData.id;
                 } catch (err) {
-                    console.warn("Supabase upload failed, falling back to local URI", err);
+                    console.warn("Supabase History Save Failed (Non-critical):", err);
                 }
             }
 
-            // 2. Save Scan Record (History) - NON-BLOCKING
-            let scanData = { id: 'temp-id-' + Date.now() }; // Fallback ID
-            try {
-                scanData = await SupabaseService.saveScan({
-                    user_id: user?.id || 'anon',
-                    input_type: method,
-                    intent: intent,
-                    image_url: finalImageUrl || undefined,
-                    website_url: method === 'url' ? url : undefined
-                });
-            } catch (err) {
-                console.warn("Supabase History Save Failed (Non-critical):", err);
-            }
-
-            // 3. Save Results - NON-BLOCKING
-            try {
-                const resultForDb = {
-                    scan_id: scanData.id,
-                    authenticity_status: intent === 'verify' ? 'analyzed' : 'info_only',
-                    confidence_score: 0,
-                    product_name: apiResult?.product_name || 'Analysis Complete',
-                    metadata: apiResult
-                };
-                await SupabaseService.saveScanResults(resultForDb);
-            } catch (err) {
-                console.warn("Supabase Result Save Failed (Non-critical):", err);
-            }
-
             console.log("Navigating to ScanResult...", { apiResult, intent });
 
-            // 4. Navigate with Real Data
+            // 3. Navigate with Real Data
             navigation.navigate('ScanResult', {
                 method,
                 intent,
                 data: finalImageUrl || url,
                 frontImage,
                 backImage,
-                scanId: scanData.id,
+                scanId,
                 mockResult: null, // Clear mock
                 apiResult: apiResult // Pass real result
             });
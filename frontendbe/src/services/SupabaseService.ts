@@ -64,36 +64,6 @@ export const SupabaseService = {
         if (error) throw error;
     },
 
-    async getUserHistory(userId: string, page: number = 1, limit: number = 5) {
-        // Calculate pagination range
-        const from = (page - 1) * limit;
-        const to = from + limit - 1;
-
-        // Fetch scans with their results, ordered by creation date descending
-        const { data, error, count } = await supabase
-            .from('scans')
-            .select(`
-                *,
-                scan_results (*),
-                price_results (*)
-            `, { count: 'exact' })
-            .eq('user_id', userId)
-            .order('created_at', { ascending: false })
-            .range(from, to);
-
-        if (error) throw error;
-
-        const totalRecords = count || 0;
-        const totalPages = Math.ceil(totalRecords / limit);
-
-        return {
-            currentPage: page,
-            totalPages: totalPages,
-            totalRecords: totalRecords,
-            data: data
-        };
-    },
-
     // --- SUPPORT ---
     async createSupportTicket(ticket: { user_id: string; subject: string; message: string }) {
         const { error } = await supabase
@@ -103,10 +73,19 @@ export const SupabaseService = {
     },
 
     // --- STORAGE ---
-    async uploadImage(uri: string, bucket: string = 'scans') {
+    // Picks the storage path and public URL up front, so the URL can go out with the scan
+    // request while the upload itself runs alongside it
+    scanImagePath(uri: string, bucket: string = 'scans') {
+        const ext = uri.substring(uri.lastIndexOf('.') + 1);
+        const fileName = `${Date.now()}.${ext}`;
+        const { data } = supabase.storage.from(bucket).getPublicUrl(fileName);
+        return { fileName, publicUrl: data.publicUrl };
+    },
+
+    async uploadImage(uri: string, bucket: string = 'scans', fileName?: string) {
         try {
             const ext = uri.substring(uri.lastIndexOf('.') + 1);
-            const fileName = `${Date.now()}.${ext}`;
+            fileName = fileName || `${Date.now()}.${ext}`;
             const formData = new FormData();
 
             // React Native specific FormData handling
@@ -1,4 +1,5 @@
 import { Platform } from 'react-native';
+import { supabase } from './supabase';
 
 const getBaseUrl = () => {
     if (Platform.OS === 'android') {
@@ -9,6 +10,23 @@ const getBaseUrl = () => {
 
 const BASE_URL = getBaseUrl();
 
+// The backend gives paid-tier users priority when it is busy, so send the session token along
+const authHeaders = async (): Promise<Record<string, string>> => {
+    const { data: { session } } = await supabase.auth.getSession();
+    return session ? { 'Authorization': `Bearer ${session.access_token}` } : {};
+};
+
+// Signed-in scans are saved to history by the backend; this describes the scan for that record
+export interface ScanInfo {
+    inputType?: string;
+    imageUrl?: string | null;
+}
+
+const scanHeaders = (scan?: ScanInfo): Record<string, string> => ({
+    ...(scan?.inputType ? { 'X-Input-Type': scan.inputType } : {}),
+    ...(scan?.imageUrl ? { 'X-Image-Url': scan.imageUrl } : {}),
+});
+
 export interface VerificationResult {
     filename: string;
     input_analysis: any;
@@ -17,7 +35,7 @@ export interface VerificationResult {
 }
 
 export const VerificationService = {
-    async verifyProduct(frontUri?: string | null, backUri?: string | null): Promise<VerificationResult> {
+    async verifyProduct(frontUri?: string | null, backUri?: string | null, scan?: ScanInfo): Promise<VerificationResult> {
         try {
             const formData = new FormData();
 
@@ -50,6 +68,8 @@ export const VerificationService = {
                 body: formData,
                 headers: {
                     'Accept': 'application/json',
+                    ...(await authHeaders()),
+                    ...scanHeaders(scan),
                 },
             });
 
@@ -66,7 +86,7 @@ export const VerificationService = {
         }
     },
 
-    async checkPrice(frontUri?: string | null, backUri?: string | null, sortBy: string = 'price_asc'): Promise<any> {
+    async checkPrice(frontUri?: string | null, backUri?: string | null, sortBy: string = 'price_asc', scan?: ScanInfo, regions?: string[]): Promise<any> {
         try {
             const formData = new FormData();
 
@@ -93,11 +113,13 @@ export const VerificationService = {
                 throw new Error("At least one image is required");
             }
 
-            console.log(`Checking price at ${BASE_URL}/price?sort=${sortBy}...`);
-            const response = await fetch(`${BASE_URL}/price?sort=${sortBy}`, {
+            // Markets to compare, e.g. ['in', 'us']; prices come back in the first one's currency
+            const query = `sort=${sortBy}` + (regions?.length ? `&regions=${regions.join(',')}` : '');
+            console.log(`Checking price at ${BASE_URL}/price?${query}...`);
+            const response = await fetch(`${BASE_URL}/price?${query}`, {
                 method: 'POST',
                 body: formData,
-                headers: { 'Accept': 'application/json' },
+                headers: { 'Accept': 'application/json', ...(await authHeaders()), ...scanHeaders(scan) },
             });
 
             if (!response.ok) throw new Error(`Server Error ${response.status}`);
@@ -108,7 +130,46 @@ export const VerificationService = {
         }
     },
 
-    async getProductDetails(frontUri?: string | null, backUri?: string | null): Promise<any> {
+    // Keyset-paginated scan history: pass the previous page's next_cursor to get the next (older) page
+    async getHistory(filters: { intent?: string; inputType?: string; verdict?: string; since?: string; until?: string } = {},
+        cursor?: string | null, limit: number = 20): Promise<{ items: any[]; next_cursor: string | null }> {
+        try {
+            const params = new URLSearchParams({ limit: String(limit) });
+            if (filters.intent) params.append('intent', filters.intent);
+            if (filters.inputType) params.append('input_type', filters.inputType);
+            if (filters.verdict) params.append('verdict', filters.verdict);
+            if (filters.since) params.append('since', filters.since);
+            if (filters.until) params.append('until', filters.until);
+            if (cursor) params.append('cursor', cursor);
+
+            const response = await fetch(`${BASE_URL}/history?${params.toString()}`, {
+                headers: { 'Accept': 'application/json', ...(await authHeaders()) },
+            });
+
+            if (!response.ok) throw new Error(`Server Error ${response.status}`);
+            return await response.json();
+        } catch (error) {
+            console.error('History Error:', error);
+            throw error;
+        }
+    },
+
+    // Dashboard counts (all time + last `days` days), served from the backend's rollup tables
+    async getStats(days: number = 30): Promise<any> {
+        try {
+            const response = await fetch(`${BASE_URL}/stats?days=${days}`, {
+                headers: { 'Accept': 'application/json', ...(await authHeaders()) },
+            });
+
+            if (!response.ok) throw new Error(`Server Error ${response.status}`);
+            return await response.json();
+        } catch (error) {
+            console.error('Stats Error:', error);
+            throw error;
+        }
+    },
+
+    async getProductDetails(frontUri?: string | null, backUri?: string | null, scan?: ScanInfo): Promise<any> {
         try {
             const formData = new FormData();
 
@@ -139,7 +200,7 @@ export const VerificationService = {
             const response = await fetch(`${BASE_URL}/details`, {
                 method: 'POST',
                 body: formData,
-                headers: { 'Accept': 'application/json' },
+                headers: { 'Accept': 'application/json', ...(await authHeaders()), ...scanHeaders(scan) },
             });
 
             if (!response.ok) throw new Error(`Server Error ${response.status}`);